@@ -6,7 +6,7 @@ from clinvar_query.ClinVar_Site.routes.results import lookup_bp
 import os
 from clinvar_query.utils.paths import upload_folder, processed_folder
 from clinvar_query.utils.paths import error_folder, database_folder
-from clinvar_query.utils.paths import database_file
+from clinvar_query.utils.paths import database_file, panel_folder
 from clinvar_query.utils.database_initialisation import database_initialise
 
 
@@ -17,6 +17,7 @@ def create_app():
     os.makedirs(processed_folder, exist_ok=True)
     os.makedirs(error_folder, exist_ok=True)
     os.makedirs(database_folder, exist_ok=True)
+    os.makedirs(panel_folder, exist_ok=True)
 # register all configs
 
     patient_database = database_initialise(database_file)
@@ -26,6 +27,7 @@ def create_app():
     Webapp.config["processed_folder"] = processed_folder
     Webapp.config["error_folder"] = error_folder
     Webapp.config["database_folder"] = database_folder
+    Webapp.config["panel_folder"] = panel_folder
     Webapp.config["patient_database"] = patient_database
 
 
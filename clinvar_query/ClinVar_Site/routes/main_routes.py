@@ -1,4 +1,5 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, render_template, current_app
+from clinvar_query.modules.gene_panel import stored_panels
 
 
 main_bp = Blueprint("main", __name__)
@@ -18,6 +19,8 @@ def index():
 # Route for the upload file
 @main_bp.route("/upload")
 def upload_site():
-    return render_template("upload_site.html")
+    return render_template("upload_site.html",
+                           panels=stored_panels(
+                               current_app.config["panel_folder"]))
 
 
@@ -1,8 +1,10 @@
 
 from clinvar_query.utils.paths import processed_folder, error_folder, database_file
-from flask import Blueprint, render_template
-from clinvar_query.modules.patient_lookup import lookup
-from clinvar_query.modules.read_uploads import read_file
+from flask import Blueprint, render_template, request, jsonify
+from clinvar_query.modules.patient_lookup import latest_results_page, file_page
+from clinvar_query.modules.read_uploads import stream_file
+from clinvar_query.modules.filter_results import parse_filters
+from clinvar_query.utils.logger import logger
 
 lookup_bp = Blueprint("lookup", __name__)
 
@@ -18,33 +20,76 @@ with the latest patient shown first This can give
 scientists the chance to see if the number of variants match up
 while also showing what our inputs for the API should look like
 There is also a chance to have a look at why the data did not process properly
+
+Only the first page of each section is rendered with the page,
+the rest is fetched on demand from the /api routes as JSON
+Each response carries a "next" cursor which is passed back as ?after=
+Files are opened in windows of lines, see stream_file in read_uploads.py
+The latest results can be filtered by allele frequency, stars and
+classification, see filter_results.py
 """
 
 
 @lookup_bp.route("/results")
 def result():
-    latest_results = []
-    files = []
-    misaligned = []
-    database = database_file
-    latest_results, files, misaligned = lookup(latest_results,
-                                               files,
-                                               misaligned,
-                                               database,
-                                               process_folder=processed_folder,
-                                               err_folder=error_folder
-                                               )
+    try:
+        filters = parse_filters(request.args)
+    except ValueError:
+        logger.warning("Ignoring invalid result filters : {}"
+                       .format(request.args))
+        filters = {}
+
+    latest_results, latest_next = latest_results_page(database_file,
+                                                      filters=filters)
+    files, files_next = file_page(processed_folder)
+    misaligned, misaligned_next = file_page(error_folder)
 
     return render_template("result_site.html",
-                           latest=latest_results, files=files,
-                           misaligned=misaligned)
+                           filters=filters,
+                           latest=latest_results, latest_next=latest_next,
+                           files=files, files_next=files_next,
+                           misaligned=misaligned,
+                           misaligned_next=misaligned_next)
+
+
+@lookup_bp.route("/api/latest", methods=["GET"])
+def latest_api():
+    try:
+        filters = parse_filters(request.args)
+    except ValueError:
+        return jsonify(error="af_min, af_max and min_stars must be numbers"), 400
+
+    rows, next_cursor = latest_results_page(
+        database_file,
+        after=request.args.get("after"),
+        limit=request.args.get("limit", type=int),
+        filters=filters)
+    return jsonify(rows=[dict(row) for row in rows], next=next_cursor)
+
+
+@lookup_bp.route("/api/files", methods=["GET"])
+def files_api():
+    files, next_cursor = file_page(
+        processed_folder,
+        after=request.args.get("after"),
+        limit=request.args.get("limit", type=int))
+    return jsonify(files=files, next=next_cursor)
+
+
+@lookup_bp.route("/api/misaligned", methods=["GET"])
+def misaligned_api():
+    misaligned, next_cursor = file_page(
+        error_folder,
+        after=request.args.get("after"),
+        limit=request.args.get("limit", type=int))
+    return jsonify(files=misaligned, next=next_cursor)
 
 
 @lookup_bp.route("/view_file",  methods=["GET"])
 def processed():
-    return read_file(processed_folder, "fileprocess")
+    return stream_file(processed_folder, "fileprocess")
 
 
 @lookup_bp.route("/view_misalign",  methods=["GET"])
 def misaligned():
-    return read_file(error_folder, "filemisalign")
+    return stream_file(error_folder, "filemisalign")
@@ -1,6 +1,14 @@
 from clinvar_query.utils.paths import database_file
-from flask import Blueprint, render_template, request
-from clinvar_query.modules.search_results import search_results
+from flask import Blueprint, render_template, request, jsonify
+from clinvar_query.modules.search_results import (
+    search_results,
+    filter_variants,
+    search_conditions,
+    search_gene,
+    search_region,
+)
+from clinvar_query.modules.genomic_regions import parse_region
+from clinvar_query.modules.filter_results import parse_filters
 
 
 search_bp = Blueprint("search", __name__)
@@ -22,6 +30,9 @@ def search_site():
     Results in variant_info
     Variant_id     Chromosome  Hgnc_id     Gene_symbol     Mane_select
     12-40294866-G-T   12      HGNC:18618   LRRK2          NM_198578.4:c.2830G>T
+
+    A region, example: chr12:40,200,000-40,400,000
+    lists the annotated variants in the region instead
     """
 
     query_data = request.args.get("q", "")
@@ -34,11 +45,114 @@ def search_site():
                                results={})
 
     results = {}
-    results = search_results(database_file, query_data, results)
+    # a region such as chr12:40,200,000-40,400,000 lists the variants in it
+    try:
+        region = parse_region(query_data)
+    except ValueError as e:
+        return render_template("search_site.html",
+                               query_data=query_data,
+                               empty_query=False,
+                               region_error=str(e),
+                               results={})
+    if region:
+        rows, _ = search_region(database_file, region)
+        if rows:
+            results["variant_locations"] = {"columns": list(rows[0]),
+                                            "rows": rows}
+    else:
+        results = search_results(database_file, query_data, results)
 
     return render_template("search_site.html",
                            query_data=query_data,
                            empty_query=False,
                            results=results)
 # This is what the user enters into the search bar,
-# it is stripped of any whitespaces
\ No newline at end of file
+# it is stripped of any whitespaces
+
+
+@search_bp.route("/filter")
+def filter_site():
+    """Returns annotated variants matching the filters as JSON,
+    a page at a time, pass the "next" value back as ?after= for more
+    The input:
+    /search_site/filter?af_max=0.01&min_stars=2&classification=Pathogenic
+    The output:
+    {"rows": [{"variant_id": "6-162727667-A-G", ...}], "next": null}
+    """
+    try:
+        filters = parse_filters(request.args)
+    except ValueError:
+        return jsonify(error="af_min, af_max and min_stars must be numbers"), 400
+
+    rows, next_cursor = filter_variants(database_file, filters,
+                                        after=request.args.get("after"),
+                                        limit=request.args.get("limit",
+                                                               type=int))
+    return jsonify(rows=rows, next=next_cursor)
+
+
+@search_bp.route("/conditions")
+def condition_site():
+    """Returns the patients with variants linked to a condition as JSON,
+    matching each word of the query against the start of the words in
+    the condition names, pass the "next" value back as ?after= for more
+    The input:
+    /search_site/conditions?q=cardiomyo
+    The output:
+    {"rows": [{"condition": "Dilated cardiomyopathy 1A", ...}], "next": null}
+    """
+    query_data = request.args.get("q", "").strip()
+    if not query_data:
+        return jsonify(error="Enter a condition to search for"), 400
+
+    rows, next_cursor = search_conditions(database_file, query_data,
+                                          after=request.args.get("after"),
+                                          limit=request.args.get("limit",
+                                                                 type=int))
+    return jsonify(rows=rows, next=next_cursor)
+
+
+@search_bp.route("/gene/<gene>")
+def gene_site(gene):
+    """Returns the variants and patients for a gene as JSON, with the
+    number of each, the gene can be given by HGNC id, symbol or alias,
+    pass the "next" value back as ?after= for more
+    The input:
+    /search_site/gene/LRRK2
+    The output:
+    {"gene": {"hgnc_id": "HGNC:18618", "symbol": "LRRK2",
+              "variant_count": 1, "patient_count": 1},
+     "rows": [{"variant_id": "12-40294866-G-T", ...}], "next": null}
+    """
+    summary, rows, next_cursor = search_gene(database_file, gene,
+                                             after=request.args.get("after"),
+                                             limit=request.args.get("limit",
+                                                                    type=int))
+    if summary is None:
+        return jsonify(error="Gene {} not found".format(gene)), 404
+
+    return jsonify(gene=summary, rows=rows, next=next_cursor)
+
+
+@search_bp.route("/region")
+def region_site():
+    """Returns the annotated variants overlapping a region as JSON,
+    in order of position, pass the "next" value back as ?after= for more
+    The input:
+    /search_site/region?region=chr12:40,200,000-40,400,000
+    The output:
+    {"rows": [{"variant_id": "12-40367069-A-G", "start": 40367068, ...}],
+     "next": null}
+    """
+    try:
+        region = parse_region(request.args.get("region", ""))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if region is None:
+        return jsonify(error="Enter a region as chr:start-end"), 400
+
+    rows, next_cursor = search_region(database_file, region,
+                                      after=request.args.get("after"),
+                                      limit=request.args.get("limit",
+                                                             type=int))
+    return jsonify(rows=rows, next=next_cursor)
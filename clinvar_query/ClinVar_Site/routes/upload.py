@@ -1,11 +1,41 @@
 from flask import Blueprint, render_template, redirect, request, url_for, current_app
+from flask import jsonify
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
 from clinvar_query.utils.messages import message_output
 from clinvar_query.utils.paths import allowed_file, allowed_ext, validator_folder, clinvar_folder
+from clinvar_query.utils.paths import panel_ext
 from clinvar_query.modules.process_uploads import process_upload_file
+from clinvar_query.modules.gene_panel import load_panel, save_panel, stored_panels
+from clinvar_query.modules.batch_uploads import (
+    archive_uploads,
+    batch_progress,
+    batch_stems,
+    process_batch,
+    start_batch,
+)
+from clinvar_query.modules.chunked_uploads import (
+    cancel_chunked_upload,
+    finish_chunked_upload,
+    save_chunk,
+    start_chunked_upload,
+    upload_status,
+)
 from clinvar_query.modules.vv_variant_query import vv_variant_query
 from clinvar_query.modules.clinvar_api_query import process_clinvar
 from clinvar_query.modules.json_to_db import json_to_dir
+from clinvar_query.modules.clinvar_vcf_annotation import bulk_annotate_folder
+from clinvar_query.modules.staging_store import run_staged_pipeline
+from clinvar_query.modules.intermediate_archive import compact_intermediates
+from clinvar_query.utils.paths import processed_folder
+from clinvar_query.utils.settings import (
+    archive_ingested,
+    clinvar_vcf,
+    staging_store,
+    upload_chunk_size,
+)
 import threading
+import zipfile
 
 """
 This evalutes the file that has been uploaded to the site
@@ -22,18 +52,57 @@ a pipeline is run, which runs all the api queries along with writing data to dat
 The outcomes:
 Error site, this can have informative messages
 Upload success, this runs the pipeline and has informative messages depending on how the file was processed
+
+A gene panel can be uploaded as a BED file or picked from the stored panels,
+only the variants inside it are annotated and the upload success page shows
+how many were left out
+
+Large files can be sent to /upload/stream as the raw request body instead
+of a form, for example
+curl -T patient1.vcf "http://localhost:5000/upload/stream?filename=patient1.vcf"
+overwrite and a stored panel name can be given in the query string too.
+The body is read straight from the request stream, so the file is saved
+and parsed while it arrives rather than after the whole form is received
+
+Very large files can be sent in chunks which can be resumed (see
+chunked_uploads.py), the client
+POSTs /upload/chunked?filename=...&size=... to get an upload id
+PUTs each chunk as the body of /upload/chunked/<upload_id>/<index>
+GETs /upload/chunked/<upload_id> to see which chunks are still missing
+POSTs /upload/chunked/<upload_id>/finish?checksum=<sha256> when all are sent
+finishing redirects like the upload form does
+
+Many files (e.g. a plate of samples) can be sent at once to /upload/batch,
+as several "files" or one zip "archive" (see batch_uploads.py). They are
+processed at the same time and annotated as one batch job, the response
+lists how each file went and /upload/batch/<batch_id> reports progress
 """
 
 process_bp = Blueprint("process", __name__)
 
 one_task = threading.Lock()
 
+# each variant is one VariantValidator query and up to two ClinVar queries
+queries_per_variant = 3
+
 
-def run_pipeline():
+def run_pipeline(session=None, on_start=None):
+    # a batch job shares one requests session across all of its files
     with one_task:
-        vv_variant_query()
-        process_clinvar(validator_folder, clinvar_folder)
+        if on_start:
+            on_start()
+        # a local ClinVar VCF replaces the API queries when it is set
+        if clinvar_vcf:
+            bulk_annotate_folder(processed_folder, clinvar_vcf)
+            return
+        if staging_store:
+            run_staged_pipeline(processed_folder)
+            return
+        vv_variant_query(session=session)
+        process_clinvar(validator_folder, clinvar_folder, session=session)
         json_to_dir()
+        if archive_ingested:
+            compact_intermediates()
 
 
 @process_bp.route("/upload", methods=["GET", "POST"])
@@ -56,27 +125,214 @@ def upload_file():
         # Overwrite flag
         overwrite = request.form.get("overwrite", "").lower() in ("true", "on")
 
+        # Gene panel, an uploaded BED file is stored for next time
+        panel = None
+        panel_name = request.form.get("panel", "")
+        panel_file = request.files.get("panel_file")
+        if panel_file and panel_file.filename:
+            if not allowed_file(panel_file.filename, panel_ext):
+                return redirect(url_for("process.error_site",
+                                        key="unsupported_panel"))
+            try:
+                panel_name = save_panel(panel_file,
+                                        current_app.config['panel_folder'],
+                                        overwrite=overwrite)
+            except FileExistsError:
+                return redirect(url_for("process.error_site",
+                                        key="panel_exists",
+                                        panel=secure_filename(
+                                            panel_file.filename)))
+        if panel_name:
+            panel = load_panel(panel_name, current_app.config['panel_folder'])
+            if panel is None:
+                return redirect(url_for("process.error_site",
+                                        key="panel_error", panel=panel_name))
+
         # Call the module to process the file
         result = process_upload_file(
             file,
             current_app.config['upload_folder'],
             current_app.config['processed_folder'],
             current_app.config['error_folder'],
-            overwrite=overwrite
+            overwrite=overwrite,
+            panel=panel
         )
 
         # Redirect based on module result
-        return redirect(
-            url_for(
-                result["redirect_endpoint"],
-                key=result["message_params"]["message"],
-                file=result["message_params"]["file"]
-            )
-        )
+        return result_redirect(result)
 
     # GET request → render upload page
-    return render_template("upload_site.html")
+    return render_template("upload_site.html",
+                           panels=stored_panels(
+                               current_app.config['panel_folder']))
+
+
+
+def result_redirect(result):
+    message_params = dict(result["message_params"])
+    return redirect(
+        url_for(
+            result["redirect_endpoint"],
+            key=message_params.pop("message"),
+            **message_params
+        )
+    )
+
+
+@process_bp.route("/stream", methods=["POST", "PUT"])
+def stream_upload_file():
+    filename = request.args.get("filename", "")
+    if not filename:
+        return redirect(url_for("process.error_site", key="no_file"))
+    if not allowed_file(filename, allowed_ext):
+        return redirect(url_for("process.error_site",
+                                key="unsupported_file"))
+
+    overwrite = request.args.get("overwrite", "").lower() in ("true", "on")
+
+    # only stored gene panels can be picked for a streamed upload
+    panel = None
+    panel_name = request.args.get("panel", "")
+    if panel_name:
+        panel = load_panel(panel_name, current_app.config['panel_folder'])
+        if panel is None:
+            return redirect(url_for("process.error_site",
+                                    key="panel_error", panel=panel_name))
+
+    result = process_upload_file(
+        FileStorage(stream=request.stream, filename=filename),
+        current_app.config['upload_folder'],
+        current_app.config['processed_folder'],
+        current_app.config['error_folder'],
+        overwrite=overwrite,
+        panel=panel
+    )
+    return result_redirect(result)
+
+
+@process_bp.route("/chunked", methods=["POST"])
+def start_chunked():
+    filename = request.args.get("filename", "")
+    if not filename or not allowed_file(filename, allowed_ext):
+        return jsonify(error=message_output("unsupported_file")), 400
+
+    panel_name = request.args.get("panel", "")
+    if panel_name and load_panel(panel_name,
+                                 current_app.config['panel_folder']) is None:
+        return jsonify(error=message_output("panel_error",
+                                            panel=panel_name)), 400
+
+    try:
+        upload = start_chunked_upload(
+            filename,
+            request.args.get("size", ""),
+            request.args.get("chunk_size") or upload_chunk_size,
+            overwrite=request.args.get("overwrite", "").lower()
+            in ("true", "on"),
+            panel=panel_name,
+            folder=current_app.config['upload_folder'])
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(upload), 201
+
+
+@process_bp.route("/chunked/<upload_id>/<int:index>", methods=["PUT"])
+def send_chunk(upload_id, index):
+    try:
+        status = save_chunk(upload_id, index, request.get_data(),
+                            folder=current_app.config['upload_folder'])
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if status is None:
+        return jsonify(error="Upload {} not found".format(upload_id)), 404
+    return jsonify(status)
+
+
+@process_bp.route("/chunked/<upload_id>", methods=["GET", "DELETE"])
+def chunked_status(upload_id):
+    status = upload_status(upload_id)
+    if status is None:
+        return jsonify(error="Upload {} not found".format(upload_id)), 404
+    if request.method == "DELETE":
+        cancel_chunked_upload(upload_id,
+                              folder=current_app.config['upload_folder'])
+        return "", 204
+    return jsonify(status)
+
+
+@process_bp.route("/chunked/<upload_id>/finish", methods=["POST"])
+def finish_chunked(upload_id):
+    try:
+        result = finish_chunked_upload(
+            upload_id,
+            request.args.get("checksum", ""),
+            current_app.config['processed_folder'],
+            current_app.config['error_folder'],
+            folder=current_app.config['upload_folder'])
+    except ValueError:
+        return jsonify(error=message_output("checksum_missing")), 400
+    if result is None:
+        return jsonify(error="Upload {} not found".format(upload_id)), 404
+    return result_redirect(result)
+
+
+@process_bp.route("/batch", methods=["POST"])
+def upload_batch():
+    files = [file for file in request.files.getlist("files") if file.filename]
+    archive = request.files.get("archive")
+    if archive and archive.filename:
+        if not allowed_file(archive.filename, {"zip"}):
+            return jsonify(error=message_output("unsupported_archive")), 400
+        try:
+            files += archive_uploads(archive)
+        except zipfile.BadZipFile:
+            return jsonify(error=message_output("unsupported_archive")), 400
+        except ValueError as e:
+            return jsonify(error=message_output("archive_too_large",
+                                                reason=e)), 400
+    if not files:
+        return jsonify(error=message_output("no_file")), 400
+
+    # only stored gene panels can be picked for a batch
+    panel = None
+    panel_name = request.form.get("panel", "")
+    if panel_name:
+        panel = load_panel(panel_name, current_app.config['panel_folder'])
+        if panel is None:
+            return jsonify(error=message_output("panel_error",
+                                                panel=panel_name)), 400
+
+    results = process_batch(
+        files,
+        current_app.config['upload_folder'],
+        current_app.config['processed_folder'],
+        current_app.config['error_folder'],
+        overwrite=request.form.get("overwrite", "").lower() in ("true", "on"),
+        panel=panel
+    )
+
+    rows = []
+    for filename, result in results:
+        message_params = dict(result["message_params"])
+        rows.append({
+            "file": filename,
+            "processed": result["redirect_endpoint"]
+            == "process.upload_success",
+            "message": message_output(message_params.pop("message"),
+                                      **message_params),
+        })
+
+    stems = batch_stems(results)
+    batch_id = start_batch(stems, run_pipeline) if stems else None
+    return jsonify(batch_id=batch_id, files=rows), 202
+
 
+@process_bp.route("/batch/<batch_id>")
+def batch_status(batch_id):
+    progress = batch_progress(batch_id)
+    if progress is None:
+        return jsonify(error="Batch {} not found".format(batch_id)), 404
+    return jsonify(progress)
 
 
 @process_bp.route("/upload_success")
@@ -85,7 +341,22 @@ def upload_success():
     kwargs = request.args.to_dict()
     kwargs.pop("key", None)
     message = message_output(key, **kwargs)
-    resp =  render_template("upload_success.html", message=message)
+    panel_message = None
+    if "panel" in kwargs:
+        # the counts come from the query string, so a summary is only
+        # shown when they can be read
+        try:
+            total, kept = int(kwargs["total"]), int(kwargs["kept"])
+        except (KeyError, ValueError):
+            total = kept = None
+        if total is not None and 0 <= kept <= total:
+            skipped = total - kept
+            kwargs.update(total=total, kept=kept)
+            panel_message = message_output("panel_summary", skipped=skipped,
+                                           queries_saved=skipped * queries_per_variant,
+                                           **kwargs)
+    resp =  render_template("upload_success.html", message=message,
+                            panel_message=panel_message)
 
     thread = threading.Thread(target=run_pipeline)
     thread.daemon = True
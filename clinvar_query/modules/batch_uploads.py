@@ -0,0 +1,264 @@
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import requests
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
+from clinvar_query.utils.logger import logger
+from clinvar_query.utils.paths import (
+    allowed_ext,
+    allowed_file,
+    clinvar_folder,
+    validator_folder,
+)
+from clinvar_query.utils.settings import (
+    batch_expiry,
+    batch_workers,
+    max_archive_file_size,
+    max_archive_files,
+    max_archive_size,
+)
+from clinvar_query.modules.compressed_files import stored_file
+from clinvar_query.modules.insert_annotated_results import is_already_ingested
+from clinvar_query.modules.intermediate_archive import is_archived
+from clinvar_query.modules.process_uploads import process_upload_file
+
+"""
+Uploading many files at once, e.g. every sample from a plate.
+
+The files are sent in one request, as separate files or in a zip archive.
+process_batch parses them at the same time in a pool of batch_workers
+threads (set in utils/settings.py), each one goes through
+process_upload_file as a single upload would. A title (the file name
+without its extension) that is in the batch twice is only processed the
+first time.
+
+The files which were processed are then annotated as one batch job,
+start_batch runs the pipeline once for all of them in a thread. The job
+shares one requests session (so connections to VariantValidator and NCBI
+are kept open) and the stages only query a variant found in many samples
+once. The job waits for any pipeline already running, as single uploads do.
+
+batch_progress reports how far the job has got, counting the files which
+have been validated, annotated with ClinVar and added to the database.
+Batches are kept in memory, so progress is lost when the app restarts,
+the files themselves are still annotated by the next pipeline run.
+Finished batches are forgotten batch_expiry seconds after they finish.
+
+The number and sizes of the files in a zip archive are checked against
+the limits in settings.py before any of them are unpacked.
+"""
+
+# batch jobs started since the app was started
+batches = {}
+batches_lock = threading.Lock()
+
+
+def archive_uploads(archive):
+    """
+    The files in a zip archive, as uploads.
+
+    Returns
+    -------
+    list of FileStorage
+        One for each file in the archive, read straight from it.
+
+    Raises
+    ------
+    zipfile.BadZipFile
+        If the archive is not a zip file.
+    ValueError
+        If it has more files, or bigger ones, than the limits allow.
+    """
+    bundle = zipfile.ZipFile(archive.stream)
+    members = [member for member in bundle.infolist()
+               if not member.is_dir() and
+               not Path(member.filename).name.startswith(".")]
+
+    # a file is never unpacked past the size the archive lists for it
+    if len(members) > max_archive_files:
+        raise ValueError(f"it has more than {max_archive_files} files")
+    for member in members:
+        if member.file_size > max_archive_file_size:
+            raise ValueError(f"{Path(member.filename).name} is over "
+                             f"{max_archive_file_size} bytes")
+    if sum(member.file_size for member in members) > max_archive_size:
+        raise ValueError(f"its files are over {max_archive_size} bytes "
+                         "in all")
+
+    return [FileStorage(stream=bundle.open(member),
+                        filename=Path(member.filename).name)
+            for member in members]
+
+
+def process_one(file, folder, processed_folder, error_folder, overwrite,
+                panel):
+    try:
+        return process_upload_file(file, folder, processed_folder,
+                                   error_folder, overwrite=overwrite,
+                                   panel=panel)
+    except Exception:
+        logger.exception(f"Processing {file.filename} in a batch failed")
+        return {"redirect_endpoint": "process.error_site",
+                "message_params": {"message": "unknown_error",
+                                   "file": file.filename}}
+    finally:
+        file.close()
+
+
+def process_batch(files, folder, processed_folder, error_folder,
+                  overwrite=False, panel=None, workers=batch_workers):
+    """
+    Process the files of a batch upload at the same time.
+
+    Returns
+    -------
+    list of tuple of (str, dict)
+        The name of each file with its result, as process_upload_file
+        returns, in the order the files were given.
+    """
+    results = [None] * len(files)
+    seen = set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for number, file in enumerate(files):
+            # the title is the patient, a.csv and a.vcf would both be
+            # written to a_processed.txt
+            title = Path(secure_filename(file.filename)).stem
+            if not allowed_file(file.filename, allowed_ext):
+                message = "unsupported_file"
+            elif title in seen:
+                message = "batch_duplicate_name"
+            else:
+                seen.add(title)
+                futures[number] = pool.submit(process_one, file, folder,
+                                              processed_folder, error_folder,
+                                              overwrite, panel)
+                continue
+            results[number] = {"redirect_endpoint": "process.error_site",
+                               "message_params": {"message": message,
+                                                  "file": file.filename}}
+        for number, future in futures.items():
+            results[number] = future.result()
+
+    logger.info(f"Processed a batch of {len(files)} files")
+    return [(file.filename, result) for file, result in zip(files, results)]
+
+
+def batch_stems(results):
+    """Stems of the processed files a batch is waiting on"""
+    stems = []
+    for filename, result in results:
+        if result["redirect_endpoint"] != "process.upload_success":
+            continue
+        stems.append(f"{Path(secure_filename(filename)).stem}_processed")
+    return list(dict.fromkeys(stems))
+
+
+def run_batch(batch, pipeline):
+    batch["status"] = "waiting"
+    try:
+        with requests.Session() as session:
+            pipeline(session=session,
+                     on_start=lambda: batch.update(status="running",
+                                                   started_at=time.time()))
+    except Exception:
+        logger.exception(f"Batch {batch['batch_id']} failed")
+        batch["status"] = "failed"
+    else:
+        batch["status"] = "finished"
+    batch["finished_at"] = time.time()
+
+
+def forget_finished_batches(expiry=batch_expiry):
+    # called with batches_lock held
+    expired = [batch_id for batch_id, batch in batches.items()
+               if batch["finished_at"] is not None and
+               time.time() - batch["finished_at"] > expiry]
+    for batch_id in expired:
+        del batches[batch_id]
+    return expired
+
+
+def start_batch(stems, pipeline):
+    """
+    Run the pipeline once for a batch of processed files.
+
+    Parameters
+    ----------
+    stems : list of str
+        The processed files in the batch, from batch_stems.
+    pipeline : callable
+        Called with a shared requests session and an on_start callback
+        for when it stops waiting for other runs, e.g. run_pipeline.
+
+    Returns
+    -------
+    str
+        The batch id for batch_progress.
+    """
+    batch_id = uuid.uuid4().hex
+    batch = {"batch_id": batch_id, "stems": stems, "status": "queued",
+             "queued_at": time.time(), "started_at": None,
+             "finished_at": None}
+    with batches_lock:
+        forget_finished_batches()
+        batches[batch_id] = batch
+    thread = threading.Thread(target=run_batch, args=(batch, pipeline))
+    thread.daemon = True
+    thread.start()
+    return batch_id
+
+
+def stem_stage(stem):
+    """How far one processed file has got through the pipeline"""
+    clinvar_file = stored_file(Path(clinvar_folder) / f"{stem}.json")
+    if clinvar_file:
+        if is_already_ingested(f"{stem}.json",
+                               Path(clinvar_file).stat().st_mtime):
+            return "ingested"
+        return "annotated"
+    # files are only archived once they are in the database
+    if is_archived("clinvar", stem):
+        return "ingested"
+    if stored_file(Path(validator_folder) / f"{stem}.json") or \
+            is_archived("validator", stem):
+        return "validated"
+    return "parsed"
+
+
+def batch_progress(batch_id):
+    """
+    How far a batch job has got.
+
+    Returns
+    -------
+    dict or None
+        The job status with the number of files in the batch and how many
+        have been validated, annotated and ingested (a file counts for
+        every stage it has passed). None for an unknown batch.
+    """
+    with batches_lock:
+        batch = batches.get(batch_id)
+        if batch is None:
+            return None
+        # the job thread changes these, they are read before the files so
+        # a finished job is never reported with counts from before it ended
+        state = {key: batch[key] for key in
+                 ["status", "queued_at", "started_at", "finished_at"]}
+
+    stages = ["parsed", "validated", "annotated", "ingested"]
+    counts = dict.fromkeys(stages, 0)
+    for stem in batch["stems"]:
+        reached = stages.index(stem_stage(stem))
+        for stage in stages[:reached + 1]:
+            counts[stage] += 1
+
+    return {"batch_id": batch_id, "status": state["status"],
+            "files": len(batch["stems"]), **counts,
+            "queued_at": state["queued_at"],
+            "started_at": state["started_at"],
+            "finished_at": state["finished_at"]}
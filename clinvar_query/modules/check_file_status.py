@@ -1,6 +1,7 @@
 from pathlib import Path
 from clinvar_query.modules.parser import parser
 from clinvar_query.utils.logger import logger
+from clinvar_query.utils.paths import database_file
 from clinvar_query.modules.save_function import save_output_to_file
 
 """Check the file extension and process accordingly.
@@ -14,10 +15,16 @@ This is then fed to the save_output_to_file module
 
 this will return 
 the saved_file, the misaligned_file and the status of the file
+
+A gene panel and summary dictionary are passed on to the parser
+If the upload was already parsed as it arrived (see process_uploads.py)
+the parsed data is passed in and the file is not read again
 """
 
 
-def app_file_check(file_path,  processed_folder, error_folder, overwrite=False):
+def app_file_check(file_path,  processed_folder, error_folder, overwrite=False,
+                   panel=None, summary=None, parsed=None,
+                   database=database_file):
 
 # initialising required variables
     file_end = Path(file_path).suffix.lower()
@@ -30,7 +37,9 @@ def app_file_check(file_path,  processed_folder, error_folder, overwrite=False):
         # logic for saving file depending on the conditions
         if file_end == ".csv" or file_end == ".vcf":
             # this assignes the data to the output of the parser
-            processed_data, misaligned_data = parser(file_path)
+            if parsed is None:
+                parsed = parser(file_path, panel=panel, summary=summary)
+            processed_data, misaligned_data = parsed
     # if the file is not a csv or vcf then it will
     # output that there is an unsupported file type
     except Exception:
@@ -39,12 +48,14 @@ def app_file_check(file_path,  processed_folder, error_folder, overwrite=False):
     saved_file, status = save_output_to_file(processed_data,
                                                 title,
                                                 folder=processed_folder,
-                                                overwrite=overwrite)
+                                                overwrite=overwrite,
+                                                database=database)
 
     if misaligned_data:
         misaligned_file, status = save_output_to_file(misaligned_data,
                                                         misaligned_title,
                                                         folder=error_folder,
-                                                        overwrite=overwrite)
+                                                        overwrite=overwrite,
+                                                        database=database)
 
     return saved_file, misaligned_file, status
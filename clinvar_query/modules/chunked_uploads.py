@@ -0,0 +1,470 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from werkzeug.datastructures import FileStorage
+from werkzeug.utils import secure_filename
+from clinvar_query.utils.logger import logger
+from clinvar_query.utils.paths import database_file, panel_folder, upload_folder
+from clinvar_query.utils.settings import (
+    chunked_upload_expiry,
+    max_chunked_upload_size,
+    max_upload_chunk_size,
+    max_upload_chunks,
+    upload_chunk_size,
+)
+from clinvar_query.modules.gene_panel import load_panel
+from clinvar_query.modules.process_uploads import (
+    parse_upload,
+    process_parsed_upload,
+)
+from clinvar_query.modules.upload_index import PART_SUFFIX, text_lines
+
+"""
+Resumable uploads for very large files, sent in chunks.
+
+A client starts an upload with the file name and size and gets back an
+upload id and the chunk size. It then sends chunk 0, 1, 2 ... in any
+order, each one is written straight to its place in
+upload_folder/<upload_id>.part and recorded in the upload_chunks table.
+If the connection drops, upload_status lists the chunks still missing so
+only those are sent again. Finishing the upload checks the sha256 the
+client gives against the file and then processes it as any other upload
+(see process_uploads.py).
+
+The file does not wait to be finished before it is parsed. A thread for
+each upload reads the chunks at the start of the file which have all
+arrived (the prefix), hashing and parsing them, and waits for the next
+chunk in line. When the last chunk lands only the end of the file is left
+to parse. If the app is restarted the thread is started again with the
+next chunk and reads the prefix back from the file. A chunk which the
+thread may already have read being sent again with other bytes starts it
+over from the beginning of the file.
+
+The size of a file and its chunks are limited in settings.py. Uploads
+which nothing has been sent to for chunked_upload_expiry seconds are
+removed when the next upload is started, with their .part file and
+parser thread.
+
+The upload_sessions and upload_chunks tables are kept in the app database,
+both are cleared when the upload is finished or cancelled.
+"""
+
+chunked_schema = """
+    CREATE TABLE IF NOT EXISTS upload_sessions (
+        upload_id TEXT PRIMARY KEY,
+        filename TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        chunk_size INTEGER NOT NULL,
+        overwrite INTEGER DEFAULT 0,
+        panel TEXT,
+        started_at REAL
+    );
+
+    CREATE TABLE IF NOT EXISTS upload_chunks (
+        upload_id TEXT,
+        chunk_index INTEGER,
+        size INTEGER,
+        PRIMARY KEY (upload_id, chunk_index)
+    ) WITHOUT ROWID;
+"""
+
+# the prefix parser of each upload, since the app was started
+parsers = {}
+parsers_lock = threading.Lock()
+
+
+def connect_chunked(database):
+    con = sqlite3.connect(database)
+    con.row_factory = sqlite3.Row
+    con.executescript(chunked_schema)
+    return con
+
+
+def chunk_count(session):
+    return -(-session["size"] // session["chunk_size"])
+
+
+def chunk_bounds(session, index):
+    """Where a chunk starts in the file and how long it must be"""
+    start = index * session["chunk_size"]
+    return start, min(session["chunk_size"], session["size"] - start)
+
+
+def read_session(con, upload_id):
+    row = con.execute("SELECT * FROM upload_sessions WHERE upload_id = ?",
+                      (upload_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def received_chunks(con, upload_id):
+    return [row[0] for row in con.execute(
+        """SELECT chunk_index FROM upload_chunks WHERE upload_id = ?
+        ORDER BY chunk_index""", (upload_id,))]
+
+
+def prefix_size(session, received):
+    """Bytes at the start of the file which have all arrived"""
+    chunks = 0
+    for index in received:
+        if index != chunks:
+            break
+        chunks += 1
+    return min(chunks * session["chunk_size"], session["size"])
+
+
+def start_chunked_upload(filename, size, chunk_size=upload_chunk_size,
+                         overwrite=False, panel=None, folder=upload_folder,
+                         database=database_file):
+    """
+    Start a chunked upload.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the file being uploaded.
+    size : int
+        Size of the whole file in bytes.
+    chunk_size : int, optional
+        Size of every chunk but the last.
+    overwrite : bool, optional
+        Overwrite the processed file if there is one already.
+    panel : str, optional
+        Name of a stored gene panel to filter the variants with.
+
+    Returns
+    -------
+    dict
+        The upload_id, chunk_size and number of chunks to send.
+
+    Raises
+    ------
+    ValueError
+        If the size or chunk size are not usable or are over the limits
+        in settings.py.
+    """
+    size, chunk_size = int(size), int(chunk_size)
+    if size < 0 or chunk_size <= 0:
+        raise ValueError("size must be 0 or more and chunk_size more than 0")
+    if size > max_chunked_upload_size:
+        raise ValueError(f"files over {max_chunked_upload_size} bytes "
+                         "cannot be uploaded")
+    if chunk_size > max_upload_chunk_size:
+        raise ValueError(f"chunk_size can be {max_upload_chunk_size} "
+                         "bytes at most")
+    if chunk_count({"size": size, "chunk_size": chunk_size}) > \
+            max_upload_chunks:
+        raise ValueError(f"the file would be sent in more than "
+                         f"{max_upload_chunks} chunks, use a bigger "
+                         "chunk_size")
+
+    expire_chunked_uploads(folder, database)
+    upload_id = uuid.uuid4().hex
+    os.makedirs(folder, exist_ok=True)
+    # the file is made at its full size, chunks are written into place
+    with open(os.path.join(folder, f"{upload_id}{PART_SUFFIX}"), "wb") as f:
+        f.truncate(size)
+
+    con = connect_chunked(database)
+    try:
+        with con:
+            con.execute(
+                """INSERT INTO upload_sessions
+                (upload_id, filename, size, chunk_size, overwrite, panel,
+                 started_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (upload_id, secure_filename(filename), size, chunk_size,
+                 int(bool(overwrite)), panel or None, time.time()))
+    finally:
+        con.close()
+
+    logger.info(f"Started chunked upload {upload_id} for {filename} "
+                f"({size} bytes)")
+    session = {"size": size, "chunk_size": chunk_size}
+    return {"upload_id": upload_id, "chunk_size": chunk_size,
+            "chunks": chunk_count(session)}
+
+
+def expire_chunked_uploads(folder=upload_folder, database=database_file,
+                           expiry=chunked_upload_expiry):
+    """
+    Remove the uploads nothing has been sent to for expiry seconds.
+
+    Returns
+    -------
+    list of str
+        The upload ids which were removed.
+    """
+    con = connect_chunked(database)
+    try:
+        sessions = con.execute(
+            "SELECT upload_id, started_at FROM upload_sessions").fetchall()
+    finally:
+        con.close()
+
+    # every chunk written updates the .part file
+    expired = []
+    for upload_id, started_at in sessions:
+        try:
+            last_sent = os.stat(os.path.join(
+                folder, f"{upload_id}{PART_SUFFIX}")).st_mtime
+        except OSError:
+            last_sent = started_at or 0
+        if time.time() - max(last_sent, started_at or 0) > expiry:
+            cancel_chunked_upload(upload_id, folder, database)
+            expired.append(upload_id)
+    if expired:
+        logger.info(f"Removed {len(expired)} expired chunked uploads")
+    return expired
+
+
+def prefix_chunks(parser, chunk_size=upload_chunk_size):
+    """Read the prefix of an upload as it grows, hashing it as it is read"""
+    position = 0
+    # unbuffered, a buffer could hold bytes from before a chunk arrived
+    with open(parser["path"], "rb", buffering=0) as f:
+        while True:
+            with parser["condition"]:
+                while position >= parser["prefix"] and not parser["closed"]:
+                    parser["condition"].wait()
+                end = parser["prefix"]
+            if position >= end:
+                return
+            f.seek(position)
+            while position < end:
+                chunk = f.read(min(chunk_size, end - position))
+                if not chunk:
+                    return
+                parser["digest"].update(chunk)
+                position += len(chunk)
+                yield chunk
+
+
+def run_parser(parser):
+    try:
+        undecodable = []
+        lines = text_lines(prefix_chunks(parser), undecodable)
+        parser["parsed"] = parse_upload(lines, parser["filename"],
+                                        panel=parser["panel"],
+                                        summary=parser["summary"],
+                                        undecodable=undecodable)
+    except Exception:
+        logger.exception(f"Parsing chunked upload {parser['path']} failed")
+
+
+def prefix_parser(upload_id, session, folder):
+    """The parser thread of an upload, started if it is not running"""
+    with parsers_lock:
+        parser = parsers.get(upload_id)
+        if parser is None:
+            panel = load_panel(session["panel"], panel_folder) \
+                if session["panel"] else None
+            parser = {"path": os.path.join(folder,
+                                           f"{upload_id}{PART_SUFFIX}"),
+                      "filename": session["filename"],
+                      "panel": panel,
+                      "summary": {},
+                      "digest": hashlib.sha256(),
+                      "parsed": None,
+                      "prefix": 0,
+                      "closed": False,
+                      "condition": threading.Condition()}
+            parser["thread"] = threading.Thread(target=run_parser,
+                                                args=(parser,), daemon=True)
+            parser["thread"].start()
+            parsers[upload_id] = parser
+    return parser
+
+
+def advance_parser(parser, prefix):
+    with parser["condition"]:
+        parser["prefix"] = max(parser["prefix"], prefix)
+        parser["condition"].notify_all()
+
+
+def close_parser(upload_id):
+    with parsers_lock:
+        parser = parsers.pop(upload_id, None)
+    if parser is not None:
+        with parser["condition"]:
+            parser["closed"] = True
+            parser["condition"].notify_all()
+        parser["thread"].join()
+    return parser
+
+
+def save_chunk(upload_id, index, data, folder=upload_folder,
+               database=database_file):
+    """
+    Write one chunk of an upload into place.
+    A chunk sent again (e.g. after a retry) is written over the first.
+
+    Returns
+    -------
+    dict or None
+        The upload status (see upload_status), None if there is no
+        upload with that id.
+
+    Raises
+    ------
+    ValueError
+        If the chunk index is out of range or the chunk is the wrong size.
+    """
+    con = connect_chunked(database)
+    try:
+        session = read_session(con, upload_id)
+        if session is None:
+            return None
+        if not 0 <= index < chunk_count(session):
+            raise ValueError(f"chunk {index} is out of range, the upload "
+                             f"has {chunk_count(session)} chunks")
+        start, length = chunk_bounds(session, index)
+        if len(data) != length:
+            raise ValueError(f"chunk {index} should be {length} bytes, "
+                             f"{len(data)} were sent")
+
+        with open(os.path.join(folder, f"{upload_id}{PART_SUFFIX}"),
+                  "r+b") as f:
+            # the parser may have read this chunk already, if it has
+            # changed the parser starts over
+            with parsers_lock:
+                parser = parsers.get(upload_id)
+            if parser is not None and start < parser["prefix"]:
+                f.seek(start)
+                if f.read(length) != data:
+                    logger.warning(f"Chunk {index} of upload {upload_id} "
+                                   "changed after it was parsed")
+                    close_parser(upload_id)
+            f.seek(start)
+            f.write(data)
+        with con:
+            con.execute(
+                """INSERT OR REPLACE INTO upload_chunks
+                (upload_id, chunk_index, size) VALUES (?, ?, ?)""",
+                (upload_id, index, length))
+        received = received_chunks(con, upload_id)
+    finally:
+        con.close()
+
+    # the parser moves on as far as the chunks have all arrived
+    advance_parser(prefix_parser(upload_id, session, folder),
+                   prefix_size(session, received))
+    return status_of(upload_id, session, received)
+
+
+def status_of(upload_id, session, received):
+    missing = sorted(set(range(chunk_count(session))) - set(received))
+    return {"upload_id": upload_id, "filename": session["filename"],
+            "size": session["size"], "chunk_size": session["chunk_size"],
+            "received": len(received), "missing": missing}
+
+
+def upload_status(upload_id, database=database_file):
+    """
+    How far an upload has got, so it can be carried on after a failure.
+
+    Returns
+    -------
+    dict or None
+        The file name, size, chunk size, number of chunks received and the
+        missing chunk indexes. None if there is no upload with that id.
+    """
+    con = connect_chunked(database)
+    try:
+        session = read_session(con, upload_id)
+        if session is None:
+            return None
+        return status_of(upload_id, session, received_chunks(con, upload_id))
+    finally:
+        con.close()
+
+
+def forget_session(upload_id, database):
+    con = connect_chunked(database)
+    try:
+        with con:
+            con.execute("DELETE FROM upload_chunks WHERE upload_id = ?",
+                        (upload_id,))
+            con.execute("DELETE FROM upload_sessions WHERE upload_id = ?",
+                        (upload_id,))
+    finally:
+        con.close()
+
+
+def cancel_chunked_upload(upload_id, folder=upload_folder,
+                          database=database_file):
+    """Stop an upload and remove what has been sent of it"""
+    close_parser(upload_id)
+    forget_session(upload_id, database)
+    try:
+        os.remove(os.path.join(folder, f"{upload_id}{PART_SUFFIX}"))
+    except OSError:
+        pass
+    logger.info(f"Cancelled chunked upload {upload_id}")
+
+
+def finish_chunked_upload(upload_id, checksum, processed_folder,
+                          error_folder, folder=upload_folder,
+                          database=database_file):
+    """
+    Check a finished upload against its sha256 and process it.
+
+    Returns
+    -------
+    dict or None
+        The redirect endpoint and message parameters, as
+        process_upload_file returns. An upload with missing chunks is
+        kept so they can still be sent, one which does not match the
+        checksum is removed. None if there is no upload with that id.
+
+    Raises
+    ------
+    ValueError
+        If no checksum is given, the upload is kept.
+    """
+    if not checksum:
+        raise ValueError("a sha256 checksum is needed to finish the upload")
+    con = connect_chunked(database)
+    try:
+        session = read_session(con, upload_id)
+        received = received_chunks(con, upload_id) if session else []
+    finally:
+        con.close()
+    if session is None:
+        return None
+
+    file = FileStorage(filename=session["filename"])
+    missing = chunk_count(session) - len(received)
+    if missing:
+        logger.warning(f"Chunked upload {upload_id} finished with "
+                       f"{missing} chunks missing")
+        return {"redirect_endpoint": "process.error_site",
+                "message_params": {"message": "upload_incomplete",
+                                   "file": file.filename,
+                                   "missing": missing}}
+
+    # an empty file has no chunks, so its parser is started here
+    parser = prefix_parser(upload_id, session, folder)
+    advance_parser(parser, session["size"])
+    close_parser(upload_id)
+
+    content_hash = parser["digest"].hexdigest()
+    if content_hash != checksum.lower():
+        logger.error(f"Chunked upload {upload_id} does not match "
+                     "its checksum")
+        cancel_chunked_upload(upload_id, folder, database)
+        return {"redirect_endpoint": "process.error_site",
+                "message_params": {"message": "checksum_mismatch",
+                                   "file": file.filename}}
+
+    upload_path = os.path.join(folder, session["filename"])
+    os.replace(parser["path"], f"{upload_path}{PART_SUFFIX}")
+    forget_session(upload_id, database)
+    logger.info(f"Chunked upload {upload_id} finished as {upload_path}")
+    return process_parsed_upload(file, upload_path, content_hash,
+                                 parser["parsed"], parser["summary"],
+                                 processed_folder, error_folder,
+                                 overwrite=bool(session["overwrite"]),
+                                 panel=parser["panel"])
@@ -10,6 +10,9 @@ summary metadata via the NCBI E-utilities API.
 
 Input variants are read from JSON files produced by a prior validation
 step, and results are written to a corresponding output directory.
+Only the ClinVar fields the database needs are written (see
+response_projection.py), the full summaries are archived when raw
+archiving is switched on.
 
 Notes
 -----
@@ -17,13 +20,32 @@ Notes
 - Network or parsing errors are logged and handled gracefully.
 """
 
-import json
 import requests
 import time
 import os
 from pathlib import Path
 from clinvar_query.utils.logger import logger
 from clinvar_query.utils.paths import validator_folder, clinvar_folder
+from clinvar_query.modules.compressed_files import compress_file, stored_stems
+from clinvar_query.modules.intermediate_archive import is_archived
+from clinvar_query.modules.incremental_update import (
+    previous_records,
+    remove_old_output,
+    reuse_record,
+)
+from clinvar_query.modules.json_records import (
+    read_records,
+    open_records,
+    write_record,
+    finish_records,
+    discard_records,
+)
+from clinvar_query.modules.response_projection import (
+    get_gene_info,
+    project_esummary,
+    open_raw_archive,
+    archive_response,
+)
 
 # ----------------- NCBI E-utilities URLs -----------------
 # Base endpoints for searching ClinVar and retrieving summary metadata
@@ -32,7 +54,7 @@ ESEARCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
 
 
 # ----------------- Functions -----------------
-def search_clinvar(hgvs: str) -> list:
+def search_clinvar(hgvs: str, session=None) -> list:
     ESUMMARY_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
     ESEARCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
     """
@@ -45,6 +67,8 @@ def search_clinvar(hgvs: str) -> list:
         ----------
         hgvs : str
             HGVS string representing a genomic variant (e.g., g.HGVS).
+        session : requests.Session, optional
+            Shared connection pool, ``requests.get`` is used without one.
 
         Returns
         -------
@@ -61,7 +85,7 @@ def search_clinvar(hgvs: str) -> list:
     params = {"db": "clinvar", "term": hgvs, "retmode": "json"}
 
     try:
-        response = requests.get(ESEARCH_URL, params=params)
+        response = (session or requests).get(ESEARCH_URL, params=params)
         response.raise_for_status()
         data = response.json()
         # Extract list of ClinVar IDs from the JSON response
@@ -71,7 +95,7 @@ def search_clinvar(hgvs: str) -> list:
         return []
 
 
-def get_esummary(clinvar_ids: list) -> dict:
+def get_esummary(clinvar_ids: list, session=None) -> dict:
     ESUMMARY_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
 
     """
@@ -84,6 +108,8 @@ def get_esummary(clinvar_ids: list) -> dict:
         ----------
         clinvar_ids : list of str
             List of ClinVar RCV IDs to retrieve summaries for.
+        session : requests.Session, optional
+            Shared connection pool, ``requests.get`` is used without one.
 
         Returns
         -------
@@ -102,14 +128,71 @@ def get_esummary(clinvar_ids: list) -> dict:
 
     params = {"db": "clinvar", "id": ",".join(clinvar_ids), "retmode": "json"}
     try:
-        response = requests.get(ESUMMARY_URL, params=params)
+        response = (session or requests).get(ESUMMARY_URL, params=params)
         response.raise_for_status()
         return response.json().get("result", {})
     except Exception as e:
         logger.error(f"Error getting esummary for IDs {clinvar_ids}: {e}")
         return {}
 
-def process_clinvar(input_dir, output_dir):
+def annotate_entry(entry, archive=None, session=None):
+    """
+        Search ClinVar for one validated variant record.
+
+        Parameters
+        ----------
+        entry : dict
+            A record from the validator files.
+        archive : file, optional
+            Raw response archive from ``open_raw_archive``.
+        session : requests.Session, optional
+            Shared connection pool for the ClinVar queries.
+
+        Returns
+        -------
+        dict or None
+            The ClinVar result, or None if the record has no variant or
+            g.HGVS to search with.
+        """
+    variant_str = entry.get("variant")
+    if not variant_str:
+        logger.warning("Variant entry missing 'variant' field, skipping.")
+        return None
+
+    # Compact and locally described entries carry the g_hgvs
+    # directly, older files hold the full VariantFormatter result
+    try:
+        variant_result = entry["result"][variant_str][variant_str]
+        g_hgvs = variant_result.get("g_hgvs")
+    except KeyError:
+        variant_result = {}
+        g_hgvs = entry.get("g_hgvs")
+    gene_info = get_gene_info(variant_result) or entry.get("gene_info")
+
+    if not g_hgvs:
+        logger.warning(f"No g_hgvs found for {variant_str}, skipping.")
+        return None
+
+    # Search ClinVar using HGVS notation
+    logger.info(f"Searching ClinVar for HGVS: {g_hgvs}")
+    clinvar_ids = search_clinvar(g_hgvs, session)
+    summary = get_esummary(clinvar_ids, session)
+    archive_response(archive, variant_str, summary)
+
+    result = {
+        "variant": variant_str,
+        "g_hgvs": g_hgvs,
+        "gene_info": gene_info,
+        "clinvar_ids": clinvar_ids,
+        "esummary": project_esummary(summary)
+    }
+    # samples carrying the variant in multi-sample files
+    if entry.get("samples"):
+        result["samples"] = entry["samples"]
+    return result
+
+
+def process_clinvar(input_dir, output_dir, session=None):
     """
         Process validated variant JSON files and annotate them with ClinVar data.
 
@@ -117,7 +200,8 @@ def process_clinvar(input_dir, output_dir):
         - Extract g.HGVS notations for each variant
         - Query ClinVar for matching RCV IDs
         - Fetch summary metadata for each RCV
-        - Write results to a corresponding output JSON file
+        - Write each result as a JSON line to the output file with the
+          same name, read and written a record at a time
 
         Parameters
         ----------
@@ -125,10 +209,16 @@ def process_clinvar(input_dir, output_dir):
             Directory containing validated variant JSON files.
         output_dir : str or pathlib.Path
             Directory where ClinVar-annotated JSON files will be written.
+        session : requests.Session, optional
+            Connection pool shared by every query, e.g. for a batch job.
 
         Notes
         -----
-        - Files already present in the output directory are skipped.
+        - Files already present in the output directory are skipped,
+          unless the input file has changed since, then only the
+          variants which were added are searched for.
+        - A variant found in more than one file is only searched for once
+          per run, the result is reused.
         - A small delay is inserted between API calls to comply with
           NCBI rate-limiting recommendations.
         """
@@ -144,70 +234,74 @@ def process_clinvar(input_dir, output_dir):
     json_files = list(Path(input_dir).glob("*.json"))
     if not json_files:
         logger.warning(f"No JSON files found in directory {input_dir}")
-    # look at all output files 
-    output_files = list(Path(output_dir).glob("*json"))
-    output_basenames = {f.stem for f in output_files}
+    # look at all output files, compressed ones included
+    output_basenames = stored_stems(output_dir, ".json")
+    # results of this run, shared by every file
+    cache = {}
     
 
     # Iterate over each JSON file
     for input_file in json_files:
-        if input_file.stem in output_basenames:
-            logger.warning(f"skipping already processed file: {input_file.name}")
-            continue
+        previous = None
+        if input_file.stem in output_basenames or \
+                is_archived("clinvar", input_file.stem):
+            previous = previous_records("clinvar", output_dir,
+                                        input_file.stem,
+                                        input_file.stat().st_mtime)
+            if previous is None:
+                logger.warning(f"skipping already processed file: {input_file.name}")
+                continue
+            logger.info(f"{input_file.name} has changed, only added variants "
+                        "are searched for")
         logger.info(f"Processing file: {input_file.name}")
 
-        # Load variant data from JSON file
+        # Variant records are read one line at a time
         try:
-            with open(input_file) as f:
-                variants_data = json.load(f)
+            variants_data = read_records(input_file)
         except Exception as e:
             logger.error(f"Failed to load JSON file {input_file}: {e}")
             continue
 
-        results = []
-
-        # Iterate over each variant entry in the JSON file
-        for entry in variants_data:
-            variant_str = entry.get("variant")
-            if not variant_str:
-                logger.warning("Variant entry missing 'variant' field, skipping.")
-                continue
-
-            # Extract the g_hgvs notation from the nested structure
-            try:
-                variant_result = entry["result"][variant_str][variant_str]
-                g_hgvs = variant_result.get("g_hgvs")
-            except KeyError:
-                g_hgvs = None
-
-            if not g_hgvs:
-                logger.warning(f"No g_hgvs found for {variant_str}, skipping.")
-                continue
-
-            # Search ClinVar using HGVS notation
-            logger.info(f"Searching ClinVar for HGVS: {g_hgvs}")
-            clinvar_ids = search_clinvar(g_hgvs)
-            summary = get_esummary(clinvar_ids)
-
-            # Append results to the output list
-            results.append({
-                "variant": variant_str,
-                "g_hgvs": g_hgvs,
-                "clinvar_ids": clinvar_ids,
-                "esummary": summary
-            })
-
-            # Respect NCBI API guidelines by adding a small delay
-            time.sleep(0.3)
-
-        # Save results to output directory with the same filename
+        # Results are written as JSON lines to the file with the same name
         output_file = Path(output_dir) / input_file.name
         try:
-            with open(output_file, "w") as f:
-                json.dump(results, f, indent=2)
-            logger.info(f"Results saved to {output_file}")
+            out_f = open_records(output_file)
         except Exception as e:
             logger.error(f"Failed to save results for {input_file.name}: {e}")
+            continue
+
+        # full summaries, only when raw archiving is switched on
+        archive = open_raw_archive("clinvar", input_file.name)
+        try:
+            for entry in variants_data:
+                result = reuse_record(previous, entry.get("variant"),
+                                      entry.get("samples")) or \
+                    reuse_record(cache, entry.get("variant"),
+                                 entry.get("samples"))
+                if result is not None:
+                    write_record(out_f, result)
+                    continue
+                result = annotate_entry(entry, archive, session)
+                if result is None:
+                    continue
+                cache[result["variant"]] = result
+                write_record(out_f, result)
+
+                # Respect NCBI API guidelines by adding a small delay
+                time.sleep(0.3)
+        except Exception as e:
+            logger.error(f"Failed to save results for {input_file.name}: {e}")
+            discard_records(out_f, output_file)
+        else:
+            finish_records(out_f, output_file)
+            if previous is not None:
+                remove_old_output(output_file)
+            logger.info(f"Results saved to {output_file}")
+            # the validator file has been read, it is only kept as a record
+            compress_file(input_file)
+        finally:
+            if archive is not None:
+                archive.close()
 
     logger.info("All files processed successfully.")
 
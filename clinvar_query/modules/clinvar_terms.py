@@ -0,0 +1,117 @@
+"""
+ClinVar review status, star rating and condition name helpers.
+
+The database stores the review status by id and the star count as an
+integer, the human-readable star rating is only built when results are
+displayed (see ``render_star_rating``).
+
+Condition (trait) names are split into lower case word tokens so they can
+be searched by word or word prefix, e.g. "cardiomyo" finds
+"Dilated cardiomyopathy 1A" (see ``condition_tokens``).
+"""
+
+import re
+
+# Mapping of ClinVar review status text to star rating
+REVIEW_TO_STARS = {
+    "no assertion": 0,
+    "criteria provided, single submitter": 1,
+    "criteria provided, multiple submitters, no conflicts": 2,
+    "reviewed by expert panel": 3,
+    "practice guideline": 4,
+}
+
+MAX_STARS = 4
+
+
+def star_count(review_status):
+    """
+    Convert a ClinVar review status into a number of stars.
+
+    Parameters
+    ----------
+    review_status : str or None
+        Review status text from the ClinVar germline classification.
+
+    Returns
+    -------
+    int
+        Star count from 0 to 4, zero if the status is missing or unknown.
+    """
+    if not review_status:
+        return 0
+
+    review_norm = review_status.strip().lower()
+    for key, value in REVIEW_TO_STARS.items():
+        if key in review_norm:
+            return value
+    return 0
+
+
+def render_star_rating(review_status, stars):
+    """
+    Build the star rating shown on the site, for example
+    ``criteria provided, single submitter (⭐☆☆☆)``.
+
+    Parameters
+    ----------
+    review_status : str or None
+        Review status text, shown as ``Unknown`` when missing.
+    stars : int or None
+        Star count, treated as zero when missing.
+
+    Returns
+    -------
+    str or None
+        The rendered rating, or None when there is no ClinVar record.
+    """
+    if review_status is None and stars is None:
+        return None
+
+    stars = stars or 0
+    stars_visual = "⭐" * stars + "☆" * (MAX_STARS - stars)
+    return f"{review_status or 'Unknown'} ({stars_visual})"
+
+
+def parse_star_rating(star_rating):
+    """
+    Split a star rating rendered by older versions back into the
+    review status and star count, used when upgrading old databases.
+
+    Returns
+    -------
+    tuple of (str or None, int)
+    """
+    if not star_rating:
+        return None, 0
+
+    review_status, _, visual = star_rating.rpartition(" (")
+    if not review_status:
+        review_status, visual = star_rating, ""
+    if review_status == "Unknown":
+        review_status = None
+    return review_status, visual.count("⭐")
+
+
+def condition_tokens(condition_name):
+    """
+    Split a condition name into its lower case words.
+
+    Parameters
+    ----------
+    condition_name : str or None
+        Condition name, e.g. ``Parkinson disease 8, autosomal dominant``.
+
+    Returns
+    -------
+    list of str
+        The words in order with repeats removed, e.g.
+        ``["parkinson", "disease", "8", "autosomal", "dominant"]``.
+    """
+    words = re.findall(r"[a-z0-9]+", (condition_name or "").lower())
+    return list(dict.fromkeys(words))
+
+
+def normalise_condition(condition_name):
+    """The condition name as its tokens joined by single spaces"""
+    return " ".join(condition_tokens(condition_name))
@@ -0,0 +1,267 @@
+"""
+Bulk annotation against a local ClinVar VCF.
+
+For large uploads, looking every variant up in VariantValidator and the
+ClinVar API (or in an index) costs a request or a seek per variant.
+This mode instead:
+
+- sorts the processed variants by chromosome and position, in memory
+  when they fit in one chunk, otherwise as sorted runs on disk which are
+  merged back together (external sort)
+- reads the ClinVar VCF (clinvar.vcf.gz from the NCBI FTP site, sorted by
+  chromosome and position) once from start to end, joining it to the
+  sorted variants as it goes
+
+Both files are read sequentially once, so the time taken is linear in the
+number of variants plus the number of ClinVar records.
+
+Each matched variant gives the same fields json_to_dir takes from the
+ClinVar esummary, and they are inserted with the same statements, a
+batch of rows at a time on one connection (insert_annotation_batch).
+The ClinVar VCF has no gnomAD frequencies, so allele_frequency is None.
+It has no HGNC ids either (GENEINFO gives NCBI gene ids), so a variant is
+only added to the gene index when its gene symbol is already there.
+
+A processed file which has changed is annotated again in full, its
+variants are moved to the new run as they are inserted and those no
+longer in it are removed, as json_to_dir does for an overwritten file.
+
+The mode is switched on by setting clinvar_vcf in utils/settings.py
+(or the ClinVar_Search_ClinVar_VCF environment variable).
+"""
+
+import gzip
+import heapq
+import os
+import tempfile
+from itertools import islice
+from pathlib import Path
+
+from clinvar_query.utils.logger import logger
+from clinvar_query.modules.clinvar_terms import star_count
+from clinvar_query.modules.grch38_contigs import GRCH38_CONTIGS, canonical_contig
+from clinvar_query.modules.vv_variant_query import split_samples
+from clinvar_query.modules.json_to_db import patient_variant_id
+from clinvar_query.modules.insert_annotated_results import (
+    insert_annotation_batch,
+    start_annotation_run,
+    finish_annotation_run,
+    is_already_ingested,
+    previous_associations,
+    drop_variants,
+)
+
+# chromosomes in the order the ClinVar VCF is sorted in (1-22, X, Y, MT)
+CONTIG_ORDER = {contig: index for index, contig in enumerate(GRCH38_CONTIGS)}
+
+# number of processed lines sorted in memory at once
+SORT_CHUNK = 1000000
+
+
+def variant_key(line):
+    """(chromosome order, position) of a processed line, None if invalid"""
+    variant, _ = split_samples(line)
+    parts = variant.split("-")
+    contig = canonical_contig(parts[0]) if len(parts) == 4 else None
+    if contig is None or not parts[1].isdigit():
+        return None
+    return CONTIG_ORDER[contig], int(parts[1])
+
+
+def sorted_lines(lines, chunk_size=SORT_CHUNK, temp_dir=None):
+    """
+    Yield processed lines sorted by chromosome and position.
+
+    Lines are sorted a chunk at a time, if there is more than one chunk
+    each is written to a temporary file and the files are merged.
+    """
+    lines = (line for line in lines if variant_key(line) is not None)
+    first = sorted(islice(lines, chunk_size), key=variant_key)
+    second = sorted(islice(lines, chunk_size), key=variant_key)
+    if not second:
+        yield from first
+        return
+
+    with tempfile.TemporaryDirectory(dir=temp_dir) as run_dir:
+        runs = []
+
+        def write_run(chunk):
+            run_path = os.path.join(run_dir, f"run_{len(runs)}.txt")
+            with open(run_path, "w") as run:
+                run.writelines(f"{line}\n" for line in chunk)
+            runs.append(run_path)
+
+        write_run(first)
+        write_run(second)
+        del first, second
+        while True:
+            chunk = sorted(islice(lines, chunk_size), key=variant_key)
+            if not chunk:
+                break
+            write_run(chunk)
+        logger.info(f"Merging {len(runs)} sorted runs of variants")
+
+        files = [open(run_path) for run_path in runs]
+        try:
+            yield from heapq.merge(*((line.rstrip("\n") for line in file)
+                                     for file in files), key=variant_key)
+        finally:
+            for file in files:
+                file.close()
+
+
+def open_vcf(vcf_path):
+    if str(vcf_path).endswith(".gz"):
+        return gzip.open(vcf_path, "rt")
+    return open(vcf_path)
+
+
+def clinvar_records(vcf_path):
+    """
+    Yield (key, ref, alt, fields) for each ClinVar record in file order.
+    Only the first five columns are split here, INFO is read on a match.
+
+    Raises
+    ------
+    ValueError
+        If the VCF is not sorted by chromosome and position.
+    """
+    last_key = None
+    with open_vcf(vcf_path) as vcf:
+        for line in vcf:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t", 7)
+            contig = canonical_contig(fields[0])
+            if contig is None:
+                continue
+            key = (CONTIG_ORDER[contig], int(fields[1]))
+            if last_key and key < last_key:
+                raise ValueError(f"{vcf_path} is not sorted by position "
+                                 f"at {fields[0]}:{fields[1]}")
+            last_key = key
+            for alt in fields[4].split(","):
+                yield key, fields[3], alt, fields
+
+
+def clinvar_text(value):
+    # ClinVar VCF values use _ for spaces
+    return value.replace("_", " ") if value else None
+
+
+def record_annotation(variant, fields):
+    """The json_to_dir ClinVar fields for a matched ClinVar VCF record"""
+    info = {}
+    for item in fields[7].split(";"):
+        key, _, value = item.partition("=")
+        info[key] = value
+
+    review_status = clinvar_text(info.get("CLNREVSTAT"))
+    gene = None
+    if info.get("GENEINFO"):
+        gene = info["GENEINFO"].split("|")[0].split(":")[0]
+
+    return {
+        "variant_id": variant,
+        "clinvar_id": fields[2],
+        "consensus_classification": clinvar_text(info.get("CLNSIG")),
+        "hgvs": info.get("CLNHGVS"),
+        "conditions": [clinvar_text(name)
+                       for name in info.get("CLNDN", "").split("|") if name],
+        "gene": gene,
+        "review_status": review_status,
+        "stars": star_count(review_status),
+        "allele_frequency": None,
+        "chromosome": fields[0],
+    }
+
+
+def merge_join(lines, records):
+    """
+    Join sorted processed lines to sorted ClinVar records, yielding an
+    annotation (with the carrying samples) for each line with a match.
+    """
+    records = iter(records)
+    record = next(records, None)
+    current_key = None
+    at_position = {}
+
+    for line in lines:
+        key = variant_key(line)
+        if key != current_key:
+            # move the ClinVar file up to this position
+            while record is not None and record[0] < key:
+                record = next(records, None)
+            at_position = {}
+            while record is not None and record[0] == key:
+                at_position[(record[1].upper(), record[2].upper())] = record[3]
+                record = next(records, None)
+            current_key = key
+
+        variant, samples = split_samples(line)
+        _, _, ref, alt = variant.split("-")
+        fields = at_position.get((ref.upper(), alt.upper()))
+        if fields:
+            annotation = record_annotation(variant, fields)
+            annotation["samples"] = samples
+            yield annotation
+
+
+def annotate_file(processed_file, clinvar_vcf, chunk_size=SORT_CHUNK):
+    """Yield the ClinVar annotations for every variant in a processed file"""
+    with open(processed_file) as processed:
+        lines = (line.rstrip("\n") for line in processed if line.strip())
+        yield from merge_join(sorted_lines(lines, chunk_size),
+                              clinvar_records(clinvar_vcf))
+
+
+def bulk_annotate(processed_file, clinvar_vcf):
+    """
+    Annotate a processed file from the ClinVar VCF and insert the results,
+    recording an annotation run like json_to_dir. Patient variants from an
+    earlier version of the file which are not in this one are removed.
+
+    Returns
+    -------
+    int
+        Number of patient variants inserted.
+    """
+    processed_file = Path(processed_file)
+    source_modified = processed_file.stat().st_mtime
+    if is_already_ingested(processed_file.name, source_modified):
+        logger.info(f"Skipping already ingested file: {processed_file.name}")
+        return 0
+
+    patient_id = processed_file.stem.split("_")[0]
+    previous = previous_associations(processed_file.name)
+    seen = set()
+
+    def links(annotations):
+        # the patient variants of this version, inserting an existing one
+        # moves it to the new run
+        for annotation in annotations:
+            for carrier in annotation.get("samples") or [patient_id]:
+                seen.add(patient_variant_id(carrier,
+                                            annotation["variant_id"]))
+            yield annotation
+
+    run_id = start_annotation_run(patient_id, processed_file.name,
+                                  source_modified)
+    inserted = insert_annotation_batch(
+        links(annotate_file(processed_file, clinvar_vcf)), run_id, patient_id)
+    if previous - seen:
+        drop_variants(previous - seen, processed_file.name)
+
+    finish_annotation_run(run_id, inserted)
+    logger.info(f"Annotated {inserted} variants in {processed_file.name} "
+                f"from the ClinVar VCF")
+    return inserted
+
+
+def bulk_annotate_folder(folder, clinvar_vcf):
+    """Annotate every processed file in a folder from the ClinVar VCF"""
+    for processed_file in sorted(Path(folder).glob("*.txt")):
+        try:
+            bulk_annotate(processed_file, clinvar_vcf)
+        except Exception:
+            logger.exception(f"Bulk annotation failed for {processed_file}")
@@ -0,0 +1,220 @@
+import gzip
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+from clinvar_query.utils.logger import logger
+from clinvar_query.utils.paths import database_file
+from clinvar_query.utils.settings import compression
+from clinvar_query.modules.file_manifest import record_file, forget_file
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+"""
+Compression for files the pipeline has finished with.
+
+Once the next stage has read a file it is only kept as a record, so it is
+compressed in place:
+processed_folder  patient1_processed.txt -> patient1_processed.txt.gz
+validator_folder  patient1_processed.json -> patient1_processed.json.gz
+clinvar_folder    patient1_processed.json -> patient1_processed.json.gz
+after vv_variant_query, process_clinvar and json_to_dir have read them.
+The method is set by compression in utils/settings.py, gzip or zstd
+(zstd needs the zstandard package, gzip is used when it is missing).
+Files still waiting for a stage are never compressed.
+
+open_text reads plain, gzip and zstd files the same way, the format is
+told from the first bytes of the file rather than its name.
+base_name gives the name without the compression suffix, which the
+skip logic uses so a compressed output still counts as done.
+
+Running this module reports the disk and read time savings for a folder:
+python -m clinvar_query.modules.compressed_files <folder>
+"""
+
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+MAGIC = {b"\x1f\x8b": "gzip", b"\x28\xb5\x2f\xfd": "zstd"}
+
+
+def available_method(method):
+    """The method to use for a setting, None for no compression"""
+    if not method:
+        return None
+    method = method.lower()
+    if method == "zstd" and zstandard is None:
+        logger.warning("zstandard is not installed, gzip is used instead")
+        return "gzip"
+    if method not in SUFFIXES:
+        logger.warning(f"Unknown compression {method}, files are left as they are")
+        return None
+    return method
+
+
+def stored_method(path):
+    """How a file is compressed, from its first bytes, None if it is not"""
+    with open(path, "rb") as f:
+        start = f.read(4)
+    for magic, method in MAGIC.items():
+        if start.startswith(magic):
+            return method
+    return None
+
+
+def base_name(name):
+    """File name without a compression suffix (a.json.gz -> a.json)"""
+    name = Path(name).name
+    for suffix in SUFFIXES.values():
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def stored_stems(folder, suffix):
+    """Stems of the files in a folder ending in suffix, compressed or not"""
+    stems = set()
+    for path in Path(folder).glob(f"*{suffix}*"):
+        name = base_name(path)
+        if name.endswith(suffix):
+            stems.add(name[:-len(suffix)])
+    return stems
+
+
+def open_text(path, mode="r"):
+    """
+    Open a text file which may be compressed.
+
+    Reading detects the compression from the file, writing uses the
+    compression suffix of the name (.gz or .zst).
+    """
+    if "r" in mode:
+        method = stored_method(path)
+    else:
+        method = next((method for method, suffix in SUFFIXES.items()
+                       if str(path).endswith(suffix)), None)
+
+    mode = mode.replace("t", "").replace("b", "") + "t"
+    if method == "gzip":
+        return gzip.open(path, mode, encoding="utf-8")
+    if method == "zstd":
+        if zstandard is None:
+            raise OSError(f"{path} is zstd compressed and zstandard is not installed")
+        return zstandard.open(path, mode, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def write_compressed(source_path, target_path, method, mtime=None):
+    """Write a compressed copy of a file, read and written in chunks"""
+    with open(source_path, "rb") as source, open(target_path, "wb") as target:
+        if method == "gzip":
+            with gzip.GzipFile(fileobj=target, mode="wb",
+                               mtime=mtime) as writer:
+                shutil.copyfileobj(source, writer)
+        else:
+            zstandard.ZstdCompressor().copy_stream(source, target)
+
+
+def compress_file(path, method=compression, database=database_file):
+    """
+    Compress a finished file in place, keeping its modified time.
+    The file manifest in database is updated when the file is listed there.
+
+    Returns
+    -------
+    str
+        Path of the compressed file, or the path as it was when
+        compression is off or the file is already compressed.
+    """
+    method = available_method(method)
+    path = str(path)
+    if method is None or not os.path.isfile(path) or stored_method(path):
+        return path
+
+    compressed = path + SUFFIXES[method]
+    try:
+        stat = os.stat(path)
+        write_compressed(path, compressed + ".part", method, stat.st_mtime)
+        os.replace(compressed + ".part", compressed)
+        os.utime(compressed, (stat.st_atime, stat.st_mtime))
+        os.remove(path)
+    except Exception as e:
+        logger.error(f"Could not compress {path} : {e}")
+        if os.path.exists(compressed + ".part"):
+            os.remove(compressed + ".part")
+        return path
+
+    if forget_file(path, database=database):
+        record_file(compressed, database=database)
+    logger.info(f"Compressed {path} with {method}")
+    return compressed
+
+
+def stored_file(path):
+    """The path a file is stored at, plain or compressed, None if missing"""
+    for candidate in [str(path)] + [f"{path}{suffix}"
+                                    for suffix in SUFFIXES.values()]:
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def benchmark(folder, methods=("gzip", "zstd")):
+    """
+    Compress a copy of every plain file in a folder with each method and
+    time reading them back.
+
+    Returns
+    -------
+    list of dict
+        One row per method (and "none" for the plain files) with the
+        total bytes, the ratio to the plain size and the read seconds.
+    """
+    files = [path for path in sorted(Path(folder).iterdir())
+             if path.is_file() and not stored_method(path)]
+    plain_bytes = sum(path.stat().st_size for path in files)
+
+    def read_all(paths):
+        start = time.perf_counter()
+        for path in paths:
+            with open_text(path) as f:
+                for _ in f:
+                    pass
+        return time.perf_counter() - start
+
+    report = [{"method": "none", "bytes": plain_bytes, "ratio": 1.0,
+               "write_seconds": 0.0, "read_seconds": read_all(files)}]
+
+    for method in methods:
+        if available_method(method) != method:
+            continue
+        copies = []
+        start = time.perf_counter()
+        try:
+            for path in files:
+                copy = f"{path}.benchmark{SUFFIXES[method]}"
+                write_compressed(path, copy, method)
+                copies.append(copy)
+            write_seconds = time.perf_counter() - start
+            stored_bytes = sum(os.path.getsize(copy) for copy in copies)
+            report.append({
+                "method": method,
+                "bytes": stored_bytes,
+                "ratio": plain_bytes / stored_bytes if stored_bytes else 1.0,
+                "write_seconds": write_seconds,
+                "read_seconds": read_all(copies),
+            })
+        finally:
+            for copy in copies:
+                os.remove(copy)
+    return report
+
+
+if __name__ == "__main__":
+    folder = sys.argv[1] if len(sys.argv) > 1 else "."
+    print(f"{'method':<8}{'bytes':>14}{'ratio':>8}{'write s':>10}{'read s':>10}")
+    for row in benchmark(folder):
+        print(f"{row['method']:<8}{row['bytes']:>14}{row['ratio']:>8.1f}"
+              f"{row['write_seconds']:>10.3f}{row['read_seconds']:>10.3f}")
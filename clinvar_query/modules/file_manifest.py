@@ -0,0 +1,212 @@
+import os
+import sqlite3
+import time
+from pathlib import Path
+from clinvar_query.utils.logger import logger
+from clinvar_query.utils.paths import database_file
+
+"""
+The file manifest keeps a table of the processed and misaligned outputs
+with their size and modified time, so the results page can list them
+with an indexed query instead of listing and stat-ing every file.
+
+save_output_to_file records each file it writes here.
+A folder that has never been listed before (for example one made before
+the manifest existed) is scanned and marked as synced, after that only
+the manifest is read until the folder itself changes. Adding, removing
+or renaming a file changes the modified time of the folder, so a folder
+modified since it was last synced is scanned again, which picks up files
+changed outside the app. Files recorded or forgotten through the app
+mark the folder as synced again, so they do not cause a scan.
+
+Folders are keyed on their resolved path, so relative and absolute
+references to the same folder share one set of rows.
+
+Listing pages are newest first and keyed on (modified time, filename)
+the cursor for the next page is written as "<modified>|<filename>"
+"""
+
+manifest_schema = """
+    CREATE TABLE IF NOT EXISTS file_manifest (
+        folder TEXT,
+        filename TEXT,
+        size INTEGER,
+        modified REAL,
+        PRIMARY KEY (folder, filename)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_file_manifest_recent
+        ON file_manifest (folder, modified DESC, filename);
+
+    CREATE TABLE IF NOT EXISTS manifest_folders (
+        folder TEXT PRIMARY KEY,
+        synced_at REAL
+    );
+"""
+
+
+def folder_key(folder):
+    return str(Path(folder).resolve())
+
+
+def connect_manifest(database):
+    con = sqlite3.connect(database)
+    con.executescript(manifest_schema)
+    return con
+
+
+def mark_synced(con, folder):
+    # the change the app made to an already synced folder is in the
+    # manifest, so the folder does not need to be scanned for it
+    con.execute(
+        """
+        UPDATE manifest_folders SET synced_at = ?
+        WHERE folder = ? AND synced_at IS NOT NULL
+        """, (time.time(), folder_key(folder)))
+
+
+def record_file(file_path, database=database_file):
+    """Add or refresh the manifest entry for a file that has been written.
+    Failures are logged and not raised, the file itself is already saved
+    and the folder can always be rebuilt with sync_folder"""
+    try:
+        stat = os.stat(file_path)
+        con = connect_manifest(database)
+        con.execute(
+            """
+            INSERT OR REPLACE INTO file_manifest
+            (folder, filename, size, modified)
+            VALUES (?, ?, ?, ?)
+            """,
+            (folder_key(os.path.dirname(file_path)),
+             os.path.basename(file_path),
+             stat.st_size,
+             stat.st_mtime))
+        mark_synced(con, os.path.dirname(file_path))
+        con.commit()
+    except Exception as e:
+        logger.error("Could not record {} in the file manifest : {}"
+                     .format(file_path, e))
+    finally:
+        if 'con' in locals():
+            con.close()
+
+
+def forget_file(file_path, database=database_file):
+    """Remove the manifest entry for a file which has been moved or
+    removed, returns True if there was one"""
+    try:
+        con = connect_manifest(database)
+        cursor = con.execute(
+            "DELETE FROM file_manifest WHERE folder = ? AND filename = ?",
+            (folder_key(os.path.dirname(file_path)),
+             os.path.basename(file_path)))
+        mark_synced(con, os.path.dirname(file_path))
+        con.commit()
+        return cursor.rowcount > 0
+    except Exception as e:
+        logger.error("Could not remove {} from the file manifest : {}"
+                     .format(file_path, e))
+        return False
+    finally:
+        if 'con' in locals():
+            con.close()
+
+
+def sync_folder(folder, database=database_file):
+    """Rebuild the manifest rows for a folder from what is on disk"""
+    key = folder_key(folder)
+    # taken before listing (less a second, file times can lag the clock)
+    # so a file added while the folder is read leaves the folder newer
+    # than the sync and it is read again
+    synced_at = time.time() - 1
+    entries = []
+    for file in os.listdir(folder):
+        path = os.path.join(folder, file)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            entries.append((key, file, stat.st_size, stat.st_mtime))
+
+    con = connect_manifest(database)
+    try:
+        with con:
+            con.execute("DELETE FROM file_manifest WHERE folder = ?", (key,))
+            con.executemany(
+                """
+                INSERT INTO file_manifest (folder, filename, size, modified)
+                VALUES (?, ?, ?, ?)
+                """, entries)
+            con.execute(
+                """
+                INSERT OR REPLACE INTO manifest_folders (folder, synced_at)
+                VALUES (?, ?)
+                """, (key, synced_at))
+        logger.info("File manifest synced for {} ({} files)"
+                    .format(folder, len(entries)))
+    finally:
+        con.close()
+
+
+def ensure_synced(con, folder, database):
+    """Scan a folder which has not been synced or changed since it was"""
+    synced = con.execute(
+        "SELECT synced_at FROM manifest_folders WHERE folder = ?",
+        (folder_key(folder),)).fetchone()
+    if not synced or synced[0] is None or \
+            os.stat(folder).st_mtime >= synced[0]:
+        sync_folder(folder, database)
+
+
+def manifest_page(folder, after=None, limit=50, database=database_file):
+    """Return one page of filenames for a folder, newest first,
+    and the cursor for the page after it (None on the last page)"""
+    files = []
+    if not os.path.exists(folder):
+        return files, None
+
+    query = """
+        SELECT filename, modified FROM file_manifest
+        WHERE folder = ?
+    """
+    params = [folder_key(folder)]
+
+    if after:
+        try:
+            modified, _, filename = after.partition("|")
+            modified = float(modified)
+            query += """
+                AND (modified < ? OR (modified = ? AND filename > ?))
+            """
+            params += [modified, modified, filename]
+        except ValueError:
+            logger.warning("Invalid file cursor : {}".format(after))
+
+    query += " ORDER BY modified DESC, filename"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit + 1)
+
+    try:
+        con = connect_manifest(database)
+        ensure_synced(con, folder, database)
+        rows = con.execute(query, params).fetchall()
+    except Exception as e:
+        logger.error("Could not fetch files : {}".format(e))
+        rows = []
+    finally:
+        if 'con' in locals():
+            con.close()
+
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = "{!r}|{}".format(rows[-1][1], rows[-1][0])
+
+    files = [filename for filename, _ in rows]
+    return files, next_cursor
+
+
+def list_files(folder, database=database_file):
+    """Every filename recorded for a folder, newest first"""
+    files, _ = manifest_page(folder, limit=None, database=database)
+    return files
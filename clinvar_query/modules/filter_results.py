@@ -0,0 +1,87 @@
+"""
+Filters for annotated variants, shared by the search and results pages.
+
+The filters are:
+af_min / af_max   - gnomAD allele frequency range, for example af_max=0.01
+                    for rare variants (variants with no frequency are left out)
+min_stars         - lowest review star rating to include, 0 to 4
+classification    - exact consensus classification, e.g. Pathogenic
+
+Each filter is a compare on an indexed column of the clinvar table
+(allele_frequency, stars, classification_id), so results are read with
+index range scans rather than by scanning every row.
+"""
+
+
+FILTER_TYPES = {
+    "af_min": float,
+    "af_max": float,
+    "min_stars": int,
+    "classification": str,
+}
+
+
+def parse_filters(args):
+    """
+    Read the filters from request arguments.
+
+    Parameters
+    ----------
+    args : mapping
+        Query string arguments, e.g. ``request.args``.
+
+    Returns
+    -------
+    dict
+        Only the filters which were given.
+
+    Raises
+    ------
+    ValueError
+        If a number filter is not a number.
+    """
+    filters = {}
+    for key, convert in FILTER_TYPES.items():
+        value = (args.get(key) or "").strip()
+        if value:
+            filters[key] = convert(value)
+    return filters
+
+
+def filter_clause(filters):
+    """
+    Build the SQL conditions for a set of filters on the clinvar table.
+
+    Returns
+    -------
+    tuple of (list of str, list, str or None)
+        The conditions to AND together, their parameters, and the
+        indexed column the filtered rows are best read in order of.
+    """
+    conditions = []
+    params = []
+    sort_column = None
+
+    if "classification" in filters:
+        conditions.append("""clinvar.classification_id = (
+            SELECT classification_id FROM classifications
+            WHERE classification = ?)""")
+        params.append(filters["classification"])
+        sort_column = "clinvar.classification_id"
+
+    if "af_min" in filters:
+        conditions.append("clinvar.allele_frequency >= ?")
+        params.append(filters["af_min"])
+    if "af_max" in filters:
+        conditions.append("clinvar.allele_frequency <= ?")
+        params.append(filters["af_max"])
+    if sort_column is None and ("af_min" in filters or "af_max" in filters):
+        sort_column = "clinvar.allele_frequency"
+
+    if "min_stars" in filters:
+        conditions.append("clinvar.stars >= ?")
+        params.append(filters["min_stars"])
+        if sort_column is None:
+            sort_column = "clinvar.stars"
+
+    return conditions, params, sort_column
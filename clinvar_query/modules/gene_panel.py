@@ -0,0 +1,112 @@
+from bisect import bisect_right
+from pathlib import Path
+from werkzeug.utils import secure_filename
+from clinvar_query.utils.logger import logger
+from clinvar_query.utils.paths import panel_folder
+from clinvar_query.modules.genomic_regions import location_contig
+
+"""
+Gene panels are BED files listing the regions a targeted test covers.
+When a panel is chosen for an upload, the parser leaves out the variants
+outside the panel so they are never sent to VariantValidator or ClinVar.
+
+BED regions are 0-based and half open, the same as variant_locations.
+Header lines (track, browser, #) are skipped and only the first three
+columns are read, for example:
+chr12   40196743   40369285   LRRK2
+
+A panel is loaded into a dictionary with its name and, per chromosome,
+the sorted region starts and ends with overlapping regions merged,
+so checking a variant is one binary search.
+
+Panels can be uploaded with a file or picked from the ones already
+stored in the panel folder. A stored panel is only replaced by a
+different file of the same name when overwrite is on, so the regions an
+earlier upload was filtered with are not changed by accident.
+"""
+
+
+def read_bed(file_path):
+    """Read a BED file into merged, sorted regions for each chromosome"""
+    regions = {}
+    with open(file_path) as bed_file:
+        for line_number, line in enumerate(bed_file, start=1):
+            if not line.strip() or line.startswith(("#", "track", "browser")):
+                continue
+            fields = line.split()
+            try:
+                chromosome = location_contig(fields[0])
+                start, end = int(fields[1]), int(fields[2])
+            except (IndexError, ValueError):
+                raise ValueError("Invalid BED line {} in {}: {}"
+                                 .format(line_number, file_path,
+                                         line.strip()))
+            regions.setdefault(chromosome, []).append((start, end))
+
+    merged = {}
+    for chromosome, intervals in regions.items():
+        starts, ends = [], []
+        for start, end in sorted(intervals):
+            if ends and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        merged[chromosome] = (starts, ends)
+    return merged
+
+
+def load_panel(name, folder=panel_folder):
+    """
+    Load a stored panel by its file name.
+
+    Returns the panel dictionary, or None if the file is missing or is
+    not a valid BED file
+    """
+    path = Path(folder) / secure_filename(name)
+    try:
+        return {"name": path.name, "regions": read_bed(path)}
+    except (OSError, ValueError) as e:
+        logger.error("Could not load gene panel {} : {}".format(name, e))
+        return None
+
+
+def save_panel(file, folder=panel_folder, overwrite=False):
+    """
+    Store an uploaded BED file in the panel folder, returns its name.
+    The same file sent again is left as it is.
+
+    Raises
+    ------
+    FileExistsError
+        If a different panel is stored under the name and overwrite is off.
+    """
+    Path(folder).mkdir(parents=True, exist_ok=True)
+    name = secure_filename(file.filename)
+    path = Path(folder) / name
+    content = file.read()
+    if path.exists() and path.read_bytes() != content:
+        if not overwrite:
+            raise FileExistsError("Gene panel {} is already stored"
+                                  .format(name))
+        logger.warning("Gene panel {} overwritten".format(name))
+    path.write_bytes(content)
+    logger.info("Gene panel {} saved".format(name))
+    return name
+
+
+def stored_panels(folder=panel_folder):
+    """Names of the panels that can be picked on the upload page"""
+    if not Path(folder).exists():
+        return []
+    return sorted(path.name for path in Path(folder).glob("*.bed"))
+
+
+def in_panel(panel, chromosome, start, end):
+    """Whether the interval start-end overlaps a region of the panel"""
+    starts, ends = panel["regions"].get(location_contig(chromosome),
+                                        ([], []))
+    # the last region starting before the end of the interval is the
+    # only one that can overlap it, as the regions do not overlap
+    index = bisect_right(starts, end - 1) - 1
+    return index >= 0 and ends[index] > start
@@ -0,0 +1,144 @@
+import re
+from clinvar_query.modules.grch38_contigs import GRCH38_CONTIGS, canonical_contig
+
+"""
+Chromosome positions for variants and region queries.
+
+variant_id is written as chrom-pos-ref-alt (for example 12-40367069-A-G),
+this splits it into a chromosome and a 0-based, half open [start, end)
+interval covering the reference allele, so 12-40367069-A-G is
+12:40367068-40367069.
+
+Intervals are placed in UCSC style bins, every bin covers a fixed window
+and an interval is given the smallest bin it fits in completely.
+A region query only has to look in the few bins that can overlap it
+(see overlapping_bin_ranges), so with an index on (chromosome, bin, start) an
+overlap query reads the matching rows rather than every variant.
+
+Regions are entered the way genome browsers show them, 1-based and
+inclusive, commas allowed and chr optional:
+chr12:40,200,000-40,400,000
+A region has to be on a GRCh38 chromosome and start inside it, its end
+is cut back to the end of the chromosome (see grch38_contigs.py), which
+keeps the number of bins a query looks in small.
+"""
+
+# bin sizes are 128kb, 1Mb, 8Mb, 64Mb and 512Mb, given by these shifts
+BIN_FIRST_SHIFT = 17
+BIN_NEXT_SHIFT = 3
+BIN_OFFSETS = [585, 73, 9, 1, 0]
+# the largest bin is 512Mb, nothing past it can be binned
+BIN_MAX_END = 1 << 29
+
+region_pattern = re.compile(
+    r"^\s*(?:chr)?([0-9]{1,2}|[XYM]|MT)\s*:\s*([0-9,]{1,15})\s*-\s*([0-9,]{1,15})\s*$",
+    re.IGNORECASE)
+
+
+def normalise_chromosome(chromosome):
+    """Chromosome without the chr prefix, in upper case (chr1 -> 1)"""
+    chromosome = str(chromosome).strip()
+    if chromosome.lower().startswith("chr"):
+        chromosome = chromosome[3:]
+    return chromosome.upper()
+
+
+def location_contig(chromosome):
+    """
+    The chromosome as variant_locations stores it, the GRCh38 name the
+    parser writes (chrMT -> M, NC_000012.12 -> 12), or for a contig which
+    is not in GRCh38 the name without chr.
+    """
+    return canonical_contig(chromosome) or normalise_chromosome(chromosome)
+
+
+def parse_variant_id(variant_id):
+    """
+    Split a chrom-pos-ref-alt variant id into its location.
+
+    Returns
+    -------
+    tuple of (str, int, int) or None
+        chromosome, start and end, or None if the id is not in that form.
+    """
+    parts = str(variant_id or "").split("-")
+    if len(parts) != 4 or not parts[1].isdigit() or int(parts[1]) < 1:
+        return None
+
+    chromosome, position, ref, _ = parts
+    start = int(position) - 1
+    return location_contig(chromosome), start, start + max(len(ref), 1)
+
+
+def parse_region(region):
+    """
+    Read a region such as chr12:40,200,000-40,400,000.
+
+    Returns
+    -------
+    tuple of (str, int, int) or None
+        chromosome, start and end as a 0-based half open interval,
+        or None if the text is not a region.
+
+    Raises
+    ------
+    ValueError
+        If the chromosome is not in GRCh38 or the region starts past
+        its end, the message can be shown to the user.
+    """
+    match = region_pattern.match(region or "")
+    if not match:
+        return None
+
+    chromosome, first, last = match.groups()
+    first = int(first.replace(",", ""))
+    last = int(last.replace(",", ""))
+    if first < 1 or last < first:
+        return None
+
+    contig = canonical_contig(chromosome)
+    if contig is None:
+        raise ValueError(f"Chromosome {chromosome} is not in GRCh38")
+    length = GRCH38_CONTIGS[contig][0]
+    if first > length:
+        raise ValueError(f"Chromosome {chromosome} is {length:,} bp long, "
+                         f"the region starts after it ends")
+    # chrMT and chrM are both stored as M, as the parser writes them
+    return contig, first - 1, min(last, length)
+
+
+def region_bin(start, end):
+    """The smallest bin an interval fits in completely"""
+    end = max(end, start + 1) - 1
+    start_bin = start >> BIN_FIRST_SHIFT
+    end_bin = end >> BIN_FIRST_SHIFT
+    for offset in BIN_OFFSETS:
+        if start_bin == end_bin:
+            return offset + start_bin
+        start_bin >>= BIN_NEXT_SHIFT
+        end_bin >>= BIN_NEXT_SHIFT
+    raise ValueError("Interval {}-{} is out of range".format(start, end))
+
+
+def overlapping_bin_ranges(start, end):
+    """
+    The first and last bin of each size which could hold an interval
+    overlapping start-end, one (first, last) pair for each bin size.
+    """
+    if start < 0 or end > BIN_MAX_END:
+        raise ValueError("Interval {}-{} is out of range".format(start, end))
+    end = max(end, start + 1) - 1
+    start_bin = start >> BIN_FIRST_SHIFT
+    end_bin = end >> BIN_FIRST_SHIFT
+    ranges = []
+    for offset in BIN_OFFSETS:
+        ranges.append((offset + start_bin, offset + end_bin))
+        start_bin >>= BIN_NEXT_SHIFT
+        end_bin >>= BIN_NEXT_SHIFT
+    return ranges
+
+
+def overlapping_bins(start, end):
+    """Every bin which could hold an interval overlapping start-end"""
+    return [number for first, last in overlapping_bin_ranges(start, end)
+            for number in range(first, last + 1)]
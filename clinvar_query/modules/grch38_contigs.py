@@ -0,0 +1,94 @@
+import re
+
+"""
+GRCh38 contig table used to check variants locally before they are sent to
+VariantValidator. Rows with an unknown contig, a position past the end of
+the contig, or alleles VariantValidator cannot take (symbolic ALTs such as
+<DEL>, the * spanning deletion, more than one ALT, letters other than
+ACGTN) fail there anyway, so they are routed to the misaligned output
+straight away instead of using up the rate limit.
+
+Contigs are the primary assembly chromosomes, with their lengths and
+RefSeq accessions from the GRCh38.p14 assembly report. Each can be written
+as 1, chr1 or NC_000001.11, the mitochondrial genome as M, MT or chrM.
+"""
+
+# name: (length, RefSeq accession)
+GRCH38_CONTIGS = {
+    "1": (248956422, "NC_000001.11"),
+    "2": (242193529, "NC_000002.12"),
+    "3": (198295559, "NC_000003.12"),
+    "4": (190214555, "NC_000004.12"),
+    "5": (181538259, "NC_000005.10"),
+    "6": (170805979, "NC_000006.12"),
+    "7": (159345973, "NC_000007.14"),
+    "8": (145138636, "NC_000008.11"),
+    "9": (138394717, "NC_000009.12"),
+    "10": (133797422, "NC_000010.11"),
+    "11": (135086622, "NC_000011.10"),
+    "12": (133275309, "NC_000012.12"),
+    "13": (114364328, "NC_000013.11"),
+    "14": (107043718, "NC_000014.9"),
+    "15": (101991189, "NC_000015.10"),
+    "16": (90338345, "NC_000016.10"),
+    "17": (83257441, "NC_000017.11"),
+    "18": (80373285, "NC_000018.10"),
+    "19": (58617616, "NC_000019.10"),
+    "20": (64444167, "NC_000020.11"),
+    "21": (46709983, "NC_000021.9"),
+    "22": (50818468, "NC_000022.11"),
+    "X": (156040895, "NC_000023.11"),
+    "Y": (57227415, "NC_000024.10"),
+    "M": (16569, "NC_012920.1"),
+}
+
+# every way a contig can be written, mapped to its name in GRCH38_CONTIGS
+CONTIG_ALIASES = {}
+for name, (_, accession) in GRCH38_CONTIGS.items():
+    for alias in (name, f"chr{name}", accession):
+        CONTIG_ALIASES[alias.upper()] = name
+CONTIG_ALIASES["MT"] = "M"
+CONTIG_ALIASES["CHRMT"] = "M"
+
+allele_pattern = re.compile(r"^[ACGTN]+$", re.IGNORECASE)
+
+
+def canonical_contig(contig):
+    """The GRCh38 contig name for an alias (chr12 -> 12), or None"""
+    return CONTIG_ALIASES.get(str(contig).strip().upper())
+
+
+def invalid_reason(chrom, pos, ref, alt):
+    """
+    Check a variant against the GRCh38 contigs and allele rules.
+
+    Returns
+    -------
+    str or None
+        Why the variant cannot be validated, or None if it can be sent.
+    """
+    contig = canonical_contig(chrom)
+    if contig is None:
+        return f"{chrom} is not a GRCh38 chromosome"
+
+    if not pos.isdigit() or int(pos) < 1:
+        return f"position {pos} is not a positive whole number"
+
+    length = GRCH38_CONTIGS[contig][0]
+    if int(pos) + len(ref) - 1 > length:
+        return f"position {pos} is past the end of chromosome {contig} ({length})"
+
+    if not allele_pattern.match(ref):
+        return f"reference allele {ref} is not made of A, C, G, T or N"
+
+    if "," in alt:
+        return f"more than one alternate allele {alt}"
+    if alt.startswith("<") or alt == "*":
+        return f"symbolic alternate allele {alt}"
+    if not allele_pattern.match(alt):
+        return f"alternate allele {alt} is not made of A, C, G, T or N"
+
+    if ref.upper() == alt.upper():
+        return "alternate allele is the same as the reference"
+
+    return None
@@ -0,0 +1,109 @@
+import json
+import os
+from pathlib import Path
+from clinvar_query.utils.logger import logger
+from clinvar_query.utils.paths import archive_folder, database_file
+from clinvar_query.modules.compressed_files import SUFFIXES, stored_file
+from clinvar_query.modules.json_records import read_records
+from clinvar_query.modules.intermediate_archive import archived_at, retrieve
+
+"""
+Re-annotating a patient file which has been overwritten.
+
+When a processed file is overwritten the validator and clinvar files made
+from the old one are still there, so vv_variant_query and process_clinvar
+used to skip it. Each stage now compares the modified time of its input
+with its output (or when the output was archived), an input which is newer
+has changed since the output was made.
+
+previous_records reads the old output back (from the folder, or from its
+archive bundle) keyed by variant. The stage then goes through the new
+input as usual, a variant which was in the old output is copied over with
+reuse_record and only the variants which were added are queried.
+Variants which were removed are not in the new output, json_to_dir drops
+them from the variants table when the new clinvar file is ingested.
+
+Old records with an error are not reused, those variants are queried again.
+Once the new output is written remove_old_output removes the old one if
+it had been compressed, so there is one copy of each file.
+"""
+
+
+def records_from_text(text):
+    """Records of an archived file, JSON Lines or an older JSON array"""
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def previous_records(stage, folder, file_stem, input_modified,
+                     bundle_folder=archive_folder, database=database_file):
+    """
+    Read the earlier output of a stage back if its input has changed since.
+
+    Parameters
+    ----------
+    stage : str
+        "validator" or "clinvar", the stage the output belongs to.
+    folder : str or pathlib.Path
+        Output folder of the stage.
+    file_stem : str
+        Name of the output without .json.
+    input_modified : float
+        Modified time of the input file.
+
+    Returns
+    -------
+    dict or None
+        The old records keyed by variant, None when the output is up to
+        date (or there is none). Empty if the input has changed but the
+        old output can no longer be read.
+    """
+    path = stored_file(Path(folder) / f"{file_stem}.json")
+    if path:
+        output_modified = os.path.getmtime(path)
+    else:
+        output_modified = archived_at(stage, file_stem, database)
+    if output_modified is None or input_modified <= output_modified:
+        return None
+
+    try:
+        if path:
+            records = list(read_records(path))
+        else:
+            text = retrieve(stage, file_stem, bundle_folder, database)
+            records = records_from_text(text) if text else []
+    except Exception as e:
+        logger.error(f"Could not read the earlier {stage} output for "
+                     f"{file_stem}, all its variants are queried : {e}")
+        records = []
+
+    return {record["variant"]: record for record in records
+            if record.get("variant") and "error" not in record}
+
+
+def reuse_record(previous, variant, samples=None):
+    """
+    The earlier record for a variant with the samples now carrying it.
+
+    Returns
+    -------
+    dict or None
+        None if the variant is new and has to be queried.
+    """
+    if not previous or variant not in previous:
+        return None
+    record = dict(previous[variant])
+    record.pop("samples", None)
+    if samples:
+        record["samples"] = samples
+    return record
+
+
+def remove_old_output(path):
+    """Remove compressed copies of an output which has been written again"""
+    for suffix in SUFFIXES.values():
+        try:
+            os.remove(f"{path}{suffix}")
+        except FileNotFoundError:
+            pass
@@ -7,6 +7,7 @@ Database insertion utilities for ClinVar query results.
 This module provides helper functions to insert or update records
 related to:
 - Patient metadata
+- Annotation runs (one per ingested ClinVar file)
 - Patient–variant associations
 - ClinVar annotations
 
@@ -17,12 +18,71 @@ configured elsewhere in the application.
 #Developed with the aid of CHATGPT
 
 import sqlite3
+from itertools import islice
 
 from clinvar_query.utils.paths import database_file
 from clinvar_query.utils.logger import logger
+from clinvar_query.modules.genomic_regions import (
+    parse_variant_id,
+    region_bin,
+)
+from clinvar_query.modules.clinvar_terms import (
+    condition_tokens,
+    normalise_condition,
+)
+
+# statements shared by the single record inserts and insert_annotation_batch
+patient_sql = """
+    INSERT OR IGNORE INTO patient_information
+    (patient_id)
+    VALUES (?)
+"""
 
-from clinvar_query.utils.paths import database_file
-from clinvar_query.utils.logger import logger
+# an existing association is moved to the new run
+variant_sql = """
+    INSERT INTO variants
+    (variant_id, patient_id, patient_variant, run_id)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (patient_variant) DO UPDATE SET
+        run_id = excluded.run_id,
+        date_annotated = CURRENT_TIMESTAMP
+"""
+
+location_sql = """
+    INSERT OR IGNORE INTO variant_locations
+    (variant_id, chromosome, start, end, bin)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+clinvar_sql = """
+    INSERT OR IGNORE INTO clinvar
+    (
+        variant_id,
+        hgvs,
+        chromosome,
+        gene,
+        classification_id,
+        review_status_id,
+        stars,
+        allele_frequency
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+clinvar_condition_sql = """
+    INSERT OR IGNORE INTO clinvar_conditions
+    (variant_id, condition_id)
+    VALUES (?, ?)
+"""
+
+variant_gene_sql = """
+    INSERT OR IGNORE INTO variant_genes
+    (hgnc_id, variant_id)
+    VALUES (?, ?)
+"""
+
+# annotations written by insert_annotation_batch in each transaction
+BATCH_SIZE = 10000
 
 
 def insert_patient_information(data):
@@ -51,16 +111,7 @@ def insert_patient_information(data):
         cursor = con.cursor()
 
         # Insert patient information if it does not already exist
-        cursor.execute(
-            """
-            INSERT OR IGNORE INTO patient_information
-            (patient_id)
-            VALUES (?)
-            """,
-            (
-                data.get("patient_id"),
-            ),
-        )
+        cursor.execute(patient_sql, (data.get("patient_id"),))
 
         # Commit the transaction to persist changes
         con.commit()
@@ -82,6 +133,224 @@ def insert_patient_information(data):
         con.close()
 
 
+def start_annotation_run(patient_id, source_file, source_modified=None):
+    """
+        Open an annotation run for one ingested ClinVar file.
+
+        Parameters
+        ----------
+        patient_id : str
+            Patient the file belongs to.
+        source_file : str
+            Name of the ClinVar JSON file being ingested.
+        source_modified : float, optional
+            Modification time of the file, used to tell whether a file
+            has changed since it was last ingested.
+
+        Returns
+        -------
+        int
+            The ``run_id`` to attach to the variants of this file.
+        """
+    try:
+        con = sqlite3.connect(database_file)
+        cursor = con.cursor()
+        cursor.execute(
+            """
+            INSERT INTO annotation_runs
+            (patient_id, source_file, source_modified)
+            VALUES (?, ?, ?)
+            """,
+            (patient_id, source_file, source_modified),
+        )
+        con.commit()
+
+        logger.info(
+            "Started annotation run %s for %s", cursor.lastrowid, source_file
+        )
+        return cursor.lastrowid
+
+    except sqlite3.DatabaseError:
+        logger.exception(
+            "Failed to start annotation run for %s", source_file
+        )
+        raise
+
+    finally:
+        con.close()
+
+
+def finish_annotation_run(run_id, variant_count):
+    """
+        Close an annotation run, after which it can be shown as the
+        latest batch on the results page.
+
+        Parameters
+        ----------
+        run_id : int
+            Run returned by ``start_annotation_run``.
+        variant_count : int
+            Number of variants in the run.
+        """
+    try:
+        con = sqlite3.connect(database_file)
+        con.execute(
+            """
+            UPDATE annotation_runs
+            SET finished_at = CURRENT_TIMESTAMP, variant_count = ?
+            WHERE run_id = ?
+            """,
+            (variant_count, run_id),
+        )
+        con.commit()
+
+        logger.info(
+            "Finished annotation run %s with %s variants",
+            run_id,
+            variant_count,
+        )
+
+    except sqlite3.DatabaseError:
+        logger.exception("Failed to finish annotation run %s", run_id)
+        raise
+
+    finally:
+        con.close()
+
+
+def is_already_ingested(source_file, source_modified):
+    """
+        Check whether a ClinVar file has already been ingested
+        and has not been modified since.
+
+        Returns
+        -------
+        bool
+            True if a finished run exists for this file and modification time.
+        """
+    try:
+        con = sqlite3.connect(database_file)
+        row = con.execute(
+            """
+            SELECT 1 FROM annotation_runs
+            WHERE source_file = ?
+                AND source_modified >= ?
+                AND finished_at IS NOT NULL
+            LIMIT 1
+            """,
+            (source_file, source_modified),
+        ).fetchone()
+        return row is not None
+
+    except sqlite3.DatabaseError:
+        logger.exception(
+            "Failed to look up annotation runs for %s", source_file
+        )
+        return False
+
+    finally:
+        con.close()
+
+
+def previous_associations(source_file):
+    """
+        Patient–variant associations from earlier runs of a ClinVar file.
+
+        Returns
+        -------
+        set of str
+            The ``patient_variant`` ids, empty if the file has not been
+            ingested before.
+        """
+    try:
+        con = sqlite3.connect(database_file)
+        rows = con.execute(
+            """
+            SELECT patient_variant FROM variants
+            WHERE run_id IN (
+                SELECT run_id FROM annotation_runs WHERE source_file = ?
+            )
+            """,
+            (source_file,),
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    except sqlite3.DatabaseError:
+        logger.exception(
+            "Failed to look up earlier variants for %s", source_file
+        )
+        raise
+
+    finally:
+        con.close()
+
+
+def drop_variants(patient_variants, source_file):
+    """
+        Remove patient–variant associations which are no longer in a
+        patient file. Only associations from earlier runs of the file are
+        removed, another file may have added the same one since. The
+        ClinVar records are kept, other patients may share them.
+
+        Returns
+        -------
+        int
+            Number of associations removed.
+        """
+    try:
+        con = sqlite3.connect(database_file)
+        cursor = con.executemany(
+            """
+            DELETE FROM variants
+            WHERE patient_variant = ? AND run_id IN (
+                SELECT run_id FROM annotation_runs WHERE source_file = ?
+            )
+            """,
+            [(patient_variant, source_file)
+             for patient_variant in patient_variants],
+        )
+        con.commit()
+
+        logger.info("Removed %s variant associations", cursor.rowcount)
+        return cursor.rowcount
+
+    except sqlite3.DatabaseError:
+        logger.exception("Failed to remove variant associations")
+        raise
+
+    finally:
+        con.close()
+
+
+def move_variants(patient_variants, run_id):
+    """
+        Move patient–variant associations which are still in a patient
+        file to its new run, so the run lists every variant of the file.
+        Their annotation is kept as it is, nothing is queried again.
+
+        Returns
+        -------
+        int
+            Number of associations moved.
+        """
+    try:
+        con = sqlite3.connect(database_file)
+        cursor = con.executemany(
+            "UPDATE variants SET run_id = ? WHERE patient_variant = ?",
+            [(run_id, patient_variant) for patient_variant in patient_variants],
+        )
+        con.commit()
+        return cursor.rowcount
+
+    except sqlite3.DatabaseError:
+        logger.exception("Failed to move variant associations to run %s",
+                         run_id)
+        raise
+
+    finally:
+        con.close()
+
+
 def insert_variants(data):
     """
        Insert or update patient–variant association records.
@@ -100,6 +369,16 @@ def insert_variants(data):
 
            patient_variant : str
                Composite identifier linking patient and variant.
+
+           run_id : int or None
+               Annotation run that produced this association.
+
+       Notes
+       -----
+       - An existing association is moved to the new run, so a patient
+         that is annotated again shows up as the latest batch.
+       - The chromosome position read from the variant id is stored in
+         ``variant_locations`` for region queries.
        """
     logger.debug("Preparing to insert variant record: %s", data)
 
@@ -107,20 +386,22 @@ def insert_variants(data):
         # Open a database connection
         con = sqlite3.connect(database_file)
         cursor = con.cursor()
-        # Insert the patient–variant association if absent
+        # Insert the patient–variant association, or move it to this run
         cursor.execute(
-            """
-            INSERT OR IGNORE INTO variants
-            (variant_id, patient_id, patient_variant)
-            VALUES (?, ?, ?)
-            """,
+            variant_sql,
             (
                 data.get("variant_id"),
                 data.get("patient_id"),
                 data.get("patient_variant"),
+                data.get("run_id"),
             ),
         )
 
+        # Record where the variant is for region queries
+        location = location_row(data.get("variant_id"))
+        if location:
+            cursor.execute(location_sql, location)
+
         con.commit()
 
         logger.info(
@@ -138,6 +419,151 @@ def insert_variants(data):
         con.close()
 
 
+def location_row(variant_id):
+    """The variant_locations row for a variant id, None if it has no position"""
+    location = parse_variant_id(variant_id)
+    if not location:
+        return None
+    chromosome, start, end = location
+    return variant_id, chromosome, start, end, region_bin(start, end)
+
+
+def term_id(cursor, table, column, value):
+    """
+        Return the id of a value in one of the small lookup tables
+        (classifications, review_statuses, conditions), adding it first
+        if it has not been seen before.
+
+        Returns
+        -------
+        int or None
+            None when there is no value to store.
+        """
+    if not value:
+        return None
+
+    cursor.execute(
+        f"INSERT OR IGNORE INTO {table} ({column}) VALUES (?)", (value,)
+    )
+    cursor.execute(
+        f"SELECT rowid FROM {table} WHERE {column} = ?", (value,)
+    )
+    return cursor.fetchone()[0]
+
+
+def condition_term_id(cursor, condition_name):
+    """
+    Return the id of a condition, adding it with its normalised name and
+    search tokens if it has not been seen before.
+    """
+    condition_id = term_id(cursor, "conditions", "condition_name",
+                           condition_name)
+    if condition_id is None:
+        return None
+
+    cursor.execute(
+        """
+        UPDATE conditions SET normalised_name = ?
+        WHERE condition_id = ? AND normalised_name IS NULL
+        """,
+        (normalise_condition(condition_name), condition_id),
+    )
+    if cursor.rowcount:
+        cursor.executemany(
+            """
+            INSERT OR IGNORE INTO condition_tokens (token, condition_id)
+            VALUES (?, ?)
+            """,
+            [(token, condition_id)
+             for token in condition_tokens(condition_name)],
+        )
+    return condition_id
+
+
+def insert_gene(cursor, hgnc_id, symbols, variant_id):
+    """
+    Add a gene to the gene index and link the variant to it.
+
+    Parameters
+    ----------
+    hgnc_id : str
+        HGNC id from VariantValidator, e.g. ``HGNC:18618``.
+    symbols : list of str or None
+        Symbols seen for the gene, the first one (from VariantValidator)
+        is kept as the gene symbol and all of them are stored as aliases.
+    variant_id : str
+    """
+    symbols = symbols or [None]
+    symbol = symbols[0]
+    symbols = [alias for alias in symbols if alias]
+
+    cursor.execute(
+        """
+        INSERT INTO genes (hgnc_id, symbol) VALUES (?, ?)
+        ON CONFLICT (hgnc_id) DO UPDATE SET
+            symbol = COALESCE(excluded.symbol, genes.symbol)
+        """,
+        (hgnc_id, symbol),
+    )
+    cursor.executemany(
+        "INSERT OR IGNORE INTO gene_aliases (alias, hgnc_id) VALUES (?, ?)",
+        [(symbol.upper(), hgnc_id) for symbol in dict.fromkeys(symbols)],
+    )
+    cursor.execute(variant_gene_sql, (hgnc_id, variant_id))
+
+
+def alias_hgnc_id(cursor, symbol):
+    """
+    The HGNC id of a gene symbol already in the gene index, None when it
+    is not there or is an alias of more than one gene
+    """
+    rows = cursor.execute(
+        "SELECT hgnc_id FROM gene_aliases WHERE alias = ? LIMIT 2",
+        (symbol.upper(),),
+    ).fetchall()
+    return rows[0][0] if len(rows) == 1 else None
+
+
+def clinvar_row(cursor, data, terms=None):
+    """
+    The clinvar row for a ClinVar record, with the lookup table ids.
+    terms is an optional dictionary of ids already looked up, so a batch
+    looks each classification and review status up once.
+    """
+    # Safely coerce allele frequency to float
+    af = data.get("allele_frequency")
+    try:
+        allele_frequency = float(af) if af is not None else None
+    except (ValueError, TypeError):
+        logger.warning(
+            "Invalid allele frequency for variant %s: %s",
+            data.get("variant_id"),
+            af,
+        )
+        allele_frequency = None
+
+    terms = {} if terms is None else terms
+    ids = []
+    for table, column, key in [
+        ("classifications", "classification", "consensus_classification"),
+        ("review_statuses", "review_status", "review_status"),
+    ]:
+        value = data.get(key)
+        if (table, value) not in terms:
+            terms[(table, value)] = term_id(cursor, table, column, value)
+        ids.append(terms[(table, value)])
+
+    return (
+        data.get("variant_id"),
+        data.get("hgvs"),
+        data.get("chromosome"),
+        data.get("gene"),
+        *ids,
+        data.get("stars"),
+        allele_frequency,
+    )
+
+
 def insert_clinvar(data):
     """
     Insert or update ClinVar variant information into the database.
@@ -148,62 +574,47 @@ def insert_clinvar(data):
         Dictionary containing:
         - variant_id (str)
         - hgvs (str)
-        - associated_conditions (str or None)
+        - conditions (list of str)
         - gene (str or None)
+        - hgnc_id (str or None)
+        - gene_symbols (list of str or None)
         - chromosome (str or None)
         - consensus_classification (str or None)
-        - star_rating (str)
+        - review_status (str or None)
+        - stars (int)
         - allele_frequency (float or None)
 
     Notes
     -----
     Allele frequency is explicitly coerced to a float (or None)
     to avoid SQLite type ambiguity.
+
+    The classification, review status and conditions are stored in
+    lookup tables and referenced by id, the star rating text is built
+    when results are displayed.
     """
     logger.debug("Preparing to insert ClinVar record: %s", data)
 
-    # Safely coerce allele frequency to float
-    af = data.get("allele_frequency")
-    try:
-        allele_frequency = float(af) if af is not None else None
-    except (ValueError, TypeError):
-        logger.warning(
-            "Invalid allele frequency for variant %s: %s",
-            data.get("variant_id"),
-            af,
-        )
-        allele_frequency = None
-
     try:
         con = sqlite3.connect(database_file)
         cursor = con.cursor()
 
-        cursor.execute(
-            """
-            INSERT OR IGNORE INTO clinvar
-            (
-                variant_id,
-                hgvs,
-                associated_conditions,
-                chromosome,
-                gene,
-                consensus_classification,
-                star_rating,
-                allele_frequency
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
+        cursor.execute(clinvar_sql, clinvar_row(cursor, data))
+
+        # Link the variant to each of its conditions
+        for condition in data.get("conditions") or []:
+            condition_id = condition_term_id(cursor, condition)
+            if condition_id is None:
+                continue
+            cursor.execute(clinvar_condition_sql,
+                           (data.get("variant_id"), condition_id))
+
+        # Add the gene to the gene index
+        if data.get("hgnc_id"):
+            insert_gene(
+                cursor, data["hgnc_id"], data.get("gene_symbols"),
                 data.get("variant_id"),
-                data.get("hgvs"),
-                data.get("associated_conditions"),
-                data.get("chromosome"),
-                data.get("gene"),
-                data.get("consensus_classification"),
-                data.get("star_rating"),
-                data.get("allele_frequency"),
-            ),
-        )
+            )
 
         con.commit()
 
@@ -219,4 +630,111 @@ def insert_clinvar(data):
         raise
 
     finally:
-        con.close()
\ No newline at end of file
+        con.close()
+
+
+def insert_annotation_batch(annotations, run_id, default_patient,
+                            batch_size=None):
+    """
+    Insert the ClinVar annotations of a whole file on one connection.
+
+    Parameters
+    ----------
+    annotations : iterable of dict
+        ClinVar records as ``insert_clinvar`` takes, each with the
+        ``samples`` carrying the variant.
+    run_id : int
+        Annotation run the associations belong to.
+    default_patient : str
+        Patient for a record with no samples.
+    batch_size : int, optional
+        Number of annotations written with ``executemany`` in each
+        transaction, ``BATCH_SIZE`` by default.
+
+    Returns
+    -------
+    int
+        Number of patient–variant associations inserted.
+
+    Notes
+    -----
+    The statements are the ones the single record inserts use, but each
+    batch is written in one transaction rather than a connection and
+    commit per row. Lookup table ids are kept for the whole file.
+    Committing each batch keeps the write lock short while the rest of
+    the file is read, the run is only finished once all of it is in.
+
+    A record with a gene symbol and no HGNC id (the ClinVar VCF only has
+    NCBI gene ids) is linked to the gene index when the symbol is already
+    in it.
+    """
+    annotations = iter(annotations)
+    batch_size = batch_size or BATCH_SIZE
+    terms = {}
+    patients = set()
+    inserted = 0
+
+    try:
+        con = sqlite3.connect(database_file)
+        cursor = con.cursor()
+
+        while True:
+            batch = list(islice(annotations, batch_size))
+            if not batch:
+                break
+
+            patient_rows, variant_rows, location_rows = [], [], []
+            clinvar_rows, condition_rows, gene_rows = [], [], []
+            for annotation in batch:
+                variant_id = annotation.get("variant_id")
+                for carrier in annotation.get("samples") or [default_patient]:
+                    if carrier not in patients:
+                        patients.add(carrier)
+                        patient_rows.append((carrier,))
+                    variant_rows.append((variant_id, carrier,
+                                         f"{carrier} _ ({variant_id})",
+                                         run_id))
+                location = location_row(variant_id)
+                if location:
+                    location_rows.append(location)
+
+                clinvar_rows.append(clinvar_row(cursor, annotation, terms))
+                for condition in annotation.get("conditions") or []:
+                    if ("conditions", condition) not in terms:
+                        terms[("conditions", condition)] = \
+                            condition_term_id(cursor, condition)
+                    condition_id = terms[("conditions", condition)]
+                    if condition_id is not None:
+                        condition_rows.append((variant_id, condition_id))
+                if annotation.get("hgnc_id"):
+                    insert_gene(cursor, annotation["hgnc_id"],
+                                annotation.get("gene_symbols"), variant_id)
+                elif annotation.get("gene"):
+                    gene = annotation["gene"]
+                    if ("genes", gene) not in terms:
+                        terms[("genes", gene)] = alias_hgnc_id(cursor, gene)
+                    if terms[("genes", gene)]:
+                        gene_rows.append((terms[("genes", gene)], variant_id))
+
+            cursor.executemany(patient_sql, patient_rows)
+            cursor.executemany(variant_sql, variant_rows)
+            cursor.executemany(location_sql, location_rows)
+            cursor.executemany(clinvar_sql, clinvar_rows)
+            cursor.executemany(clinvar_condition_sql, condition_rows)
+            cursor.executemany(variant_gene_sql, gene_rows)
+            con.commit()
+
+            inserted += len(variant_rows)
+            logger.info("Inserted a batch of %s variant associations",
+                        len(variant_rows))
+
+    except sqlite3.DatabaseError:
+        logger.exception("Failed to insert a batch of annotations for run %s",
+                         run_id)
+        raise
+
+    finally:
+        if 'con' in locals():
+            con.close()
+
+    return inserted
@@ -0,0 +1,241 @@
+import datetime
+import gzip
+import os
+import sqlite3
+import tarfile
+import time
+from pathlib import Path
+from clinvar_query.utils.logger import logger
+from clinvar_query.utils.paths import (
+    archive_folder,
+    clinvar_folder,
+    database_file,
+    validator_folder,
+)
+from clinvar_query.utils.settings import retention_days
+from clinvar_query.modules.compressed_files import base_name, stored_file
+from clinvar_query.modules.insert_annotated_results import is_already_ingested
+
+"""
+Archiving of the validator and clinvar files once they are in the database.
+
+Every stage lists its whole folder on each run, so the folders are kept
+down to the files still being worked on. When archive_ingested is set in
+utils/settings.py, after each pipeline run every clinvar file with a
+finished annotation run (and the validator file it was made from) is
+moved into a tar bundle for the day, archive_folder/<YYYY-MM-DD>.tar,
+under validator/<name> and clinvar/<name>.
+
+The archived_files table indexes each file by (stage, file_stem) with its
+bundle and where its bytes start in the bundle, so retrieve reads a file
+straight back without going through the tar. vv_variant_query and
+process_clinvar also look files up here, so a file whose output has been
+archived is not queried again.
+
+Bundles older than retention_days are deleted, their index rows are kept
+(without a bundle) so the files are still known to be done.
+Processed files are left where they are, they are listed on the results page.
+
+Run it on its own with python -m clinvar_query.modules.intermediate_archive
+"""
+
+STAGE_FOLDERS = {"validator": validator_folder, "clinvar": clinvar_folder}
+
+archive_schema = """
+    CREATE TABLE IF NOT EXISTS archived_files (
+        stage TEXT NOT NULL,
+        file_stem TEXT NOT NULL,
+        bundle TEXT,
+        member TEXT,
+        data_offset INTEGER,
+        size INTEGER,
+        archived_at REAL,
+        PRIMARY KEY (stage, file_stem)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_archived_files_bundle
+        ON archived_files (bundle);
+"""
+
+
+def connect_archive(database):
+    con = sqlite3.connect(database)
+    con.executescript(archive_schema)
+    return con
+
+
+def archived_at(stage, file_stem, database=database_file):
+    """When the file for a stage was archived, None if it has not been.
+    The database is only read, nothing is created when there is no archive"""
+    try:
+        con = sqlite3.connect(f"file:{database}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return None
+    try:
+        row = con.execute(
+            """SELECT archived_at FROM archived_files
+            WHERE stage = ? AND file_stem = ?""",
+            (stage, file_stem)).fetchone()
+        return row[0] if row else None
+    except sqlite3.Error:
+        return None
+    finally:
+        con.close()
+
+
+def is_archived(stage, file_stem, database=database_file):
+    """True if the file for a stage has been archived"""
+    return archived_at(stage, file_stem, database) is not None
+
+
+def ingested_stems(folder=clinvar_folder):
+    """Stems of the clinvar files which have been fully ingested"""
+    stems = []
+    for path in sorted(Path(folder).glob("*.json*")):
+        name = base_name(path)
+        if not name.endswith(".json"):
+            continue
+        if is_already_ingested(name, path.stat().st_mtime):
+            stems.append(name[:-len(".json")])
+    return stems
+
+
+def archive_ingested(folders=None, bundle_folder=archive_folder,
+                     database=database_file, today=None):
+    """
+    Move the files of every ingested clinvar file into today's bundle.
+
+    Returns
+    -------
+    int
+        Number of files archived.
+    """
+    folders = folders or STAGE_FOLDERS
+    stems = ingested_stems(folders["clinvar"])
+    if not stems:
+        return 0
+
+    today = today or datetime.date.today()
+    os.makedirs(bundle_folder, exist_ok=True)
+    bundle = Path(bundle_folder) / f"{today.isoformat()}.tar"
+
+    rows = []
+    archived = []
+    with tarfile.open(bundle, "a") as tar:
+        for stem in stems:
+            for stage, folder in folders.items():
+                path = stored_file(Path(folder) / f"{stem}.json")
+                if path is None:
+                    continue
+                member = f"{stage}/{Path(path).name}"
+                tar.add(path, arcname=member)
+                # the data is the last (block padded) thing written
+                size = tar.members[-1].size
+                blocks = -(-size // tarfile.BLOCKSIZE)
+                rows.append((stage, stem, bundle.name, member,
+                             tar.offset - blocks * tarfile.BLOCKSIZE, size,
+                             time.time()))
+                archived.append(path)
+
+    # the index is written before the files are removed, so a file is
+    # never gone without a record of where it went
+    con = connect_archive(database)
+    try:
+        with con:
+            con.executemany(
+                """INSERT OR REPLACE INTO archived_files
+                (stage, file_stem, bundle, member, data_offset, size,
+                 archived_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)""", rows)
+    finally:
+        con.close()
+
+    for path in archived:
+        os.remove(path)
+    logger.info(f"Archived {len(archived)} files to {bundle}")
+    return len(archived)
+
+
+def retrieve(stage, file_stem, bundle_folder=archive_folder,
+             database=database_file):
+    """
+    Read an archived file back from its bundle.
+
+    Returns
+    -------
+    str or None
+        The file content (decompressed if it was compressed), or None if
+        it was not archived or its bundle is past retention.
+    """
+    con = connect_archive(database)
+    try:
+        row = con.execute(
+            """SELECT bundle, data_offset, size FROM archived_files
+            WHERE stage = ? AND file_stem = ?""",
+            (stage, file_stem)).fetchone()
+    finally:
+        con.close()
+    if not row or row[0] is None:
+        return None
+
+    bundle, offset, size = row
+    with open(Path(bundle_folder) / bundle, "rb") as f:
+        f.seek(offset)
+        content = f.read(size)
+    if content.startswith(b"\x1f\x8b"):
+        content = gzip.decompress(content)
+    return content.decode("utf-8")
+
+
+def enforce_retention(days=retention_days, bundle_folder=archive_folder,
+                      database=database_file, today=None):
+    """
+    Delete the bundles older than the retention period.
+
+    Returns
+    -------
+    list of str
+        Names of the bundles deleted.
+    """
+    if days is None or not os.path.isdir(bundle_folder):
+        return []
+    today = today or datetime.date.today()
+    cutoff = today - datetime.timedelta(days=days)
+
+    expired = []
+    for bundle in sorted(Path(bundle_folder).glob("*.tar")):
+        try:
+            bundle_date = datetime.date.fromisoformat(bundle.stem)
+        except ValueError:
+            continue
+        if bundle_date < cutoff:
+            expired.append(bundle)
+
+    if not expired:
+        return []
+    con = connect_archive(database)
+    try:
+        with con:
+            con.executemany(
+                """UPDATE archived_files
+                SET bundle = NULL, member = NULL, data_offset = NULL
+                WHERE bundle = ?""", [(bundle.name,) for bundle in expired])
+    finally:
+        con.close()
+    for bundle in expired:
+        os.remove(bundle)
+        logger.info(f"Deleted archive bundle {bundle.name} past retention")
+    return [bundle.name for bundle in expired]
+
+
+def compact_intermediates():
+    """Archive the ingested files and apply the retention period"""
+    try:
+        archive_ingested()
+        enforce_retention()
+    except Exception:
+        logger.exception("Archiving intermediate files failed")
+
+
+if __name__ == "__main__":
+    compact_intermediates()
@@ -0,0 +1,93 @@
+import json
+import os
+from clinvar_query.utils.logger import logger
+from clinvar_query.modules.compressed_files import open_text
+
+"""
+Reading and writing the validator and clinvar intermediate files.
+
+The files are written as JSON Lines, one variant record per line:
+{"variant":"12-40367069-A-G","g_hgvs":"NC_000012.12:g.40367069A>G",...}
+{"variant":"1-2-A-G","g_hgvs":"NC_000001.11:g.2A>G",...}
+so each stage writes a record as soon as it has it and the next stage
+reads them one line at a time, neither holds the whole file in memory.
+
+The file names stay <name>.json. Files from before this change hold one
+JSON array, read_records still reads them (whole, as before). Files which
+have been compressed (see compressed_files.py) are read the same way.
+
+Records are written to <name>.json.part which is renamed when the file is
+complete, so the skip logic and the next stage never pick up a file that
+was cut short. A .part file can be read with read_records while it is
+being written, a line which is not complete yet is skipped.
+"""
+
+PART_SUFFIX = ".part"
+
+
+def json_lines(file, path):
+    with file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logger.warning(f"Skipping unreadable line {number} in {path}")
+
+
+def read_records(path):
+    """
+    Open an intermediate file and read its records.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        A JSON Lines file, or an older file holding one JSON array.
+
+    Returns
+    -------
+    iterator of dict
+        The records in file order, read line by line for JSON Lines.
+
+    Raises
+    ------
+    OSError
+        If the file cannot be opened.
+    ValueError
+        If an older JSON array file is not valid JSON.
+    """
+    with open_text(path) as file:
+        start = file.read(64).lstrip()
+
+    file = open_text(path)
+    if start.startswith("["):
+        # older files are one JSON array
+        with file:
+            return iter(json.load(file))
+    return json_lines(file, path)
+
+
+def open_records(path):
+    """Start writing records to path, they go to path.part until finished"""
+    return open(f"{path}{PART_SUFFIX}", "w")
+
+
+def write_record(file, record):
+    """Write one record as a line of JSON"""
+    file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+def finish_records(file, path):
+    """Close the records file and move it to its final name"""
+    file.close()
+    os.replace(f"{path}{PART_SUFFIX}", path)
+
+
+def discard_records(file, path):
+    """Close and remove a records file which could not be finished"""
+    file.close()
+    try:
+        os.remove(f"{path}{PART_SUFFIX}")
+    except OSError:
+        pass
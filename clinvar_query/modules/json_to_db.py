@@ -6,31 +6,254 @@ Process ClinVar JSON result files and insert annotated variant data
 into the database.
 
 This script:
-- Reads ClinVar JSON files from a configured directory
-- Extracts variant, HGNC gene symbol, consensus classification,
+- Reads ClinVar JSON files from a configured directory, a record
+  (JSON line) at a time
+- Extracts variant, HGNC gene id and symbol, consensus classification,
   associated conditions, star rating, and allele frequency
-- Normalises ClinVar review status into star ratings
+- Normalises ClinVar review status into star counts
 - Inserts patient, variant, and ClinVar records into the database
+- Records one annotation run per file, which the variants point to,
+  and skips files that were already ingested and have not changed
+  (a file with no valid entries gets an empty run)
+- Links each variant from a multi-sample file to every sample carrying
+  it, the ClinVar record is stored once
+- For a file ingested before (a patient file which was overwritten),
+  only adds the variants which are new and removes the ones which are no
+  longer in it, the others are left as they are
 - Logs progress, warnings, and errors using a rotating file logger
 
 All logging is handled via the shared ClinVar_Search_logger.
 """
 
 from pathlib import Path
-import json
 from decimal import Decimal
 
-from clinvar_query.utils.paths import database_file, clinvar_folder
+from clinvar_query.utils.paths import clinvar_folder
 from clinvar_query.modules.insert_annotated_results import (
     insert_clinvar,
     insert_patient_information,
-    insert_variants
+    insert_variants,
+    start_annotation_run,
+    finish_annotation_run,
+    is_already_ingested,
+    previous_associations,
+    drop_variants,
+    move_variants,
+)
+
+from clinvar_query.modules.json_records import read_records
+from clinvar_query.modules.compressed_files import compress_file
+from clinvar_query.modules.clinvar_terms import (
+    star_count,
+    render_star_rating
 )
 
 # Project-wide configured logger (rotating file + console warnings)
 from clinvar_query.utils.logger import logger
 
 
+def build_clinvar(entry, source_name):
+    """
+    Extract the ClinVar annotation from one ClinVar result entry.
+
+    Parameters
+    ----------
+    entry : dict
+        A record from the clinvar files (or the staging store).
+    source_name : str
+        Where the entry came from, for log messages.
+
+    Returns
+    -------
+    dict or None
+        The payload for ``insert_clinvar``, or None if the entry is
+        malformed or has no ClinVar record (the reason is logged).
+    """
+    variant_str = entry.get("variant")
+    g_hgvs = entry.get("g_hgvs")
+    summary = entry.get("esummary")
+
+    # Skip entries missing critical information
+    if not variant_str or not g_hgvs or not isinstance(summary, dict):
+        logger.warning(
+            "Skipping malformed entry in %s: %s",
+            source_name,
+            entry
+        )
+        return None
+
+    # ----------------------------------------------------------
+    # Resolve ClinVar UID to the full ClinVar record
+    # ----------------------------------------------------------
+    uids = summary.get("uids")
+    if not uids:
+        logger.warning(
+            "No ClinVar UID found for variant %s",
+            variant_str
+        )
+        return None
+
+    uid = uids[0]
+    cv_data = summary.get(uid)
+
+    if not cv_data:
+        logger.error(
+            "ClinVar UID %s not found in esummary for variant %s",
+            uid,
+            variant_str
+        )
+        return None
+
+    # ----------------------------------------------------------
+    # Extract gene symbol (first gene only)
+    # ----------------------------------------------------------
+    gene = None
+    genes = cv_data.get("genes", [])
+    if genes:
+        gene = genes[0].get("symbol")
+
+    # HGNC id and symbol from VariantValidator, used for the
+    # gene index, falling back to the ClinVar symbol
+    gene_info = entry.get("gene_info") or {}
+    hgnc_id = gene_info.get("hgnc_id")
+    gene = gene or gene_info.get("symbol")
+
+    # ----------------------------------------------------------
+    # Determine chromosome from current genome assembly
+    # ----------------------------------------------------------
+    chromosome = None
+    variation_set = cv_data.get("variation_set", [])
+    if variation_set:
+        for loc in variation_set[0].get("variation_loc", []):
+            # Prefer current assembly coordinates only
+            if loc.get("status") == "current":
+                chromosome = loc.get("chr")
+                break
+
+    # ----------------------------------------------------------
+    # Germline classification and review status
+    # ----------------------------------------------------------
+    germline = cv_data.get("germline_classification", {})
+
+    classification = germline.get("description")
+    review_status = germline.get("review_status")
+
+    # Star count is stored, the rating text is built for display
+    stars_count = star_count(review_status)
+
+    # ----------------------------------------------------------
+    # Extract associated disease/phenotype names
+    # ----------------------------------------------------------
+    conditions = []
+    for trait in germline.get("trait_set", []):
+        name = trait.get("trait_name")
+        if name:
+            conditions.append(name)
+
+    # ----------------------------------------------------------
+    # Extract gnomAD allele frequency (if present)
+    # ----------------------------------------------------------
+    allele_frequency = None
+    if variation_set:
+        freq_set = variation_set[0].get("allele_freq_set", [])
+        for freq in freq_set:
+            # Restrict to gnomAD-derived frequencies only
+            source = freq.get("source", "").lower()
+            if "gnomad" in source:
+                value = freq.get("value")
+                try:
+                    allele_frequency = (
+                        float(value) if value is not None else None
+                    )
+                except (ValueError, TypeError):
+                    logger.warning(
+                        "Invalid allele frequency for variant %s: %s",
+                        variant_str,
+                        value
+                    )
+                    allele_frequency = None
+                break
+
+    # ----------------------------------------------------------
+    # Prepare database insertion payload
+    # ----------------------------------------------------------
+    return {
+        "variant_id": variant_str,
+        "consensus_classification": classification,
+        "hgvs": g_hgvs,
+        "conditions": conditions,
+        "gene": gene,
+        "hgnc_id": hgnc_id,
+        "gene_symbols": [gene_info.get("symbol"), gene],
+        "review_status": review_status,
+        "stars": stars_count,
+        "allele_frequency": allele_frequency,
+        "chromosome": chromosome,
+    }
+
+
+def patient_variant_id(patient_id, variant_id):
+    """The id linking a patient and a variant in the variants table"""
+    return f"{patient_id} _ ({variant_id})"
+
+
+def ingest_entry(clinvar, carriers, run_id, patients):
+    """
+    Insert one annotated variant for each sample carrying it.
+
+    Parameters
+    ----------
+    clinvar : dict
+        Payload from ``build_clinvar``.
+    carriers : list of str
+        Patients carrying the variant.
+    run_id : int
+        Annotation run the variants belong to.
+    patients : set of str
+        Patients already inserted in this run, added to as they are.
+
+    Returns
+    -------
+    int
+        Number of patient variants inserted.
+    """
+    variant_str = clinvar["variant_id"]
+    inserted = 0
+
+    for carrier in carriers:
+        if carrier not in patients:
+            insert_patient_information({"patient_id": carrier})
+            patients.add(carrier)
+
+        variants = {
+            "variant_id": variant_str,
+            "patient_id": carrier,
+            "patient_variant": patient_variant_id(carrier, variant_str),
+            "run_id": run_id,
+        }
+
+        insert_variants(variants)
+        inserted += 1
+
+    insert_clinvar(clinvar)
+
+    # Decimal formatting for logging readability
+    allele_frequency = clinvar["allele_frequency"]
+    allele_frequency_str = (
+        format(Decimal(str(allele_frequency)).normalize(), "f")
+        if allele_frequency is not None else "None found"
+    )
+    logger.info(
+        "Inserted variant %s | classification=%s | review=%s "
+        "| gnomAD_AF=%s",
+        variant_str,
+        clinvar["consensus_classification"],
+        render_star_rating(clinvar["review_status"], clinvar["stars"]),
+        allele_frequency_str,
+    )
+    return inserted
+
+
 def json_to_dir():
     """
     Process all ClinVar JSON files in the configured directory.
@@ -63,12 +286,18 @@ def json_to_dir():
     # Process each JSON file independently to avoid cascading failures
     # ------------------------------------------------------------------
     for json_file in json_files:
+        # Files ingested before are skipped unless they have changed
+        source_modified = json_file.stat().st_mtime
+        if is_already_ingested(json_file.name, source_modified):
+            logger.info("Skipping already ingested file: %s", json_file.name)
+            continue
+
         logger.info("Processing file: %s", json_file.name)
 
         try:
-            # Load JSON content from file
-            with open(json_file, "r") as f:
-                variants_data = json.load(f)
+            # Records are read one line at a time (older files are
+            # one JSON array and are loaded whole)
+            variants_data = read_records(json_file)
 
             # File naming convention:
             #   <patient_id>_<test_type>.json
@@ -80,196 +309,95 @@ def json_to_dir():
             logger.exception("Failed to load JSON file: %s", json_file)
             continue
 
+        # Variants from an earlier version of the file are not queried or
+        # inserted again, they are moved to the new run at the end and
+        # those no longer in it are removed
+        try:
+            previous = previous_associations(json_file.name)
+        except Exception:
+            logger.exception("Skipping %s, its earlier variants could not "
+                             "be read", json_file.name)
+            continue
+        seen = set()
+
+        # The annotation run is opened with the first valid variant
+        run_id = None
+        inserted = 0
+        patients = set()
+
         # --------------------------------------------------------------
         # Iterate through each variant entry in the JSON payload
         # --------------------------------------------------------------
         for entry in variants_data:
-            variant_str = entry.get("variant")
-            g_hgvs = entry.get("g_hgvs")
-            summary = entry.get("esummary")
-
-            # Skip entries missing critical information
-            if not variant_str or not g_hgvs or not isinstance(summary, dict):
-                logger.warning(
-                    "Skipping malformed entry in %s: %s",
-                    json_file.name,
-                    entry
-                )
-                continue
-
-            # ----------------------------------------------------------
-            # Resolve ClinVar UID to the full ClinVar record
-            # ----------------------------------------------------------
-            uids = summary.get("uids")
-            if not uids:
-                logger.warning(
-                    "No ClinVar UID found for variant %s",
-                    variant_str
-                )
+            clinvar = build_clinvar(entry, json_file.name)
+            if clinvar is None:
                 continue
 
-            uid = uids[0]
-            cv_data = summary.get(uid)
-
-            if not cv_data:
-                logger.error(
-                    "ClinVar UID %s not found in esummary for variant %s",
-                    uid,
-                    variant_str
-                )
+            # Multi-sample files list the samples carrying the variant,
+            # each one is linked as a patient, otherwise the patient is
+            # taken from the file name
+            carriers = entry.get("samples") or [patient_id]
+            links = {carrier: patient_variant_id(carrier,
+                                                 clinvar["variant_id"])
+                     for carrier in carriers}
+            seen.update(links.values())
+            carriers = [carrier for carrier, link in links.items()
+                        if link not in previous]
+            if not carriers:
                 continue
 
             # ----------------------------------------------------------
-            # Extract gene symbol (first gene only)
-            # ----------------------------------------------------------
-            gene = None
-            genes = cv_data.get("genes", [])
-            if genes:
-                gene = genes[0].get("symbol")
-
-            # ----------------------------------------------------------
-            # Determine chromosome from current genome assembly
+            # Insert records into the database
             # ----------------------------------------------------------
-            chromosome = None
-            variation_set = cv_data.get("variation_set", [])
-            if variation_set:
-                for loc in variation_set[0].get("variation_loc", []):
-                    # Prefer current assembly coordinates only
-                    if loc.get("status") == "current":
-                        chromosome = loc.get("chr")
-                        break
+            try:
+                if run_id is None:
+                    run_id = start_annotation_run(
+                        patient_id, json_file.name, source_modified
+                    )
 
-            # ----------------------------------------------------------
-            # Germline classification and review status
-            # ----------------------------------------------------------
-            germline = cv_data.get("germline_classification", {})
-
-            classification = germline.get("description")
-            review_status = germline.get("review_status")
-
-            # Mapping of ClinVar review status text to star rating
-            review_to_stars = {
-                "no assertion": 0,
-                "criteria provided, single submitter": 1,
-                "criteria provided, multiple submitters, no conflicts": 2,
-                "reviewed by expert panel": 3,
-                "practice guideline": 4,
-            }
-
-            # Default to zero stars if no review status is available
-            stars_count = 0
-            if review_status:
-                review_norm = review_status.strip().lower()
-                for key, value in review_to_stars.items():
-                    if key in review_norm:
-                        stars_count = value
-                        break
-
-            # Human-readable star representation
-            stars_visual = "⭐" * stars_count + "☆" * (4 - stars_count)
-            star_rating = (
-                f"{review_status} ({stars_visual})"
-                if review_status
-                else f"Unknown ({stars_visual})"
-            )
+                inserted += ingest_entry(clinvar, carriers, run_id, patients)
 
-            # ----------------------------------------------------------
-            # Extract associated disease/phenotype names
-            # ----------------------------------------------------------
-            conditions = []
-            for trait in germline.get("trait_set", []):
-                name = trait.get("trait_name")
-                if name:
-                    conditions.append(name)
-
-            associated_conditions = (
-                "; ".join(conditions) if conditions else None
-            )
+            except Exception:
+                # Log traceback but continue processing remaining variants
+                logger.exception(
+                    "Database insertion failed for variant %s",
+                    clinvar["variant_id"]
+                )
 
-            # ----------------------------------------------------------
-            # Extract gnomAD allele frequency (if present)
-            # ----------------------------------------------------------
-            allele_frequency = None
-            if variation_set:
-                freq_set = variation_set[0].get("allele_freq_set", [])
-                for freq in freq_set:
-                    # Restrict to gnomAD-derived frequencies only
-                    source = freq.get("source", "").lower()
-                    if "gnomad" in source:
-                        value = freq.get("value")
-                        try:
-                            allele_frequency = (
-                                float(value) if value is not None else None
-                            )
-                        except (ValueError, TypeError):
-                            logger.warning(
-                                "Invalid allele frequency for variant %s: %s",
-                                variant_str,
-                                value
-                            )
-                            allele_frequency = None
-                        break
-
-            # Decimal formatting for logging readability
-            allele_frequency_decimal = (
-                Decimal(str(allele_frequency))
-                if allele_frequency is not None else None
-            )
-            allele_frequency_str = (
-                format(allele_frequency_decimal.normalize(), "f")
-                if allele_frequency_decimal is not None else "None found"
+        # Variants kept in and taken out of an overwritten file
+        kept = previous & seen
+        removed = previous - seen
+        try:
+            # the run still records that this version was ingested, also
+            # when it has no valid entries, so it is not read again
+            if run_id is None:
+                run_id = start_annotation_run(
+                    patient_id, json_file.name, source_modified
+                )
+            if kept:
+                inserted += move_variants(kept, run_id)
+            if removed:
+                drop_variants(removed, json_file.name)
+        except Exception:
+            logger.exception(
+                "Could not update the earlier variants of %s", json_file.name
             )
+            continue
 
-            # ----------------------------------------------------------
-            # Prepare database insertion payloads
-            # ----------------------------------------------------------
-            clinvar = {
-                "variant_id": variant_str,
-                "consensus_classification": classification,
-                "hgvs": g_hgvs,
-                "associated_conditions": associated_conditions,
-                "gene": gene,
-                "star_rating": star_rating,
-                "allele_frequency": allele_frequency_str,
-                "chromosome": chromosome,
-            }
-
-            patient_info = {
-                "patient_id": patient_id
-            }
-
-            variants = {
-                "variant_id": variant_str,
-                "patient_id": patient_id,
-                "patient_variant": f"{patient_id} _ ({variant_str})",
-            }
-
-            # ----------------------------------------------------------
-            # Insert records into the database
-            # ----------------------------------------------------------
+        # Close the run so it can be shown as the latest batch
+        if run_id is not None:
             try:
-                insert_patient_information(patient_info)
-                insert_variants(variants)
-                insert_clinvar(clinvar)
-
-                logger.info(
-                    "Inserted variant %s | classification=%s | review=%s "
-                    "| gnomAD_AF=%s",
-                    variant_str,
-                    classification,
-                    star_rating,
-                    allele_frequency_str,
-                )
-
+                finish_annotation_run(run_id, inserted)
             except Exception:
-                # Log traceback but continue processing remaining variants
                 logger.exception(
-                    "Database insertion failed for variant %s",
-                    variant_str
+                    "Could not finish annotation run for %s", json_file.name
                 )
+            else:
+                # the file is in the database, it is only kept as a record
+                compress_file(json_file)
 
     logger.info("All ClinVar JSON files processed successfully.")
 
 
 if __name__ == "__main__":
-    json_to_dir()
\ No newline at end of file
+    json_to_dir()
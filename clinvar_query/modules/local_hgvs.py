@@ -0,0 +1,191 @@
+import mmap
+import os
+from clinvar_query.utils.logger import logger
+from clinvar_query.modules.grch38_contigs import GRCH38_CONTIGS, canonical_contig
+
+"""
+Local g.HGVS for simple variants, read from a GRCh38 reference FASTA.
+
+process_clinvar only needs the g_hgvs string from VariantValidator, for
+substitutions, deletions, insertions and duplications that can be worked
+out here from the reference sequence and the RefSeq accession of the
+chromosome. Variants this cannot describe (or whose REF does not match the
+reference) are left for VariantValidator.
+
+The FASTA is read through its .fai index (samtools faidx, or made here if
+it is missing) and memory mapped, so only the few bases around each
+variant are read from disk.
+
+Variants are written with the HGVS 3' rule, deletions and insertions in
+a repeat are moved to their last possible position and an insertion of
+the bases just before it is written as a duplication, for example
+12-40367069-A-G                NC_000012.12:g.40367069A>G
+1-100-CAA-C  (1:100 is CAAAAG)  NC_000001.11:g.103_104del
+1-100-C-CA   (1:100 is CAAG)    NC_000001.11:g.102dup
+
+This is optional, it is switched on by setting reference_fasta in
+utils/settings.py (or the ClinVar_Search_FASTA environment variable).
+"""
+
+# how far a deletion or insertion is moved along a repeat at most,
+# longer repeats are left for VariantValidator
+MAX_SHIFT = 1000
+
+
+def index_fasta(fasta_path):
+    """Write a samtools style .fai index next to the FASTA, returns its path"""
+    fai_path = f"{fasta_path}.fai"
+    entries = []
+    name = None
+    with open(fasta_path, "rb") as fasta:
+        offset = 0
+        for line in fasta:
+            if line.startswith(b">"):
+                name = line[1:].split()[0].decode()
+                entries.append([name, 0, offset + len(line), 0, 0])
+            elif name is not None and line.strip():
+                entry = entries[-1]
+                if entry[3] == 0:
+                    entry[3] = len(line.rstrip(b"\r\n"))
+                    entry[4] = len(line)
+                entry[1] += len(line.rstrip(b"\r\n"))
+            offset += len(line)
+
+    with open(fai_path, "w") as fai:
+        for entry in entries:
+            fai.write("\t".join(str(value) for value in entry) + "\n")
+    return fai_path
+
+
+class ReferenceFasta:
+    """A FASTA file read through its .fai index with a memory map"""
+
+    def __init__(self, fasta_path):
+        fai_path = f"{fasta_path}.fai"
+        if not os.path.exists(fai_path):
+            index_fasta(fasta_path)
+
+        # contig name: (length, offset, bases per line, bytes per line)
+        self.contigs = {}
+        with open(fai_path) as fai:
+            for line in fai:
+                name, length, offset, linebases, linewidth = \
+                    line.split("\t")[:5]
+                contig = canonical_contig(name)
+                if contig:
+                    self.contigs[contig] = (int(length), int(offset),
+                                            int(linebases), int(linewidth))
+
+        self.file = open(fasta_path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def fetch(self, contig, start, end):
+        """Bases from start to end (0-based, half open), upper case"""
+        length, offset, linebases, linewidth = self.contigs[contig]
+        start = max(start, 0)
+        end = min(end, length)
+        if start >= end:
+            return ""
+
+        def byte(position):
+            return (offset + (position // linebases) * linewidth
+                    + position % linebases)
+
+        bases = self.map[byte(start):byte(end - 1) + 1]
+        return bases.replace(b"\n", b"").replace(b"\r", b"").decode().upper()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+def open_reference(fasta_path):
+    """Open the reference FASTA, None if it is not set or cannot be read"""
+    if not fasta_path:
+        return None
+    try:
+        return ReferenceFasta(fasta_path)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not open reference FASTA {fasta_path}: {e}")
+        return None
+
+
+def shift_3_prime(reference, contig, start, bases, span):
+    """
+    Move a run of bases as far 3' as the reference repeats it, returns the
+    new start (or None for very long repeats). For a deletion span is the
+    number of bases deleted from start, for an insertion before start it is 0
+    """
+    for _ in range(MAX_SHIFT):
+        if reference.fetch(contig, start + span, start + span + 1) != \
+                bases[0]:
+            return start
+        bases = bases[1:] + bases[0]
+        start += 1
+    return None
+
+
+def local_g_hgvs(reference, variant):
+    """
+    Build the g.HGVS for a chrom-pos-ref-alt variant.
+
+    Returns
+    -------
+    str or None
+        e.g. ``NC_000012.12:g.40367069A>G``, or None if the variant has to
+        go to VariantValidator.
+    """
+    try:
+        chrom, pos, ref, alt = variant.split("-")
+        contig = canonical_contig(chrom)
+        accession = GRCH38_CONTIGS[contig][1]
+        start = int(pos) - 1
+        ref, alt = ref.upper(), alt.upper()
+        if contig not in reference.contigs:
+            return None
+    except (ValueError, KeyError):
+        return None
+
+    # the REF has to match the reference, otherwise VariantValidator
+    # gives the proper error
+    if reference.fetch(contig, start, start + len(ref)) != ref:
+        return None
+
+    # remove the bases REF and ALT share (e.g. the VCF anchor base)
+    while ref and alt and ref[-1] == alt[-1]:
+        ref, alt = ref[:-1], alt[:-1]
+    while ref and alt and ref[0] == alt[0]:
+        ref, alt = ref[1:], alt[1:]
+        start += 1
+
+    if len(ref) == 1 and len(alt) == 1:
+        return f"{accession}:g.{start + 1}{ref}>{alt}"
+
+    if ref and not alt:
+        start = shift_3_prime(reference, contig, start, ref, len(ref))
+        if start is None:
+            return None
+        if len(ref) == 1:
+            return f"{accession}:g.{start + 1}del"
+        return f"{accession}:g.{start + 1}_{start + len(ref)}del"
+
+    if alt and not ref:
+        shifted = shift_3_prime(reference, contig, start, alt, 0)
+        if shifted is None:
+            return None
+        # the inserted bases rotate as they move along the repeat
+        turn = (shifted - start) % len(alt)
+        alt = alt[turn:] + alt[:turn]
+        start = shifted
+        if reference.fetch(contig, start - len(alt), start) == alt:
+            if len(alt) == 1:
+                return f"{accession}:g.{start}dup"
+            return f"{accession}:g.{start - len(alt) + 1}_{start}dup"
+        return f"{accession}:g.{start}_{start + 1}ins{alt}"
+
+    if ref and alt:
+        if len(ref) == 1:
+            return f"{accession}:g.{start + 1}delins{alt}"
+        return f"{accession}:g.{start + 1}_{start + len(ref)}delins{alt}"
+
+    return None
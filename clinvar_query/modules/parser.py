@@ -1,10 +1,14 @@
 
 from clinvar_query.utils.logger import logger
+from clinvar_query.modules.genomic_regions import parse_variant_id
+from clinvar_query.modules.gene_panel import in_panel
+from clinvar_query.modules.vcf_filters import failed_filter, carrying_samples
+from clinvar_query.modules.grch38_contigs import invalid_reason, canonical_contig
 from pathlib import Path
 import csv
 
 
-def parser(file_path):
+def parser(file_path, panel=None, summary=None, filters=None):
     """This module parses through the uploaded file
 it first checks if it ends in csv or vcf
 then it extracts the data
@@ -12,50 +16,138 @@ Example input
 12,40294866,.,G,T
 Example output
 12-40294866-G-T
+
+Each variant is checked against the GRCh38 contigs (see grch38_contigs.py),
+rows with an unknown chromosome, a position past its end or alleles
+VariantValidator cannot take are added to the misaligned rows instead
+Example misaligned row
+invalid variant row ['1', '300000000', '.', 'A', 'G']: position 300000000 is past the end of chromosome 1 (248956422)
+
+If a gene panel is given (see gene_panel.py) variants outside of it
+are left out, so they are never annotated
+VCF rows are checked against the quality and genotype filters in
+vcf_filters.py (set in settings.py unless filters are given), rows which
+fail are left out
+If a summary dictionary is given, the number of variants read ("total"),
+the number dropped by the VCF filters ("filtered")
+and the number kept ("kept") are written to it
+
+A VCF with more than one sample column is read in the same pass, each
+unique variant is written once followed by a tab and the samples carrying
+it, so it is annotated once and linked to every sample afterwards
+Example output
+12-40294866-G-T	patient1,patient3
 """
 #debugged and optimised with chatGPT
 
+    try:
+        with open(file_path, newline="") as parsefile:
+            return parse_lines(parsefile, Path(file_path).suffix, panel=panel,
+                               summary=summary, filters=filters)
+    except Exception as e:
+        logger.error("Failed to parse csv/vcf file! {}" .format(e))
+        return None, None
+
+
+def parse_lines(lines, file_end, panel=None, summary=None, filters=None):
+    """Parse the lines of an upload, read from a file by parser or as the
+upload arrives (see process_uploads.py)
+file_end is the extension of the uploaded file, .csv or .vcf
+Returns the processed and misaligned strings, as parser does
+"""
+
     variants = []
     misaligned_rows = []
+    sample_names = []
+    carriers = {}
+    total = 0
+    filtered = 0
     try:
-        file_end = Path(file_path).suffix
         if file_end == ".csv":
             delimiter = ","
         elif file_end == ".vcf":
             delimiter = "\t"
         else:
             logger.error("Not csv or vcf! Check again")
-        with open(file_path, newline="") as parsefile:
-            parse_file = csv.reader(parsefile, delimiter=delimiter)
-            for row in parse_file:
-                if not row or row[0].startswith("#"):
-                    continue
+        parse_file = csv.reader(lines, delimiter=delimiter)
+        for row in parse_file:
+            # sample names are the columns after FORMAT in the header
+            if row and row[0] == "#CHROM" and len(row) > 10:
+                sample_names = [name.strip() for name in row[9:]]
+            if not row or row[0].startswith("#"):
+                continue
 
-                chrom = pos = ref = alt = None
+            chrom = pos = ref = alt = None
 
-                if len(row) >= 5:
-                    chrom = row[0].strip()
-                    pos = row[1].strip()
-                    ref = row[3].strip()
-                    alt = row[4].strip()
-                # remove "chr prefix" and then move on
-                    chrom = chrom.lstrip("chr")
+            if len(row) >= 5:
+                chrom = row[0].strip()
+                pos = row[1].strip()
+                ref = row[3].strip()
+                alt = row[4].strip()
 
-                if chrom and pos and ref and alt:
-                    variant = f"{chrom}-{pos}-{ref}-{alt}"
-                    variants.append(variant)
+            if chrom and pos and ref and alt:
+                # rows VariantValidator would reject go to misaligned
+                reason = invalid_reason(chrom, pos, ref, alt)
+                if reason:
+                    misaligned_rows.append(f"invalid variant row {row}: {reason}")
+                    logger.error(f"invalid variant row {row}: {reason}")
+                    continue
+                # chr1, NC_000001.11 and 1 are all written as 1
+                chrom = canonical_contig(chrom)
+                variant = f"{chrom}-{pos}-{ref}-{alt}"
+                total += 1
+                if sample_names:
+                    samples = carrying_samples(row, sample_names, filters)
+                    if not samples:
+                        filtered += 1
+                        logger.debug(f"{variant} is not carried by any "
+                                     f"sample passing the filters")
+                        continue
+                elif file_end == ".vcf":
+                    reason = failed_filter(row, filters)
+                    if reason:
+                        filtered += 1
+                        logger.debug(f"{variant} failed {reason} filter")
+                        continue
+                location = parse_variant_id(variant)
+                if panel and location and not in_panel(panel, *location):
+                    continue
+                if sample_names:
+                    if variant not in carriers:
+                        carriers[variant] = []
+                        variants.append(variant)
+                    carriers[variant] += [sample for sample in samples
+                                          if sample not in carriers[variant]]
                 else:
-                    misaligned_row = f"incomplete or misaligned row {row}"
-                    misaligned_rows.append(misaligned_row)
-                    logger.error(f"incomplete or misaligned row {row}")
-
-            parse_string = "\n".join(variants)
-            if misaligned_rows:
-                misaligned_string = "\n".join(misaligned_rows)
-                return parse_string, misaligned_string
+                    variants.append(variant)
             else:
-                misaligned_string = ""
-                return parse_string, misaligned_string
+                misaligned_row = f"incomplete or misaligned row {row}"
+                misaligned_rows.append(misaligned_row)
+                logger.error(f"incomplete or misaligned row {row}")
+
+        if panel:
+            logger.info(f"gene panel {panel['name']} kept "
+                        f"{len(variants)} of {total} variants")
+        if filtered:
+            logger.info(f"{filtered} of {total} variants failed "
+                        f"the vcf filters")
+        if summary is not None:
+            summary["total"] = total
+            summary["filtered"] = filtered
+            summary["kept"] = len(variants)
+            if sample_names:
+                summary["samples"] = len(sample_names)
+
+        if sample_names:
+            variants = [f"{variant}\t{','.join(carriers[variant])}"
+                        for variant in variants]
+        parse_string = "\n".join(variants)
+        if misaligned_rows:
+            misaligned_string = "\n".join(misaligned_rows)
+            return parse_string, misaligned_string
+        else:
+            misaligned_string = ""
+            return parse_string, misaligned_string
     except Exception as e:
         logger.error("Failed to parse csv/vcf file! {}" .format(e))
         return None, None
@@ -1,46 +1,69 @@
 import sqlite3
-import os
 from clinvar_query.utils.logger import logger
-from clinvar_query.utils.paths import processed_folder, error_folder
+from clinvar_query.modules.file_manifest import list_files, manifest_page
+from clinvar_query.modules.clinvar_terms import render_star_rating
+from clinvar_query.modules.filter_results import filter_clause
 from clinvar_query.utils.paths import database_file
 
 """
 The lookup module uses a sql query to output patient results in the results page
 This uses left join to combine variants and clinvar data
-and is sorted by the latest date to ensure only 1 patient is used
+and only uses the variants from the latest finished annotation run,
+one run is written for each ClinVar file ingested by json_to_dir,
+to ensure only 1 patient is used
 this is fed in latest_results to output
 patient id, variant id, consensus classification, star rating, date annotated
+The classification and review status are joined in from their lookup tables
+and the star rating text is rendered here rather than stored
 
 The file lookup section validates the existence of:
 processed file folder
 misaligned file folder
 
-This is then sorted by date
+This is then sorted by date, using the file manifest
+(see file_manifest.py) rather than listing the folders
 
 """
 #debugged with chatGPT
 
+
+def connect_results(database):
+    # the star rating is stored as a review status id and a star count,
+    # star_rating() turns these back into text as the rows are read
+    con = sqlite3.connect(database)
+    con.row_factory = sqlite3.Row
+    con.create_function("star_rating", 2, render_star_rating,
+                        deterministic=True)
+    return con
+
+
 def lookup(latest_results, files, misaligned, database,
-           process_folder, err_folder):
+           process_folder, err_folder, manifest_database=database_file):
     
     try:
-        con = sqlite3.connect(database)
-        con.row_factory = sqlite3.Row
+        con = connect_results(database)
         cur = con.cursor()
 
         cur.execute("""
             SELECT
                 variants.patient_id,
                 variants.variant_id,
-                clinvar.consensus_classification,
-                clinvar.star_rating,
+                classifications.classification AS consensus_classification,
+                star_rating(review_statuses.review_status, clinvar.stars)
+                    AS star_rating,
                 clinvar.allele_frequency,
                 variants.date_annotated
             FROM variants
             LEFT JOIN clinvar
                 ON variants.variant_id = clinvar.variant_id
-            WHERE variants.date_annotated = (
-                SELECT MAX(date_annotated) FROM variants)      
+            LEFT JOIN classifications
+                ON clinvar.classification_id = classifications.classification_id
+            LEFT JOIN review_statuses
+                ON clinvar.review_status_id = review_statuses.review_status_id
+            WHERE variants.run_id = (
+                SELECT run_id FROM annotation_runs
+                WHERE finished_at IS NOT NULL
+                ORDER BY run_id DESC LIMIT 1)
         """)
         latest_results =cur.fetchall()
 
@@ -50,31 +73,89 @@ def lookup(latest_results, files, misaligned, database,
         if 'con' in locals():
             con.close()
 
-    # processed patient file lookup made with chatGPT
+    # processed and misaligned files come from the file manifest
+    # newest first, so the folders are not listed on every view
     try:
-        if os.path.exists(process_folder):
-            files = [file for file in os.listdir(process_folder)
-                     if os.path.isfile(os.path.join(process_folder, file))]
-            files = sorted(
-                files,
-                key=lambda file: os.path.getmtime(os.path.join(
-                    process_folder, file)),
-                reverse=True
-            )
-    # files with errors in them made with chatGPT
-        else:
-            files = []
-        if os.path.exists(err_folder):
-            misaligned = [f for f in os.listdir(err_folder)
-                          if os.path.isfile(os.path.join(err_folder, f))]
-            misaligned = sorted(
-                misaligned,
-                key=lambda f: os.path.getmtime(os.path.join(err_folder, f)),
-                reverse=True
-            )
-        else:
-            misaligned = []
+        files = list_files(process_folder, database=manifest_database)
+        misaligned = list_files(err_folder, database=manifest_database)
     except Exception as e:
         logger.error("Could not fetch files : {}".format(e))
 
-    return latest_results, files, misaligned
\ No newline at end of file
+    return latest_results, files, misaligned
+
+"""
+Paged lookups for the results page
+These return a fixed size page of rows plus a cursor for the next page,
+so the size and cost of each response does not grow with the patient
+The cursor is the last key seen, rather than an offset (keyset paging)
+latest results are keyed on patient_variant
+files are keyed on (modified time, filename), newest first
+The latest results can be narrowed with the filters in filter_results.py
+"""
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def page_limit(limit):
+    # keep user supplied page sizes within sensible bounds
+    if not limit or limit < 1:
+        return PAGE_SIZE
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def latest_results_page(database, after=None, limit=PAGE_SIZE, filters=None):
+    limit = page_limit(limit)
+    rows = []
+    # optional allele frequency, star and classification filters
+    conditions, params, _ = filter_clause(filters or {})
+    where_filters = "".join(f"\n                AND {c}" for c in conditions)
+    try:
+        con = connect_results(database)
+        cur = con.cursor()
+
+        cur.execute(f"""
+            SELECT
+                variants.patient_id,
+                variants.variant_id,
+                variants.patient_variant,
+                classifications.classification AS consensus_classification,
+                star_rating(review_statuses.review_status, clinvar.stars)
+                    AS star_rating,
+                clinvar.allele_frequency,
+                variants.date_annotated
+            FROM variants
+            LEFT JOIN clinvar
+                ON variants.variant_id = clinvar.variant_id
+            LEFT JOIN classifications
+                ON clinvar.classification_id = classifications.classification_id
+            LEFT JOIN review_statuses
+                ON clinvar.review_status_id = review_statuses.review_status_id
+            WHERE variants.run_id = (
+                SELECT run_id FROM annotation_runs
+                WHERE finished_at IS NOT NULL
+                ORDER BY run_id DESC LIMIT 1)
+                AND variants.patient_variant > ?{where_filters}
+            ORDER BY variants.patient_variant
+            LIMIT ?
+        """, (after or "", *params, limit + 1))
+        rows = cur.fetchall()
+
+    except Exception as e:
+        logger.error("database error : {}".format(e))
+    finally:
+        if 'con' in locals():
+            con.close()
+
+    # one extra row is fetched to tell if there is another page
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1]["patient_variant"]
+
+    return rows, next_cursor
+
+
+def file_page(folder, after=None, limit=PAGE_SIZE, database=database_file):
+    return manifest_page(folder, after=after, limit=page_limit(limit),
+                         database=database)
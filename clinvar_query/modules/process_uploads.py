@@ -1,6 +1,18 @@
 from werkzeug.utils import secure_filename
 from clinvar_query.modules.check_file_status import app_file_check
+from clinvar_query.modules.parser import parse_lines
+from clinvar_query.modules.upload_index import (
+    discard_upload,
+    find_upload,
+    finish_upload,
+    record_upload,
+    stream_upload,
+)
 from clinvar_query.utils.logger import logger
+from clinvar_query.utils.settings import vcf_filters
+from pathlib import Path
+import hashlib
+import json
 import os
 
 """This module evaluates the state of
@@ -11,10 +23,35 @@ the redirect endpoint, the message parameters
 This will then take inputs from messages.py to output informative data
 This is fed into upload.py
 
+If a gene panel was chosen, the number of variants read and the number
+inside the panel are added to the message parameters for the job summary
+
+The upload is saved, hashed and parsed in one pass as it arrives,
+it is not read back from disk afterwards. A title which was already
+processed into the folder from the same content, panel and VCF filters
+is not saved again (see upload_index.py), the existing outputs are used
+instead
+
 """
 
 
-def process_upload_file(file, folder, processed_folder, error_folder,  overwrite=False):
+def panel_summary(panel, summary):
+    total = summary.get("total", 0)
+    kept = summary.get("kept", 0)
+    return {"panel": panel["name"], "total": total, "kept": kept}
+
+
+def upload_settings(panel=None):
+    # what the outputs depend on besides the content, so a change to the
+    # filters or to a panel's regions means the upload is processed again
+    settings = {"filters": vcf_filters,
+                "regions": panel["regions"] if panel else None}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True,
+                                     default=str).encode()).hexdigest()
+
+
+def process_upload_file(file, folder, processed_folder, error_folder,  overwrite=False,
+                        panel=None):
     # This does not have try except blocks as the logic here
     # involves redirecting to an error site.
     # However, there are  still loggers with levels to ensure it is informative
@@ -25,8 +62,54 @@ def process_upload_file(file, folder, processed_folder, error_folder,  overwrite
 
     filename = secure_filename(file.filename)
     upload_path = os.path.join(folder, filename)
-    # save the file
-    file.save(upload_path)
+    # save the file, hashing and parsing it as it is written
+    summary = {}
+    undecodable = []
+    digest = hashlib.sha256()
+    lines = stream_upload(file, upload_path, digest, undecodable=undecodable)
+    parsed = parse_upload(lines, filename, panel=panel, summary=summary,
+                          undecodable=undecodable)
+    return process_parsed_upload(file, upload_path, digest.hexdigest(),
+                                 parsed, summary, processed_folder,
+                                 error_folder, overwrite=overwrite,
+                                 panel=panel)
+
+
+def parse_upload(lines, filename, panel=None, summary=None, undecodable=()):
+    # csv and vcf files are parsed, every line is read either way
+    # so all of the upload is saved
+    parsed = None
+    if Path(filename).suffix.lower() in (".csv", ".vcf"):
+        parsed = parse_lines(lines, Path(filename).suffix, panel=panel,
+                             summary=summary)
+    for _ in lines:
+        pass
+    # rows which are not UTF-8 are left out of the lines, they are
+    # added to the misaligned rows once all of them are known
+    if parsed and parsed[0] is not None and undecodable:
+        processed, misaligned = parsed
+        rows = [f"undecodable row {line!r}" for line in undecodable]
+        parsed = processed, "\n".join(([misaligned] if misaligned else [])
+                                       + rows)
+    return parsed
+
+
+def process_parsed_upload(file, upload_path, content_hash, parsed, summary,
+                          processed_folder, error_folder, overwrite=False,
+                          panel=None):
+    # the upload is at upload_path.part, it is kept unless the title was
+    # already processed from the same content
+    filename = os.path.basename(upload_path)
+    title = Path(filename).stem
+    panel_name = panel["name"] if panel else ""
+    settings = upload_settings(panel)
+
+    known = find_upload(processed_folder, title, content_hash, panel_name,
+                        settings)
+    if known:
+        discard_upload(upload_path)
+        return unchanged_outcome(filename, file, known, panel)
+    finish_upload(upload_path)
 
     # call files
 
@@ -34,7 +117,35 @@ def process_upload_file(file, folder, processed_folder, error_folder,  overwrite
                                                 upload_path,
                                                 processed_folder,
                                                 error_folder,
-                                                overwrite=overwrite)
+                                                overwrite=overwrite,
+                                                panel=panel,
+                                                summary=summary,
+                                                parsed=parsed)
+    if processed_file and status in ("created", "overwritten"):
+        record_upload(processed_folder, content_hash, title, processed_file,
+                      misaligned_file, panel=panel_name, summary=summary,
+                      settings=settings)
+    result = outcome(filename, file, processed_file, misaligned_file, status)
+    if panel and result and \
+            result["redirect_endpoint"] == "process.upload_success":
+        result["message_params"].update(panel_summary(panel, summary))
+    return result
+
+
+def unchanged_outcome(filename, file, known, panel=None):
+    # the title was processed from the same content, its outputs are
+    # still there
+    logger.info(f"{filename} is unchanged, the existing results are kept")
+    params = {"message": "unchanged_upload", "file": file.filename,
+              "existing": known["title"]}
+    if panel:
+        params.update(panel_summary(panel, known))
+    return {"redirect_endpoint": "process.upload_success",
+            "message_params": params}
+
+
+def outcome(filename, file, processed_file, misaligned_file, status):
+    # the redirect and message for how the file was processed
 
     # look for redirecting now
     if not processed_file and status != "skipped":
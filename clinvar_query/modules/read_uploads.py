@@ -1,33 +1,129 @@
 import os
-from flask import request
+import gzip
+import zlib
+from itertools import islice
+from flask import request, send_file, Response
+from werkzeug.security import safe_join
 from clinvar_query.utils.logger import logger
+from clinvar_query.modules.compressed_files import open_text, stored_method
 
 """This is used to read uploads
 This looks for files and reads the file
 There is error handling involved
 
-If there is a done file:
-File is read
+stream_file serves the processed and misaligned files as a response which
+is sent in chunks, so large processed files are never held in memory as
+one string
+
+There are three ways to read a file:
+A line window, with ?offset=<first line>&limit=<number of lines>
+the X-Next-Offset header gives the offset of the following window,
+and is left out once the end of the file is reached
+A byte range, using a standard HTTP Range header
+The whole file, which is gzip compressed when the browser accepts it
+
+Files compressed once the pipeline finished with them are decompressed as
+they are read. A gzip file is sent as it is stored to a browser which
+accepts gzip, and byte ranges are not available for compressed files
+as they would be offsets into the compressed bytes.
 
 If there is no file:
 No file selected will pop up
 
 If there is a file but no file path:
 Please refresh and try again message pops up
-
 """
 
-def read_file(folder, filetype):
+LINE_WINDOW = 500
+MAX_LINE_WINDOW = 5000
+CHUNK_SIZE = 64 * 1024
+
+
+def gzip_chunks(file_path):
+    # wbits=31 writes a gzip header, so browsers can decode it directly
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+    yield compressor.flush()
+
+
+def plain_chunks(file_path):
+    with open_text(file_path) as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), ""):
+            yield chunk.encode("utf-8")
+
+
+def accepts_gzip():
+    return "gzip" in request.headers.get("Accept-Encoding", "").lower()
+
+
+def read_window(file_path, offset, limit):
+    limit = min(max(limit, 1), MAX_LINE_WINDOW)
+    offset = max(offset, 0)
+    # one line past the window is read to tell if the file carries on
+    with open_text(file_path) as f:
+        lines = list(islice(f, offset, offset + limit + 1))
+
+    next_offset = None
+    if len(lines) > limit:
+        lines = lines[:limit]
+        next_offset = offset + limit
+
+    content = "".join(lines).encode("utf-8")
+    if accepts_gzip():
+        content = gzip.compress(content)
+        response = Response(content, mimetype="text/plain")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(content, mimetype="text/plain")
+
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["X-Line-Offset"] = str(offset)
+    if next_offset is not None:
+        response.headers["X-Next-Offset"] = str(next_offset)
+    return response
+
+
+def stream_file(folder, filetype):
     try:
         done_file = request.args.get(filetype)
         if not done_file:
             return "No file selected!", 400
 
-        file_path = os.path.join(folder, done_file)
-        if not os.path.exists(file_path):
-            return "File not found, please refresh and try again."
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
+        file_path = safe_join(str(folder), done_file)
+        if not file_path or not os.path.isfile(file_path):
+            return "File not found, please refresh and try again.", 404
+
+        offset = request.args.get("offset", type=int)
+        limit = request.args.get("limit", type=int)
+        if offset is not None or limit is not None:
+            return read_window(file_path, offset or 0, limit or LINE_WINDOW)
+
+        method = stored_method(file_path)
+        if method == "gzip" and accepts_gzip():
+            # already gzip, so it is sent without compressing it again
+            response = send_file(os.path.abspath(file_path),
+                                 mimetype="text/plain", conditional=False)
+            response.headers["Content-Encoding"] = "gzip"
+            response.headers["Vary"] = "Accept-Encoding"
+            return response
+        if method:
+            return Response(plain_chunks(file_path), mimetype="text/plain")
+
+        # ranges are byte offsets into the file as stored,
+        # so these are left to send_file which handles Range and 206
+        if request.range or not accepts_gzip():
+            return send_file(os.path.abspath(file_path), mimetype="text/plain",
+                             conditional=True)
+
+        response = Response(gzip_chunks(file_path), mimetype="text/plain")
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
     except Exception as e:
         logger.error("Reading processed or misaligned files has failed : {}".format(e))
-    return content
+        return "Reading this file has failed, please try again.", 500
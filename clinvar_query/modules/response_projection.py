@@ -0,0 +1,157 @@
+import gzip
+import json
+import os
+from pathlib import Path
+from clinvar_query.utils.paths import raw_archive_folder
+from clinvar_query.utils.settings import archive_raw_responses
+
+"""
+Compact records for the VariantValidator and ClinVar responses.
+
+The pipeline only reads a few fields from each response:
+VariantFormatter - the g_hgvs and the HGNC gene of the first transcript
+ESummary         - for the first ClinVar record, the gene symbol, the
+                   current chromosome, the gnomAD allele frequency and the
+                   germline classification, review status and conditions
+
+These are picked out as soon as a response comes back and only they are
+written to the validator and clinvar folders, the rest of each response
+(transcripts, submitters, every assembly and frequency source...) is
+dropped. The ClinVar record keeps the ESummary layout, so json_to_dir reads
+projected and older full files the same way.
+
+The full responses can still be kept by setting archive_raw_responses in
+utils/settings.py, they are then written gzipped, one JSON line per
+variant, to raw_archive_folder/<stage>/<file name>.jsonl.gz.
+"""
+
+
+def get_gene_info(variant_result) -> dict:
+    """
+        Pull the HGNC gene id and symbol out of a VariantFormatter result.
+
+        The gene is reported for each transcript under ``hgvs_t_and_p``,
+        the first transcript with an HGNC id is used.
+
+        Parameters
+        ----------
+        variant_result : dict
+            The per-variant VariantFormatter result holding ``g_hgvs``.
+
+        Returns
+        -------
+        dict or None
+            ``{"hgnc_id": ..., "symbol": ...}``, or None if no transcript
+            reports a gene.
+        """
+    transcripts = variant_result.get("hgvs_t_and_p") or {}
+    if not isinstance(transcripts, dict):
+        return None
+
+    for transcript in transcripts.values():
+        gene_info = (transcript or {}).get("gene_info") or {}
+        if gene_info.get("hgnc_id"):
+            return {
+                "hgnc_id": gene_info["hgnc_id"],
+                "symbol": gene_info.get("symbol"),
+            }
+    return None
+
+
+def project_vv(variant, response):
+    """
+        Compact record for a VariantFormatter response.
+
+        Returns
+        -------
+        dict
+            ``{"variant", "g_hgvs", "gene_info"}``, g_hgvs is None if the
+            response does not describe the variant.
+        """
+    try:
+        variant_result = response[variant][variant]
+    except (KeyError, TypeError):
+        variant_result = None
+    if not isinstance(variant_result, dict):
+        variant_result = {}
+
+    return {
+        "variant": variant,
+        "g_hgvs": variant_result.get("g_hgvs"),
+        "gene_info": get_gene_info(variant_result),
+    }
+
+
+def project_clinvar_record(record):
+    """The fields json_to_dir reads from one ESummary record"""
+    germline = record.get("germline_classification") or {}
+    genes = record.get("genes") or []
+
+    variation_set = []
+    if record.get("variation_set"):
+        variation = record["variation_set"][0] or {}
+        variation_set.append({
+            "variation_loc": [
+                {"status": loc.get("status"), "chr": loc.get("chr")}
+                for loc in variation.get("variation_loc") or []
+                if loc.get("status") == "current"
+            ][:1],
+            "allele_freq_set": [
+                {"source": freq.get("source"), "value": freq.get("value")}
+                for freq in variation.get("allele_freq_set") or []
+                if "gnomad" in (freq.get("source") or "").lower()
+            ][:1],
+        })
+
+    return {
+        "genes": [{"symbol": gene.get("symbol")} for gene in genes[:1]],
+        "variation_set": variation_set,
+        "germline_classification": {
+            "description": germline.get("description"),
+            "review_status": germline.get("review_status"),
+            "trait_set": [{"trait_name": trait.get("trait_name")}
+                          for trait in germline.get("trait_set") or []
+                          if trait.get("trait_name")],
+        },
+    }
+
+
+def project_esummary(summary):
+    """
+        Compact ESummary result, keeping only the first ClinVar record.
+
+        Returns
+        -------
+        dict
+            ``{"uids": [uid], uid: record}``, or an empty dict when there
+            is no record.
+        """
+    uids = (summary or {}).get("uids") or []
+    if not uids or not isinstance(summary.get(uids[0]), dict):
+        return {}
+    return {"uids": uids[:1],
+            uids[0]: project_clinvar_record(summary[uids[0]])}
+
+
+def open_raw_archive(stage, file_name):
+    """
+        Open the raw response archive for one input file.
+
+        Returns
+        -------
+        file or None
+            A gzip text file to pass to archive_response, None when
+            archiving is switched off.
+        """
+    if not archive_raw_responses:
+        return None
+    folder = Path(raw_archive_folder) / stage
+    os.makedirs(folder, exist_ok=True)
+    return gzip.open(folder / f"{Path(file_name).stem}.jsonl.gz", "at")
+
+
+def archive_response(archive, variant, response):
+    """Add a full response to an open archive, if there is one"""
+    if archive is not None:
+        archive.write(json.dumps({"variant": variant, "response": response})
+                      + "\n")
@@ -1,5 +1,7 @@
-from clinvar_query.utils.paths import processed_folder
+from clinvar_query.utils.paths import database_file, processed_folder
 from clinvar_query.utils.logger import logger
+from clinvar_query.modules.file_manifest import record_file, forget_file
+from clinvar_query.modules.compressed_files import stored_file
 import os
 
 """
@@ -17,17 +19,23 @@ created = where a file is created
 overwritten = where a file has been overwritten
 skipped = where a file has not been overwritten
 error = where there has been an error
+
+Every file written is recorded in the file manifest,
+which the results page uses to list the processed and misaligned files,
+the manifest is kept in the database passed in (the app database by default)
 """
 
 def save_output_to_file(content, title, folder=processed_folder,
-                        overwrite=False):
+                        overwrite=False, database=database_file):
 
     """Saves the processed content to the processed folder."""
     os.makedirs(folder, exist_ok=True)
     output_path = os.path.join(folder, f"{title}_processed.txt")
 
-# first evaluate if file exists
-    file_exists = os.path.isfile(output_path)
+# first evaluate if file exists, it may have been compressed
+# once it was annotated
+    stored_path = stored_file(output_path)
+    file_exists = stored_path is not None
 
     try:
         if file_exists and not overwrite:
@@ -35,12 +43,16 @@ def save_output_to_file(content, title, folder=processed_folder,
                            "already exists and overwrite is False")
             return None, "skipped"
         status = "overwritten" if file_exists else "created"
+        if file_exists and stored_path != output_path:
+            os.remove(stored_path)
+            forget_file(stored_path, database=database)
     except Exception as e:
         logger.error(f"Error writing to {output_path} : {str(e)}")
 
     try:
         with open(output_path, 'w') as f:
             f.write(content)
+        record_file(output_path, database=database)
         return output_path, status
     except Exception as e:
         logger.error(f"Error writing to {output_path} : {str(e)}")
@@ -1,4 +1,11 @@
 import sqlite3
+import json
+from clinvar_query.utils.logger import logger
+from clinvar_query.modules.patient_lookup import connect_results, page_limit
+from clinvar_query.modules.patient_lookup import PAGE_SIZE
+from clinvar_query.modules.filter_results import filter_clause
+from clinvar_query.modules.clinvar_terms import condition_tokens
+from clinvar_query.modules.genomic_regions import overlapping_bin_ranges
 
 """This search function uses sql queries to pore through the database
 This looks for matches of the whole string or integer to return all relevant tables
@@ -15,28 +22,83 @@ Variant_id     Chromosome  Hgnc_id     Gene_symbol     Mane_select
 12-40294866-G-T   12      HGNC:18618   LRRK2          NM_198578.4:c.2830G>T
 """
 
+# clinvar holds ids for the classification, review status and conditions
+# (see add_dictionary_tables in setup_results.py), their text is joined
+# back in so the clinvar rows are searched and shown as they were stored
+clinvar_search = """
+    SELECT
+        clinvar.variant_id,
+        classifications.classification AS consensus_classification,
+        clinvar.hgvs,
+        (SELECT group_concat(conditions.condition_name, '; ')
+         FROM clinvar_conditions
+         JOIN conditions
+            ON conditions.condition_id = clinvar_conditions.condition_id
+         WHERE clinvar_conditions.variant_id = clinvar.variant_id)
+            AS associated_conditions,
+        clinvar.gene,
+        star_rating(review_statuses.review_status, clinvar.stars)
+            AS star_rating,
+        clinvar.allele_frequency,
+        clinvar.chromosome
+    FROM clinvar
+    LEFT JOIN classifications
+        ON clinvar.classification_id = classifications.classification_id
+    LEFT JOIN review_statuses
+        ON clinvar.review_status_id = review_statuses.review_status_id
+"""
+
+clinvar_columns = ["variant_id", "consensus_classification", "hgvs",
+                   "associated_conditions", "gene", "star_rating",
+                   "allele_frequency", "chromosome"]
+
+# only the tables with patient results are searched, the rest of the
+# database (runs, indexes, the file manifest, upload records) is kept
+# off the search page
+searched_tables = ["patient_information", "variants", "clinvar"]
+
+# a variant with several conditions is found by any one of them
+condition_match = """
+    "variant_id" IN (
+        SELECT clinvar_conditions.variant_id
+        FROM conditions
+        JOIN clinvar_conditions
+            ON clinvar_conditions.condition_id = conditions.condition_id
+        WHERE conditions.condition_name LIKE ?)
+"""
+
+
 def search_results(database_file, query_data, results):
     #parts of this were made with chatGPT
     try:
-        con = sqlite3.connect(database_file)
-        con.row_factory = sqlite3.Row
+        con = connect_results(database_file)
         cur = con.cursor()
 
         cur.execute("SELECT name from sqlite_master WHERE type='table';")
-        tables = [row[0] for row in cur.fetchall()]
+        tables = {row[0] for row in cur.fetchall()}
 
-        for table in tables:
-            cur.execute(f"PRAGMA table_info({table})")
-            columns = [row["name"] for row in cur.fetchall()]
+        for table in searched_tables:
+            if table not in tables:
+                continue
+            source = f'"{table}"'
+            if table == "clinvar" and "classifications" in tables:
+                source = f"({clinvar_search})"
+                columns = clinvar_columns
+            else:
+                cur.execute(f"PRAGMA table_info({table})")
+                columns = [row["name"] for row in cur.fetchall()]
 
             if not columns:
                 continue
 
-            where_clause = " OR ".join([f'"{col}" LIKE ?' for col in columns])
+            matches = [f'"{col}" LIKE ?' for col in columns]
+            if source != f'"{table}"':
+                matches.append(condition_match)
+            where_clause = " OR ".join(matches)
 
-            values = [f"{query_data}"] * len(columns)
+            values = [f"{query_data}"] * len(matches)
 
-            cur.execute(f'SELECT * FROM "{table}" WHERE {where_clause}',
+            cur.execute(f'SELECT * FROM {source} WHERE {where_clause}',
                         values)
             rows = cur.fetchall()
 
@@ -52,4 +114,350 @@ def search_results(database_file, query_data, results):
     finally:
         if 'con' in locals():
             con.close()
-    return results
\ No newline at end of file
+    return results
+
+
+"""filter_variants returns annotated variants matching the filters in
+filter_results.py, across every patient, one page at a time
+Rows are read in order of the indexed column being filtered on,
+then variant id, and the cursor for the next page holds both values
+The input:
+{"af_max": 0.01, "min_stars": 2}
+The output:
+Variant_id        Gene   Consensus_classification  Star_rating   Allele_frequency
+6-162727667-A-G   PACRG  Pathogenic                ...(⭐⭐☆☆)    3e-05
+"""
+
+
+def filter_variants(database_file, filters, after=None, limit=PAGE_SIZE):
+    limit = page_limit(limit)
+    conditions, params, sort_column = filter_clause(filters)
+    sort_column = sort_column or "clinvar.variant_id"
+
+    if after:
+        try:
+            sort_value, variant_id = json.loads(after)
+            conditions.append(f"({sort_column}, clinvar.variant_id) > (?, ?)")
+            params += [sort_value, variant_id]
+        except (ValueError, TypeError):
+            logger.warning("Invalid filter cursor : {}".format(after))
+
+    where_clause = " AND ".join(conditions) if conditions else "1"
+    rows = []
+    try:
+        con = connect_results(database_file)
+        cur = con.cursor()
+        cur.execute(f"""
+            SELECT
+                clinvar.variant_id,
+                clinvar.hgvs,
+                clinvar.gene,
+                classifications.classification AS consensus_classification,
+                star_rating(review_statuses.review_status, clinvar.stars)
+                    AS star_rating,
+                clinvar.allele_frequency,
+                {sort_column} AS sort_value
+            FROM clinvar
+            LEFT JOIN classifications
+                ON clinvar.classification_id = classifications.classification_id
+            LEFT JOIN review_statuses
+                ON clinvar.review_status_id = review_statuses.review_status_id
+            WHERE {where_clause}
+            ORDER BY {sort_column}, clinvar.variant_id
+            LIMIT ?
+        """, (*params, limit + 1))
+        rows = [dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        logger.error("database error : {}".format(e))
+    finally:
+        if 'con' in locals():
+            con.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = json.dumps([rows[-1]["sort_value"],
+                                  rows[-1]["variant_id"]])
+    for row in rows:
+        row.pop("sort_value")
+
+    return rows, next_cursor
+
+
+"""search_conditions finds the patients with variants linked to a condition
+Every word in the query has to start one of the words in the condition name,
+so "cardiomyo" finds "Dilated cardiomyopathy 1A" and "parkinson 8" finds
+"Parkinson disease 8, autosomal dominant"
+The words are looked up in the condition_tokens index and the variants are
+then followed through clinvar_conditions, so the time taken depends on the
+number of matches rather than the number of variants in the database
+The input:
+cardiomyo
+The output:
+Condition                    Variant_id         Patient_id   Gene
+Dilated cardiomyopathy 1A    1-156130687-C-T    patient1     LMNA
+"""
+
+
+def search_conditions(database_file, query_data, after=None, limit=PAGE_SIZE):
+    limit = page_limit(limit)
+    tokens = condition_tokens(query_data)
+    if not tokens:
+        return [], None
+
+    # tokens only hold a-z and 0-9, so every word starting with the
+    # token sorts before the token followed by "{"
+    matched = " INTERSECT ".join(
+        ["SELECT condition_id FROM condition_tokens"
+         " WHERE token >= ? AND token < ?"] * len(tokens))
+    params = [bound for token in tokens for bound in (token, token + "{")]
+
+    where_clause = "1"
+    if after:
+        try:
+            condition_id, variant_id, patient_id = json.loads(after)
+            where_clause = """(clinvar_conditions.condition_id,
+                               clinvar_conditions.variant_id,
+                               variants.patient_id) > (?, ?, ?)"""
+            params += [condition_id, variant_id, patient_id]
+        except (ValueError, TypeError):
+            logger.warning("Invalid condition cursor : {}".format(after))
+
+    rows = []
+    try:
+        con = connect_results(database_file)
+        cur = con.cursor()
+        cur.execute(f"""
+            WITH matched (condition_id) AS ({matched})
+            SELECT
+                conditions.condition_id,
+                conditions.condition_name AS condition,
+                clinvar_conditions.variant_id,
+                variants.patient_id,
+                clinvar.hgvs,
+                clinvar.gene,
+                classifications.classification AS consensus_classification
+            FROM matched
+            JOIN conditions
+                ON conditions.condition_id = matched.condition_id
+            JOIN clinvar_conditions
+                ON clinvar_conditions.condition_id = matched.condition_id
+            JOIN variants
+                ON variants.variant_id = clinvar_conditions.variant_id
+            LEFT JOIN clinvar
+                ON clinvar.variant_id = clinvar_conditions.variant_id
+            LEFT JOIN classifications
+                ON clinvar.classification_id = classifications.classification_id
+            WHERE {where_clause}
+            ORDER BY clinvar_conditions.condition_id,
+                     clinvar_conditions.variant_id,
+                     variants.patient_id
+            LIMIT ?
+        """, (*params, limit + 1))
+        rows = [dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        logger.error("database error : {}".format(e))
+    finally:
+        if 'con' in locals():
+            con.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = json.dumps([last["condition_id"], last["variant_id"],
+                                  last["patient_id"]])
+    for row in rows:
+        row.pop("condition_id")
+
+    return rows, next_cursor
+
+
+"""search_gene looks up a gene by HGNC id (HGNC:18618), symbol or alias
+and returns the patients with variants in it, with the number of variants
+and patients for the gene
+Each part is read through the variant_genes key and the
+variants (variant_id, patient_id) index, so the time taken depends on the
+size of the gene rather than the number of variants in the database
+The input:
+LRRK2
+The output:
+{"hgnc_id": "HGNC:18618", "symbol": "LRRK2", "variant_count": 1,
+ "patient_count": 1}
+Variant_id        Patient_id   Consensus_classification
+12-40294866-G-T   patient1     Pathogenic
+"""
+
+
+def find_gene(cur, gene):
+    gene = gene.strip()
+    if gene.upper().startswith("HGNC:"):
+        cur.execute("SELECT hgnc_id, symbol FROM genes WHERE hgnc_id = ?",
+                    ("HGNC:" + gene[5:],))
+    else:
+        # the current symbol is preferred over an alias of another gene
+        cur.execute("""
+            SELECT genes.hgnc_id, genes.symbol
+            FROM gene_aliases
+            JOIN genes ON genes.hgnc_id = gene_aliases.hgnc_id
+            WHERE gene_aliases.alias = ?
+            ORDER BY genes.symbol = gene_aliases.alias DESC
+            LIMIT 1
+        """, (gene.upper(),))
+    return cur.fetchone()
+
+
+def search_gene(database_file, gene, after=None, limit=PAGE_SIZE):
+    limit = page_limit(limit)
+    summary = None
+    rows = []
+    try:
+        con = connect_results(database_file)
+        cur = con.cursor()
+
+        found = find_gene(cur, gene)
+        if found is None:
+            return None, [], None
+        hgnc_id = found["hgnc_id"]
+
+        cur.execute("""
+            SELECT
+                count(DISTINCT variant_genes.variant_id) AS variant_count,
+                count(DISTINCT variants.patient_id) AS patient_count
+            FROM variant_genes
+            JOIN variants ON variants.variant_id = variant_genes.variant_id
+            WHERE variant_genes.hgnc_id = ?
+        """, (hgnc_id,))
+        summary = {"hgnc_id": hgnc_id, "symbol": found["symbol"],
+                   **dict(cur.fetchone())}
+
+        where_clause = "variant_genes.hgnc_id = ?"
+        params = [hgnc_id]
+        if after:
+            try:
+                variant_id, patient_id = json.loads(after)
+                where_clause += """ AND (variant_genes.variant_id,
+                                         variants.patient_id) > (?, ?)"""
+                params += [variant_id, patient_id]
+            except (ValueError, TypeError):
+                logger.warning("Invalid gene cursor : {}".format(after))
+
+        cur.execute(f"""
+            SELECT
+                variant_genes.variant_id,
+                variants.patient_id,
+                clinvar.hgvs,
+                classifications.classification AS consensus_classification,
+                star_rating(review_statuses.review_status, clinvar.stars)
+                    AS star_rating,
+                clinvar.allele_frequency
+            FROM variant_genes
+            JOIN variants ON variants.variant_id = variant_genes.variant_id
+            LEFT JOIN clinvar ON clinvar.variant_id = variant_genes.variant_id
+            LEFT JOIN classifications
+                ON clinvar.classification_id = classifications.classification_id
+            LEFT JOIN review_statuses
+                ON clinvar.review_status_id = review_statuses.review_status_id
+            WHERE {where_clause}
+            ORDER BY variant_genes.variant_id, variants.patient_id
+            LIMIT ?
+        """, (*params, limit + 1))
+        rows = [dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        logger.error("database error : {}".format(e))
+    finally:
+        if 'con' in locals():
+            con.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = json.dumps([rows[-1]["variant_id"],
+                                  rows[-1]["patient_id"]])
+
+    return summary, rows, next_cursor
+
+
+"""search_region returns the annotated variants overlapping a region, with
+the patients they were found in, in order of position
+Only the bins which can overlap the region are read from the
+variant_locations (chromosome, bin, start) index, so the variants outside
+the region are never looked at
+The input:
+("12", 40199999, 40400000), from parse_region("chr12:40,200,000-40,400,000")
+The output:
+Variant_id        Chromosome  Start      End        Patient_id  Gene
+12-40367069-A-G   12          40367068   40367069   test1       LRRK2
+"""
+
+
+def search_region(database_file, region, after=None, limit=PAGE_SIZE):
+    limit = page_limit(limit)
+    chromosome, start, end = region
+    # one range of bins for each bin size, so a whole chromosome is
+    # still five ranges rather than thousands of bins
+    bin_ranges = overlapping_bin_ranges(start, end)
+
+    # the chromosome is repeated in each range so every one of them is a
+    # search of the (chromosome, bin) index
+    in_bins = " OR ".join(["""(variant_locations.chromosome = ?
+        AND variant_locations.bin BETWEEN ? AND ?)"""] * len(bin_ranges))
+    where_clause = f"""
+        ({in_bins})
+        AND variant_locations.start < ?
+        AND variant_locations.end > ?
+    """
+    params = [value for first, last in bin_ranges
+              for value in (chromosome, first, last)] + [end, start]
+    if after:
+        try:
+            position, variant_id, patient_id = json.loads(after)
+            where_clause += """ AND (variant_locations.start,
+                                     variant_locations.variant_id,
+                                     variants.patient_id) > (?, ?, ?)"""
+            params += [position, variant_id, patient_id]
+        except (ValueError, TypeError):
+            logger.warning("Invalid region cursor : {}".format(after))
+
+    rows = []
+    try:
+        con = connect_results(database_file)
+        cur = con.cursor()
+        cur.execute(f"""
+            SELECT
+                variant_locations.variant_id,
+                variant_locations.chromosome,
+                variant_locations.start,
+                variant_locations.end,
+                variants.patient_id,
+                clinvar.gene,
+                clinvar.hgvs,
+                classifications.classification AS consensus_classification
+            FROM variant_locations
+            JOIN variants
+                ON variants.variant_id = variant_locations.variant_id
+            LEFT JOIN clinvar
+                ON clinvar.variant_id = variant_locations.variant_id
+            LEFT JOIN classifications
+                ON clinvar.classification_id = classifications.classification_id
+            WHERE {where_clause}
+            ORDER BY variant_locations.start,
+                     variant_locations.variant_id,
+                     variants.patient_id
+            LIMIT ?
+        """, (*params, limit + 1))
+        rows = [dict(row) for row in cur.fetchall()]
+    except Exception as e:
+        logger.error("database error : {}".format(e))
+    finally:
+        if 'con' in locals():
+            con.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = json.dumps([last["start"], last["variant_id"],
+                                  last["patient_id"]])
+
+    return rows, next_cursor
@@ -1,9 +1,49 @@
 import sqlite3
 import os
 from clinvar_query.utils.paths import database_file
+from clinvar_query.modules.file_manifest import manifest_schema
+from clinvar_query.modules.genomic_regions import (
+    parse_variant_id,
+    region_bin,
+)
+from clinvar_query.modules.clinvar_terms import (
+    parse_star_rating,
+    condition_tokens,
+    normalise_condition,
+)
 
 #Developed with the aid of CHATGPT
 
+# Tables as they were first released, later changes are in MIGRATIONS
+base_schema = """
+PRAGMA foreign_keys = ON;
+
+CREATE TABLE IF NOT EXISTS patient_information (
+    patient_id TEXT PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS variants (
+    variant_id TEXT,
+    patient_id TEXT,
+    patient_variant TEXT PRIMARY KEY,
+    date_annotated DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (patient_id) REFERENCES patient_information(patient_id)
+);
+
+CREATE TABLE IF NOT EXISTS clinvar (
+    variant_id TEXT PRIMARY KEY,
+    consensus_classification TEXT,
+    hgvs TEXT,
+    associated_conditions TEXT,
+    gene TEXT,
+    star_rating TEXT,
+    allele_frequency REAL,
+    chromosome TEXT,
+    FOREIGN KEY (variant_id) REFERENCES variants (variant_id)
+);
+"""
+
+
 def create_database(path=None):
     """
     Create SQLite database and tables.
@@ -17,41 +57,401 @@ def create_database(path=None):
     if parent_dir:
         os.makedirs(parent_dir, exist_ok=True)
 
-    sql_script = """
-    PRAGMA foreign_keys = ON;
+    try:
+        with sqlite3.connect(db_path) as con:
+            cursor = con.cursor()
+            cursor.executescript(base_schema)
+            con.commit()
 
-    CREATE TABLE IF NOT EXISTS patient_information (
-        patient_id TEXT PRIMARY KEY
-    );
+    except sqlite3.OperationalError as e:
+        raise RuntimeError(f"Database creation failed at {db_path}: {e}")
 
-    CREATE TABLE IF NOT EXISTS variants (
-        variant_id TEXT,
+    upgrade_database(db_path)
+
+    print("✅ Database and tables created successfully:", db_path)
+
+
+def run_script(con, script):
+    """
+    Run the statements of a script one at a time with execute.
+    executescript commits first, this keeps every statement in the
+    transaction of the migration it is part of
+    """
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            con.execute(statement)
+            statement = ""
+    if statement.strip():
+        con.execute(statement)
+
+
+def add_annotation_runs(con):
+    """
+    One row per ingested ClinVar file, variants point at the run that
+    last annotated them so the latest batch is found by run id.
+    Existing rows are grouped into runs by patient and date annotated,
+    which matches how the latest batch was found before
+    """
+    run_script(con, """
+    CREATE TABLE IF NOT EXISTS annotation_runs (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
         patient_id TEXT,
-        patient_variant TEXT PRIMARY KEY,
-        date_annotated DATETIME DEFAULT CURRENT_TIMESTAMP,
+        source_file TEXT,
+        source_modified REAL,
+        started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        finished_at DATETIME,
+        variant_count INTEGER DEFAULT 0,
         FOREIGN KEY (patient_id) REFERENCES patient_information(patient_id)
     );
 
-    CREATE TABLE IF NOT EXISTS clinvar (
+    CREATE INDEX IF NOT EXISTS idx_annotation_runs_source
+        ON annotation_runs (source_file, run_id);
+
+    ALTER TABLE variants ADD COLUMN run_id INTEGER
+        REFERENCES annotation_runs (run_id);
+
+    CREATE INDEX IF NOT EXISTS idx_variants_run
+        ON variants (run_id, patient_variant);
+
+    DROP INDEX IF EXISTS idx_variants_latest;
+    """)
+
+    batches = con.execute("""
+        SELECT patient_id, date_annotated, COUNT(*)
+        FROM variants
+        GROUP BY patient_id, date_annotated
+        ORDER BY date_annotated, patient_id
+    """).fetchall()
+
+    for patient_id, date_annotated, count in batches:
+        cursor = con.execute("""
+            INSERT INTO annotation_runs
+            (patient_id, started_at, finished_at, variant_count)
+            VALUES (?, ?, ?, ?)
+        """, (patient_id, date_annotated, date_annotated, count))
+        con.execute("""
+            UPDATE variants SET run_id = ?
+            WHERE patient_id IS ? AND date_annotated IS ?
+        """, (cursor.lastrowid, patient_id, date_annotated))
+
+
+def add_dictionary_tables(con):
+    """
+    The classification, review status and condition text is stored once
+    in small lookup tables and referenced by integer id from clinvar,
+    along with the star count. Existing text is moved into the lookup
+    tables and the old text columns are cleared
+    """
+    run_script(con, """
+    CREATE TABLE IF NOT EXISTS classifications (
+        classification_id INTEGER PRIMARY KEY,
+        classification TEXT UNIQUE NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS review_statuses (
+        review_status_id INTEGER PRIMARY KEY,
+        review_status TEXT UNIQUE NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS conditions (
+        condition_id INTEGER PRIMARY KEY,
+        condition_name TEXT UNIQUE NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS clinvar_conditions (
+        variant_id TEXT,
+        condition_id INTEGER REFERENCES conditions (condition_id),
+        PRIMARY KEY (variant_id, condition_id)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS idx_clinvar_conditions_condition
+        ON clinvar_conditions (condition_id, variant_id);
+
+    ALTER TABLE clinvar ADD COLUMN classification_id INTEGER
+        REFERENCES classifications (classification_id);
+    ALTER TABLE clinvar ADD COLUMN review_status_id INTEGER
+        REFERENCES review_statuses (review_status_id);
+    ALTER TABLE clinvar ADD COLUMN stars INTEGER;
+
+    CREATE INDEX IF NOT EXISTS idx_clinvar_classification
+        ON clinvar (classification_id);
+    CREATE INDEX IF NOT EXISTS idx_clinvar_stars
+        ON clinvar (stars);
+    """)
+
+    def term_id(table, column, value):
+        if not value:
+            return None
+        con.execute(f"INSERT OR IGNORE INTO {table} ({column}) VALUES (?)",
+                    (value,))
+        return con.execute(f"SELECT rowid FROM {table} WHERE {column} = ?",
+                           (value,)).fetchone()[0]
+
+    rows = con.execute("""
+        SELECT variant_id, consensus_classification, star_rating,
+               associated_conditions
+        FROM clinvar
+    """).fetchall()
+
+    for variant_id, classification, star_rating, conditions in rows:
+        review_status, stars = parse_star_rating(star_rating)
+        con.execute("""
+            UPDATE clinvar SET
+                classification_id = ?,
+                review_status_id = ?,
+                stars = ?,
+                consensus_classification = NULL,
+                star_rating = NULL,
+                associated_conditions = NULL
+            WHERE variant_id = ?
+        """, (term_id("classifications", "classification", classification),
+              term_id("review_statuses", "review_status", review_status),
+              stars if star_rating else None,
+              variant_id))
+
+        for condition in (conditions or "").split("; "):
+            condition_id = term_id("conditions", "condition_name", condition)
+            if condition_id:
+                con.execute("""
+                    INSERT OR IGNORE INTO clinvar_conditions
+                    (variant_id, condition_id) VALUES (?, ?)
+                """, (variant_id, condition_id))
+
+
+# allele frequency was stored as text by older versions,
+# including "None found" when there was no gnomAD frequency
+numeric_allele_frequency = """
+    UPDATE clinvar
+    SET allele_frequency = CASE
+        WHEN trim(allele_frequency) GLOB '[0-9.]*'
+            THEN CAST(trim(allele_frequency) AS REAL)
+        ELSE NULL
+    END
+    WHERE typeof(allele_frequency) = 'text';
+
+    CREATE INDEX IF NOT EXISTS idx_clinvar_allele_frequency
+        ON clinvar (allele_frequency, variant_id);
+    CREATE INDEX IF NOT EXISTS idx_clinvar_stars_variant
+        ON clinvar (stars, variant_id);
+    CREATE INDEX IF NOT EXISTS idx_clinvar_classification_variant
+        ON clinvar (classification_id, variant_id);
+    DROP INDEX IF EXISTS idx_clinvar_stars;
+    DROP INDEX IF EXISTS idx_clinvar_classification;
+"""
+
+
+def add_condition_tokens(con):
+    """
+    Condition names are given a normalised form and are split into word
+    tokens, each token is stored with the condition it came from so a
+    condition search reads the token index and then follows
+    clinvar_conditions and variants by their indexes, without touching
+    unrelated variants
+    """
+    run_script(con, """
+    ALTER TABLE conditions ADD COLUMN normalised_name TEXT;
+
+    CREATE INDEX IF NOT EXISTS idx_conditions_normalised
+        ON conditions (normalised_name);
+
+    CREATE TABLE IF NOT EXISTS condition_tokens (
+        token TEXT,
+        condition_id INTEGER REFERENCES conditions (condition_id),
+        PRIMARY KEY (token, condition_id)
+    ) WITHOUT ROWID;
+
+    CREATE INDEX IF NOT EXISTS idx_variants_variant
+        ON variants (variant_id, patient_id);
+    """)
+
+    rows = con.execute(
+        "SELECT condition_id, condition_name FROM conditions").fetchall()
+    for condition_id, condition_name in rows:
+        con.execute(
+            "UPDATE conditions SET normalised_name = ? WHERE condition_id = ?",
+            (normalise_condition(condition_name), condition_id))
+        con.executemany(
+            "INSERT OR IGNORE INTO condition_tokens (token, condition_id)"
+            " VALUES (?, ?)",
+            [(token, condition_id)
+             for token in condition_tokens(condition_name)])
+
+
+# genes are keyed on their HGNC id from VariantValidator, with every
+# symbol seen for the gene kept as an alias (upper case) so lookups by
+# symbol or alias are one index search. variant_genes and the variants
+# (variant_id, patient_id) index cover the per-gene variant and patient
+# counts so they are read from indexes alone
+gene_tables = """
+    CREATE TABLE IF NOT EXISTS genes (
+        hgnc_id TEXT PRIMARY KEY,
+        symbol TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS gene_aliases (
+        alias TEXT,
+        hgnc_id TEXT REFERENCES genes (hgnc_id),
+        PRIMARY KEY (alias, hgnc_id)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS variant_genes (
+        hgnc_id TEXT REFERENCES genes (hgnc_id),
+        variant_id TEXT,
+        PRIMARY KEY (hgnc_id, variant_id)
+    ) WITHOUT ROWID;
+"""
+
+
+def add_variant_locations(con):
+    """
+    Chromosome, start, end and bin for each variant, read from the
+    variant id, with an index on (chromosome, bin, start) for region
+    queries. Variants already in the database are added from their ids
+    """
+    run_script(con, """
+    CREATE TABLE IF NOT EXISTS variant_locations (
+        variant_id TEXT PRIMARY KEY,
+        chromosome TEXT NOT NULL,
+        start INTEGER NOT NULL,
+        end INTEGER NOT NULL,
+        bin INTEGER NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_variant_locations_bin
+        ON variant_locations (chromosome, bin, start, end, variant_id);
+    """)
+
+    rows = con.execute("""
+        SELECT variant_id FROM variants
+        UNION
+        SELECT variant_id FROM clinvar
+    """).fetchall()
+    for (variant_id,) in rows:
+        location = parse_variant_id(variant_id)
+        if location:
+            chromosome, start, end = location
+            con.execute("""
+                INSERT OR IGNORE INTO variant_locations
+                (variant_id, chromosome, start, end, bin)
+                VALUES (?, ?, ?, ?, ?)
+            """, (variant_id, chromosome, start, end,
+                  region_bin(start, end)))
+
+
+# the text columns emptied by add_dictionary_tables still take a slot
+# in every row, clinvar is rebuilt without them and its indexes made
+# again. The pages they leave free are given back by the VACUUM in
+# upgrade_database
+drop_clinvar_text = """
+    CREATE TABLE clinvar_new (
         variant_id TEXT PRIMARY KEY,
-        consensus_classification TEXT,
         hgvs TEXT,
-        associated_conditions TEXT,
         gene TEXT,
-        star_rating TEXT,
         allele_frequency REAL,
         chromosome TEXT,
+        classification_id INTEGER
+            REFERENCES classifications (classification_id),
+        review_status_id INTEGER
+            REFERENCES review_statuses (review_status_id),
+        stars INTEGER,
         FOREIGN KEY (variant_id) REFERENCES variants (variant_id)
     );
+
+    INSERT INTO clinvar_new
+        (variant_id, hgvs, gene, allele_frequency, chromosome,
+         classification_id, review_status_id, stars)
+    SELECT variant_id, hgvs, gene, allele_frequency, chromosome,
+           classification_id, review_status_id, stars
+    FROM clinvar;
+
+    DROP TABLE clinvar;
+    ALTER TABLE clinvar_new RENAME TO clinvar;
+
+    CREATE INDEX IF NOT EXISTS idx_clinvar_allele_frequency
+        ON clinvar (allele_frequency, variant_id);
+    CREATE INDEX IF NOT EXISTS idx_clinvar_stars_variant
+        ON clinvar (stars, variant_id);
+    CREATE INDEX IF NOT EXISTS idx_clinvar_classification_variant
+        ON clinvar (classification_id, variant_id);
+"""
+
+
+# Schema changes made after the first release.
+# Each entry moves the schema on by one version and they are applied in
+# order, the database user_version records how many have been applied
+# so existing databases are brought up to date without being recreated.
+# A migration and its user_version are committed together, one which
+# fails part way is rolled back and is run again in full next time
+MIGRATIONS = [
+    # latest batch lookup and keyset paging on the results page
+    """
+    CREATE INDEX IF NOT EXISTS idx_variants_latest
+        ON variants (date_annotated, patient_variant);
+    """,
+    # listings of processed and misaligned outputs
+    manifest_schema,
+    # latest batch tracked by annotation run
+    add_annotation_runs,
+    # repeated ClinVar text moved into lookup tables
+    add_dictionary_tables,
+    # allele frequency as a number, with indexes for filtering
+    numeric_allele_frequency,
+    # condition search by word and word prefix
+    add_condition_tokens,
+    # gene index from the VariantValidator HGNC ids
+    gene_tables,
+    # typed chromosome positions for region queries
+    add_variant_locations,
+    # clinvar without the emptied text columns
+    drop_clinvar_text,
+]
+
+
+def upgrade_database(path=None):
     """
+    Apply any outstanding schema migrations to an existing database.
+
+    path: optional path to database file (default is production DB)
+    """
+    db_path = str(path or database_file)
 
     try:
-        with sqlite3.connect(db_path) as con:
-            cursor = con.cursor()
-            cursor.executescript(sql_script)
-            con.commit()
+        # transactions are opened and committed here, not by sqlite3
+        con = sqlite3.connect(db_path, isolation_level=None)
+        version = con.execute("PRAGMA user_version").fetchone()[0]
+
+        # an empty file is given the original tables first
+        if version == 0:
+            con.executescript(base_schema)
+        # base_schema turns foreign keys on, clinvar references the
+        # variant_id of variants which is not unique so every change to
+        # variants would fail the check while the rows are moved on
+        con.execute("PRAGMA foreign_keys = OFF")
+
+        for number, migration in enumerate(MIGRATIONS[version:],
+                                           start=version + 1):
+            con.execute("BEGIN")
+            try:
+                if callable(migration):
+                    migration(con)
+                else:
+                    run_script(con, migration)
+                con.execute(f"PRAGMA user_version = {number}")
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+
+        # VACUUM cannot run inside a transaction, so the space freed by
+        # the migrations is given back once they are all committed
+        if version < len(MIGRATIONS):
+            con.execute("VACUUM")
 
     except sqlite3.OperationalError as e:
-        raise RuntimeError(f"Database creation failed at {db_path}: {e}")
+        raise RuntimeError(f"Database upgrade failed at {db_path}: {e}")
 
-    print("✅ Database and tables created successfully:", db_path)
+    finally:
+        if 'con' in locals():
+            con.close()
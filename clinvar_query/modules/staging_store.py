@@ -0,0 +1,386 @@
+import json
+import sqlite3
+import time
+from pathlib import Path
+from clinvar_query.utils.logger import logger
+from clinvar_query.utils.paths import processed_folder, staging_database_file
+from clinvar_query.utils.settings import reference_fasta
+from clinvar_query.modules.local_hgvs import open_reference
+from clinvar_query.modules.vv_variant_query import query_variant, split_samples
+from clinvar_query.modules.clinvar_api_query import annotate_entry
+from clinvar_query.modules.json_to_db import (
+    build_clinvar,
+    ingest_entry,
+    patient_variant_id,
+)
+from clinvar_query.modules.insert_annotated_results import (
+    start_annotation_run,
+    finish_annotation_run,
+    previous_associations,
+    drop_variants,
+    move_variants,
+)
+
+"""
+Staging database for the pipeline, used instead of the validator and
+clinvar folders when staging_store is set in utils/settings.py.
+
+Every stage result is a row keyed by (file_stem, variant, stage), where
+file_stem is the processed file the variant came from
+(<patient_id>_<test>, as for the JSON files) and the stage is one of
+validator - the VariantValidator (or local) result
+clinvar    - the ClinVar search result, NULL when there was nothing to search
+database   - written once the variant is in the results database, with the
+             patient variant ids it was linked to
+
+A row is marked done when the stage after has written its row, so the
+rows still pending are read from a partial index on the rows not done,
+which stays the size of the work left instead of listing folders and
+comparing file names. Rows are written and committed in batches, so a
+stopped run picks up from the last batch rather than from the start of
+the file.
+
+A processed file which has changed is read again, variants no longer in
+it are taken out of the store and the file is marked changed. The
+database stage then gives the file a new run, as json_to_dir does for
+an overwritten JSON file: variants kept from earlier runs are moved to
+it and those taken out are removed from the results database.
+
+The stages reuse query_variant, annotate_entry, build_clinvar and
+ingest_entry, so the records are the same as in the JSON files.
+"""
+
+STAGES = ("validator", "clinvar", "database")
+
+# rows written per transaction
+STAGE_BATCH = 500
+
+staging_schema = """
+    CREATE TABLE IF NOT EXISTS stage_results (
+        file_stem TEXT NOT NULL,
+        variant TEXT NOT NULL,
+        stage TEXT NOT NULL,
+        record TEXT,
+        done INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (file_stem, variant, stage)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS staged_files (
+        file_stem TEXT PRIMARY KEY,
+        source_modified REAL,
+        changed INTEGER NOT NULL DEFAULT 0
+    );
+"""
+
+# only rows the next stage still has to take are indexed
+staging_indexes = """
+    DROP INDEX IF EXISTS idx_stage_results_stage;
+
+    CREATE INDEX IF NOT EXISTS idx_stage_results_pending
+        ON stage_results (stage, file_stem, variant)
+        WHERE done = 0 AND record IS NOT NULL;
+"""
+
+
+def add_done_flags(con):
+    """
+    Stores made before the done flag are given it, a row is done when
+    the next stage has a row for the variant. The database stage did not
+    keep the ids it linked then, so it is run again for every variant,
+    patient variants already in the results database are not inserted
+    twice
+    """
+    con.execute("ALTER TABLE stage_results"
+                " ADD COLUMN done INTEGER NOT NULL DEFAULT 0")
+    con.execute("ALTER TABLE staged_files"
+                " ADD COLUMN changed INTEGER NOT NULL DEFAULT 0")
+    con.execute("DELETE FROM stage_results WHERE stage = 'database'")
+    con.execute("""
+        UPDATE stage_results SET done = 1
+        WHERE stage = 'validator' AND EXISTS (
+            SELECT 1 FROM stage_results AS later
+            WHERE later.file_stem = stage_results.file_stem
+                AND later.variant = stage_results.variant
+                AND later.stage = 'clinvar'
+        )
+    """)
+    con.commit()
+
+
+def connect_staging(database=staging_database_file):
+    Path(database).parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(database)
+    con.executescript(staging_schema)
+    columns = [row[1] for row in con.execute("PRAGMA table_info(stage_results)")]
+    if "done" not in columns:
+        add_done_flags(con)
+    con.executescript(staging_indexes)
+    return con
+
+
+def save_stage(con, file_stem, variant, stage, record):
+    """
+    Write a stage result, record is stored as JSON (None for no result).
+    The row of the stage before is marked done in the same transaction
+    """
+    con.execute(
+        """INSERT OR REPLACE INTO stage_results
+        (file_stem, variant, stage, record) VALUES (?, ?, ?, ?)""",
+        (file_stem, variant, stage,
+         None if record is None else
+         json.dumps(record, separators=(",", ":"))))
+    if stage != STAGES[0]:
+        con.execute(
+            """UPDATE stage_results SET done = 1
+            WHERE file_stem = ? AND variant = ? AND stage = ?""",
+            (file_stem, variant, STAGES[STAGES.index(stage) - 1]))
+
+
+# the rows of the stage before which are not done yet, read in
+# (file_stem, variant) order from idx_stage_results_pending
+pending_sql = """
+    SELECT file_stem, variant, record
+    FROM stage_results
+    WHERE stage = ?
+        AND done = 0
+        AND record IS NOT NULL
+        AND (file_stem, variant) > (?, ?)
+    ORDER BY file_stem, variant
+    LIMIT ?
+"""
+
+
+def pending(con, stage, after=("", ""), limit=STAGE_BATCH):
+    """
+    Variants waiting for a stage, with the record from the stage before.
+
+    Parameters
+    ----------
+    after : tuple of (str, str)
+        (file_stem, variant) of the last row of the previous batch, so a
+        variant which failed is not picked up again in the same pass.
+
+    Returns
+    -------
+    list of tuple of (str, str, dict)
+        file_stem, variant and record, in file and variant order.
+        Variants whose earlier stage had no result are not included.
+    """
+    previous = STAGES[STAGES.index(stage) - 1]
+    rows = con.execute(pending_sql, (previous, *after, limit)).fetchall()
+    return [(file_stem, variant, json.loads(record))
+            for file_stem, variant, record in rows]
+
+
+def forget_variant(con, file_stem, variant):
+    """Take every stage of a variant of a processed file out of the store"""
+    con.execute(
+        "DELETE FROM stage_results WHERE file_stem = ? AND variant = ?",
+        (file_stem, variant))
+
+
+def stage_validator(folder=processed_folder, database=staging_database_file):
+    """
+    Describe every processed variant which has no validator result yet.
+    Files which were fully staged and have not changed since are not read.
+    Variants no longer in a changed file are taken out of the store, as
+    are those whose samples changed so they are described again.
+
+    Returns
+    -------
+    int
+        Number of variants staged.
+    """
+    con = connect_staging(database)
+    reference = open_reference(reference_fasta)
+    staged = 0
+    try:
+        for processed_file in sorted(Path(folder).glob("*.txt")):
+            file_stem = processed_file.stem
+            source_modified = processed_file.stat().st_mtime
+            row = con.execute(
+                "SELECT source_modified FROM staged_files WHERE file_stem = ?",
+                (file_stem,)).fetchone()
+            if row and row[0] >= source_modified:
+                continue
+
+            # the samples each staged variant was described with
+            done = {variant: json.loads(record).get("samples", [])
+                    for variant, record in con.execute(
+                        """SELECT variant, record FROM stage_results
+                        WHERE stage = 'validator' AND file_stem = ?""",
+                        (file_stem,))}
+            in_file = set()
+
+            logger.info(f"Staging VariantValidator results for {processed_file.name}")
+            with open(processed_file) as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    variant, samples = split_samples(line)
+                    in_file.add(variant)
+                    if done.get(variant) == samples:
+                        continue
+                    if variant in done:
+                        forget_variant(con, file_stem, variant)
+                    entry = query_variant(line, reference)
+                    save_stage(con, file_stem, entry["variant"], "validator",
+                               entry)
+                    done[entry["variant"]] = samples
+                    staged += 1
+                    if staged % STAGE_BATCH == 0:
+                        con.commit()
+
+            for variant in set(done) - in_file:
+                forget_variant(con, file_stem, variant)
+            con.execute(
+                "INSERT OR REPLACE INTO staged_files VALUES (?, ?, 1)",
+                (file_stem, source_modified))
+            con.commit()
+    finally:
+        con.commit()
+        con.close()
+        if reference:
+            reference.close()
+    return staged
+
+
+def stage_clinvar(database=staging_database_file):
+    """
+    Search ClinVar for every variant with a validator result and no
+    ClinVar result yet.
+
+    Returns
+    -------
+    int
+        Number of variants staged.
+    """
+    con = connect_staging(database)
+    staged = 0
+    after = ("", "")
+    try:
+        while True:
+            batch = pending(con, "clinvar", after)
+            if not batch:
+                break
+            after = batch[-1][:2]
+            for file_stem, variant, entry in batch:
+                result = annotate_entry(entry)
+                save_stage(con, file_stem, variant, "clinvar", result)
+                staged += 1
+                if result is not None:
+                    # Respect NCBI API guidelines by adding a small delay
+                    time.sleep(0.3)
+            con.commit()
+    finally:
+        con.close()
+    return staged
+
+
+def stage_database(database=staging_database_file):
+    """
+    Insert every variant with a ClinVar result which is not in the
+    results database yet, one annotation run per processed file.
+    Patient variants from earlier runs of the file are not inserted
+    again, those still in it are moved to the new run and those no
+    longer in it are removed, as for an overwritten JSON file.
+
+    Returns
+    -------
+    int
+        Number of patient variants inserted or moved.
+    """
+    con = connect_staging(database)
+    runs = {}
+    inserted = 0
+    after = ("", "")
+
+    def run_for(file_stem):
+        if file_stem not in runs:
+            source_file = f"{file_stem}.json"
+            previous = previous_associations(source_file)
+            runs[file_stem] = {
+                "run_id": start_annotation_run(
+                    file_stem.split("_")[0], source_file, time.time()),
+                "source_file": source_file,
+                "previous": previous,
+                "inserted": 0,
+                "patients": set(),
+                # links of variants left pending, they are not removed
+                "failed": set(),
+            }
+        return runs[file_stem]
+
+    try:
+        while True:
+            batch = pending(con, "database", after)
+            if not batch:
+                break
+            after = batch[-1][:2]
+            for file_stem, variant, entry in batch:
+                clinvar = build_clinvar(entry, file_stem)
+                links = None
+                if clinvar is not None:
+                    run = run_for(file_stem)
+                    links = {
+                        carrier: patient_variant_id(carrier,
+                                                    clinvar["variant_id"])
+                        for carrier in entry.get("samples")
+                        or [file_stem.split("_")[0]]}
+                    carriers = [carrier for carrier, link in links.items()
+                                if link not in run["previous"]]
+                    try:
+                        count = ingest_entry(clinvar, carriers,
+                                             run["run_id"], run["patients"])
+                    except Exception:
+                        # left pending so it is tried again next time
+                        logger.exception(
+                            "Database insertion failed for variant %s",
+                            variant)
+                        run["failed"].update(links.values())
+                        continue
+                    run["inserted"] += count
+                    inserted += count
+                    links = sorted(links.values())
+                save_stage(con, file_stem, variant, "database", links)
+            con.commit()
+
+        # changed files get a run even when nothing in them is new
+        for (file_stem,) in con.execute(
+                "SELECT file_stem FROM staged_files WHERE changed = 1"
+        ).fetchall():
+            run_for(file_stem)
+
+        for file_stem, run in runs.items():
+            seen = set(run["failed"])
+            for (record,) in con.execute(
+                    """SELECT record FROM stage_results
+                    WHERE file_stem = ? AND stage = 'database'
+                        AND record IS NOT NULL""", (file_stem,)):
+                seen.update(json.loads(record))
+            kept = run["previous"] & seen
+            removed = run["previous"] - seen
+            if kept:
+                moved = move_variants(kept, run["run_id"])
+                run["inserted"] += moved
+                inserted += moved
+            if removed:
+                drop_variants(removed, run["source_file"])
+            con.execute(
+                "UPDATE staged_files SET changed = 0 WHERE file_stem = ?",
+                (file_stem,))
+            con.commit()
+    finally:
+        con.close()
+        for run in runs.values():
+            finish_annotation_run(run["run_id"], run["inserted"])
+    return inserted
+
+
+def run_staged_pipeline(folder=processed_folder,
+                        database=staging_database_file):
+    """Run the validator, ClinVar and database stages through the store"""
+    logger.info(f"Staged {stage_validator(folder, database)} VariantValidator results")
+    logger.info(f"Staged {stage_clinvar(database)} ClinVar results")
+    logger.info(f"Inserted {stage_database(database)} variants from the staging store")
@@ -0,0 +1,225 @@
+import os
+import sqlite3
+import time
+from clinvar_query.utils.logger import logger
+from clinvar_query.utils.paths import database_file
+from clinvar_query.modules.compressed_files import stored_file
+from clinvar_query.modules.file_manifest import folder_key
+
+"""
+An index of uploads by their content, so the same file sent again is not
+saved and run through the pipeline a second time.
+
+stream_upload writes the upload in chunks to <name>.part as it arrives,
+hashing each chunk (sha256) and handing its lines on to the parser, so the
+upload is saved, hashed and parsed in one pass and never read back.
+Every upload that is processed is recorded under its title and the
+processed folder, with its hash, the gene panel it was filtered with, the
+settings it was parsed with (the VCF filters and the panel regions) and
+the processed and misaligned files it made (and the panel counts for the
+job summary).
+
+process_upload_file looks the title up before saving any outputs. If it
+was already processed into the folder from the same content, panel and
+settings, and its processed file is still there, the .part file is
+removed and the existing outputs are used, the variants are already in
+the database from the first run. This covers an overwrite with content
+that has not changed, which now leaves everything as it was. The same
+content under another title is processed as usual, as each title is a
+patient of its own.
+
+Indexes made before the settings were recorded are keyed by content, they
+are dropped and made again, the uploads in them are only processed again
+the next time they are sent.
+"""
+
+CHUNK_SIZE = 1024 * 1024
+PART_SUFFIX = ".part"
+
+upload_schema = """
+    CREATE TABLE IF NOT EXISTS upload_index (
+        folder TEXT NOT NULL,
+        title TEXT NOT NULL,
+        content_hash TEXT NOT NULL,
+        panel TEXT NOT NULL,
+        settings TEXT NOT NULL,
+        processed_file TEXT,
+        misaligned_file TEXT,
+        total INTEGER,
+        kept INTEGER,
+        recorded_at REAL,
+        PRIMARY KEY (folder, title)
+    );
+"""
+
+
+def connect_uploads(database):
+    con = sqlite3.connect(database)
+    con.row_factory = sqlite3.Row
+    columns = [row[1] for row in
+               con.execute("PRAGMA table_info(upload_index)")]
+    if columns and "settings" not in columns:
+        # an index from before the settings were recorded
+        con.executescript("DROP TABLE upload_index;")
+    con.executescript(upload_schema)
+    return con
+
+
+def decoded_line(line, undecodable):
+    try:
+        return line.decode("utf-8")
+    except UnicodeDecodeError:
+        logger.error(f"row {line!r} is not valid UTF-8")
+        if undecodable is not None:
+            undecodable.append(line)
+        return None
+
+
+def text_lines(chunks, undecodable=None):
+    """
+    Decode chunks of an upload into text lines.
+    Lines may end in \\n, \\r\\n or \\r alone (old Mac files), each line keeps
+    its own ending. A line which is not valid UTF-8 is not yielded, it is
+    added to undecodable (if given) as the bytes it was sent as.
+
+    Yields
+    ------
+    str
+        Each line as soon as all of it has arrived.
+    """
+    pending = b""
+    for chunk in chunks:
+        lines = (pending + chunk).splitlines(keepends=True)
+        # the last line may not have all arrived yet, a \r at the end
+        # may still be followed by a \n
+        pending = lines.pop() if lines and \
+            not lines[-1].endswith(b"\n") else b""
+        for line in lines:
+            text = decoded_line(line, undecodable)
+            if text is not None:
+                yield text
+    for line in pending.splitlines(keepends=True):
+        text = decoded_line(line, undecodable)
+        if text is not None:
+            yield text
+
+
+def saved_chunks(file, upload_path, digest, chunk_size=CHUNK_SIZE):
+    """Read an upload a chunk at a time, writing and hashing each one"""
+    with open(f"{upload_path}{PART_SUFFIX}", "wb") as f:
+        while True:
+            chunk = file.stream.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+            yield chunk
+
+
+def stream_upload(file, upload_path, digest, chunk_size=CHUNK_SIZE,
+                  undecodable=None):
+    """
+    Write an uploaded file to upload_path.part as it arrives.
+
+    Parameters
+    ----------
+    file : FileStorage
+        The upload, read from its stream a chunk at a time.
+    upload_path : str
+        Where the upload is saved once it is finished.
+    digest : hashlib hash
+        Updated with every chunk, e.g. ``hashlib.sha256()``.
+    undecodable : list, optional
+        Collects the lines which are not valid UTF-8 (see text_lines).
+
+    Returns
+    -------
+    iterator of str
+        The text lines of the upload, each as soon as it has arrived.
+        The rest of the upload is only written when all lines are read.
+    """
+    return text_lines(saved_chunks(file, upload_path, digest, chunk_size),
+                      undecodable)
+
+
+def find_upload(processed_folder, title, content_hash, panel="",
+                settings="", database=database_file):
+    """
+    The earlier result for the title, None if there is none, it was made
+    from other content, panel or settings, or its processed file has since
+    been removed.
+
+    Returns
+    -------
+    dict or None
+        title, processed_file, misaligned_file, total and kept.
+    """
+    try:
+        con = connect_uploads(database)
+    except sqlite3.Error as e:
+        logger.error(f"Could not read the upload index : {e}")
+        return None
+    try:
+        key = (folder_key(processed_folder), title)
+        row = con.execute(
+            """SELECT title, content_hash, panel, settings, processed_file,
+            misaligned_file, total, kept
+            FROM upload_index WHERE folder = ? AND title = ?""",
+            key).fetchone()
+        if row is None or \
+                (row["content_hash"], row["panel"], row["settings"]) != \
+                (content_hash, panel, settings):
+            return None
+        if not stored_file(row["processed_file"]):
+            with con:
+                con.execute(
+                    "DELETE FROM upload_index WHERE folder = ? AND title = ?",
+                    key)
+            return None
+        return {name: row[name] for name in
+                ["title", "processed_file", "misaligned_file", "total",
+                 "kept"]}
+    except sqlite3.Error as e:
+        logger.error(f"Could not read the upload index : {e}")
+        return None
+    finally:
+        con.close()
+
+
+def record_upload(processed_folder, content_hash, title, processed_file,
+                  misaligned_file=None, panel="", summary=None, settings="",
+                  database=database_file):
+    """Record the outputs made from an upload, replacing what was recorded
+    for the title before. Failures are logged and not raised, the upload
+    is only processed again next time"""
+    summary = summary or {}
+    try:
+        con = connect_uploads(database)
+        with con:
+            con.execute(
+                """INSERT OR REPLACE INTO upload_index
+                (folder, title, content_hash, panel, settings,
+                 processed_file, misaligned_file, total, kept, recorded_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (folder_key(processed_folder), title, content_hash, panel,
+                 settings, str(processed_file),
+                 str(misaligned_file) if misaligned_file else None,
+                 summary.get("total"), summary.get("kept"), time.time()))
+    except Exception as e:
+        logger.error(f"Could not record {title} in the upload index : {e}")
+    finally:
+        if 'con' in locals():
+            con.close()
+
+
+def discard_upload(upload_path):
+    """Remove the .part file of an upload which is not needed"""
+    try:
+        os.remove(f"{upload_path}{PART_SUFFIX}")
+    except OSError:
+        pass
+
+
+def finish_upload(upload_path):
+    """Move a saved upload to its final name"""
+    os.replace(f"{upload_path}{PART_SUFFIX}", upload_path)
@@ -0,0 +1,108 @@
+from clinvar_query.utils.settings import vcf_filters
+
+"""
+Quality and genotype checks for VCF rows, run by the parser so that
+filtered, low quality and hom-ref or no-call rows are dropped before they
+are sent to VariantValidator and ClinVar.
+
+The filters are set in utils/settings.py and only use the row already
+split by the parser, so each check is a few string compares.
+
+VCF columns used:
+CHROM POS ID REF ALT QUAL FILTER INFO FORMAT SAMPLE SAMPLE ...
+                     5    6          8      9
+QUAL and FILTER are checked once for the row (the site), DP, GQ and the
+genotype are checked for each sample. failed_filter checks the first
+sample, for single sample files, and carrying_samples returns every
+sample that passes, for multi-sample files.
+"""
+
+QUAL = 5
+FILTER = 6
+FORMAT = 8
+SAMPLE = 9
+
+
+def sample_fields(row, column=SAMPLE):
+    """The FORMAT keys of a sample with their values"""
+    if len(row) <= column:
+        return {}
+    keys = row[FORMAT].strip().split(":")
+    values = row[column].strip().split(":")
+    return dict(zip(keys, values))
+
+
+def below_minimum(value, minimum):
+    # a missing value cannot show the minimum is met
+    try:
+        return float(value) < minimum
+    except (TypeError, ValueError):
+        return True
+
+
+def non_reference(genotype):
+    """Whether a genotype such as 0/1 or 1|1 carries an alternate allele"""
+    alleles = genotype.replace("|", "/").split("/")
+    return any(allele not in ("0", ".", "") for allele in alleles)
+
+
+def failed_site_filter(row, filters):
+    """The first QUAL or FILTER check the row fails, or None"""
+    if filters.get("pass_only") and len(row) > FILTER:
+        if row[FILTER].strip() not in ("PASS", "."):
+            return "pass_only"
+
+    if filters.get("min_qual") is not None and len(row) > QUAL:
+        if below_minimum(row[QUAL].strip(), filters["min_qual"]):
+            return "min_qual"
+
+    return None
+
+
+def failed_sample_filter(sample, filters):
+    """The first DP, GQ or genotype check a sample fails, or None"""
+    if filters.get("min_depth") is not None and sample:
+        if below_minimum(sample.get("DP"), filters["min_depth"]):
+            return "min_depth"
+
+    if filters.get("min_genotype_quality") is not None and sample:
+        if below_minimum(sample.get("GQ"), filters["min_genotype_quality"]):
+            return "min_genotype_quality"
+
+    if filters.get("non_reference") and "GT" in sample:
+        if not non_reference(sample["GT"]):
+            return "non_reference"
+
+    return None
+
+
+def failed_filter(row, filters=None):
+    """
+    Check a split VCF row and its first sample against the filters.
+
+    Returns
+    -------
+    str or None
+        The name of the first filter the row fails, or None if it passes.
+    """
+    filters = vcf_filters if filters is None else filters
+    return (failed_site_filter(row, filters)
+            or failed_sample_filter(sample_fields(row), filters))
+
+
+def carrying_samples(row, sample_names, filters=None):
+    """
+    The samples of a multi-sample row which pass the filters.
+
+    Returns
+    -------
+    list of str
+        Sample names in file order, empty if the row fails QUAL or FILTER
+        or no sample passes.
+    """
+    filters = vcf_filters if filters is None else filters
+    if failed_site_filter(row, filters):
+        return []
+
+    return [name for column, name in enumerate(sample_names, start=SAMPLE)
+            if not failed_sample_filter(sample_fields(row, column), filters)]
@@ -10,15 +10,24 @@ This module provides a batch interface for querying the VariantValidator
 REST API using variant descriptions stored in text files.
 
 Each input ``.txt`` file is processed line-by-line, with each line
-representing a single variant description. Results from the API are
-written to a corresponding ``.json`` file with the same base name.
+representing a single variant description, optionally followed by a tab
+and the samples carrying it (multi-sample VCFs). Results from the API are
+written to a corresponding ``.json`` file with the same base name, one
+JSON line per variant as each comes back (see ``json_records.py``).
 
 Features
 --------
 - Discovers all input files matching a wildcard pattern.
 - Queries the VariantValidator API for each variant.
-- Stores results (success or error) in structured JSON output.
+- Builds the g.HGVS locally for simple variants when a reference FASTA
+  is set (see ``local_hgvs.py``), only the rest go to the API.
+- Stores a compact record of each result (the g.HGVS and gene, see
+  ``response_projection.py``) or the error in JSON output, the full
+  responses are only kept when raw archiving is switched on.
 - Ensures output directories exist before writing.
+- Re-runs a processed file which was overwritten after its output was
+  made, only the variants which were added are queried
+  (see ``incremental_update.py``).
 - Logs progress, warnings, and errors for traceability.
 
 Notes
@@ -29,10 +38,29 @@ also be imported and invoked programmatically.
 
 import os
 import glob
-import json
 import requests
 from clinvar_query.utils.logger import logger
 from clinvar_query.utils.paths import processed_folder, validator_folder
+from clinvar_query.utils.settings import reference_fasta
+from clinvar_query.modules.local_hgvs import open_reference, local_g_hgvs
+from clinvar_query.modules.compressed_files import compress_file, stored_stems
+from clinvar_query.modules.intermediate_archive import is_archived
+from clinvar_query.modules.incremental_update import (
+    previous_records,
+    remove_old_output,
+    reuse_record,
+)
+from clinvar_query.modules.json_records import (
+    open_records,
+    write_record,
+    finish_records,
+    discard_records,
+)
+from clinvar_query.modules.response_projection import (
+    project_vv,
+    open_raw_archive,
+    archive_response,
+)
 from pathlib import Path
 
 
@@ -56,7 +84,83 @@ checkonly = "False"
 
 
 # ----------------- Variant Query Function -----------------
-def vv_variant_query():
+def split_samples(line):
+    """
+        Split a processed line into the variant and its carrying samples.
+
+        Lines from multi-sample VCFs are written as
+        ``12-40294866-G-T<tab>patient1,patient3``, other lines are just
+        the variant.
+
+        Returns
+        -------
+        tuple of (str, list of str)
+            The variant and the sample names, empty for single sample files.
+        """
+    variant, _, samples = line.partition("\t")
+    return variant.strip(), [sample for sample in samples.split(",") if sample]
+
+
+def query_variant(line, reference=None, archive=None, session=None):
+    """
+        Describe one processed line, locally or with VariantValidator.
+
+        Parameters
+        ----------
+        line : str
+            A processed line, the variant and any carrying samples.
+        reference : ReferenceFasta, optional
+            Reference used to describe simple variants without the API.
+        archive : file, optional
+            Raw response archive from ``open_raw_archive``.
+        session : requests.Session, optional
+            Shared connection pool, ``requests.get`` is used without one.
+
+        Returns
+        -------
+        dict
+            The compact result or the error, with the samples.
+        """
+    # multi-sample files list the carrying samples after a tab
+    variant, samples = split_samples(line)
+
+    # Simple variants are described locally without an API call
+    g_hgvs = local_g_hgvs(reference, variant) if reference else None
+    if g_hgvs:
+        entry = {"variant": variant, "g_hgvs": g_hgvs, "source": "local"}
+        logger.debug(f"Built g.HGVS locally for variant: {variant}")
+    else:
+        url = f"{base_url}/{build}/{variant}/{model}/{transcript}/{checkonly}"
+        try:
+            response = (session or requests).get(url)
+            if response.status_code == 200:
+                # Successful API response, only the fields the
+                # later stages read are kept
+                raw = response.json()
+                archive_response(archive, variant, raw)
+                entry = project_vv(variant, raw)
+                logger.debug(f"Successfully retrieved result for variant: {variant}")
+            else:
+                # API responded but returned an error status code
+                entry = {
+                    "variant": variant,
+                    "error": f"Failed to retrieve data ({response.status_code})"
+                }
+                logger.warning(f"Variant {variant} returned status code {response.status_code}")
+        except Exception as e:
+            # Network or unexpected failure during request execution
+            entry = {
+                "variant": variant,
+                "error": f"Exception during request: {e}"
+            }
+            logger.error(f"Exception querying variant {variant}: {e}")
+
+    if samples:
+        entry["samples"] = samples
+    return entry
+
+
+def vv_variant_query(session=None):
     """
         Query VariantValidator for variants listed in input text files.
 
@@ -73,7 +177,13 @@ def vv_variant_query():
             a. Read variants line-by-line.
             b. Query VariantValidator for each variant.
             c. Capture success or error responses.
-            d. Write results to a JSON file with the same base name.
+            d. Write each result as a JSON line to a file with the same
+               base name, which is moved into place once complete.
+
+        Parameters
+        ----------
+        session : requests.Session, optional
+            Connection pool shared by every query, e.g. for a batch job.
 
         Returns
         -------
@@ -81,7 +191,11 @@ def vv_variant_query():
 
         Notes
         -----
-        - Files with existing JSON outputs are skipped to ensure idempotency.
+        - A variant found in more than one file (e.g. samples from the same
+          plate) is only queried once per run, the result is reused.
+        - Files with existing JSON outputs are skipped to ensure idempotency,
+          unless the input file has changed since, then the earlier
+          results are reused for the variants still in it.
         - Network or API failures are captured per-variant and logged.
         """
 
@@ -97,9 +211,8 @@ def vv_variant_query():
         return
 
     # Locate output files (SAFE from glob patching)
-    output_dir = Path(output_folder)
-    output_files = list(output_dir.glob("*.json"))
-    output_basenames = {f.stem for f in output_files}
+    # (outputs compressed once they were read still count)
+    output_basenames = stored_stems(output_folder, ".json")
 
     # ------------------------------------------------------------------
     # Alternative implementation (retained for reference)
@@ -119,64 +232,81 @@ def vv_variant_query():
     # ------------------------------------------------------------------
 
 
+    # Local g.HGVS engine, None when no reference FASTA is set
+    reference = open_reference(reference_fasta)
+    # results of this run, shared by every file
+    cache = {}
+
     # Process each input file independently
     for file in files:
         input_filename = os.path.basename(file)
         input_stem = Path(input_filename).stem
         logger.info(f"Processing file: {input_filename}")
 
-        # Skip files that already have corresponding JSON outputs.
-        if input_stem in output_basenames:
-            logger.warning(f"skipping already processed file: {input_filename}")
-            continue
+        # Skip files that already have corresponding JSON outputs,
+        # in the folder or archived once they were ingested,
+        # unless the file was overwritten after the output was made
+        previous = None
+        if input_stem in output_basenames or \
+                is_archived("validator", input_stem):
+            previous = previous_records("validator", output_folder,
+                                        input_stem, os.path.getmtime(file))
+            if previous is None:
+                logger.warning(f"skipping already processed file: {input_filename}")
+                continue
+            logger.info(f"{input_filename} has changed, only added variants "
+                        "are queried")
 
-        # Read and sanitize variant entries from the input file.
+        # Variants are read one line at a time from the input file
         try:
-            with open(file, "r") as f:
-                variants = [line.strip() for line in f if line.strip()]
-            logger.info(f"Loaded {len(variants)} variants from {input_filename}")
+            f = open(file, "r")
         except Exception as e:
             logger.error(f"Failed to read file {input_filename}: {e}")
             continue
 
-        results = []
-
-        # Query VariantValidator API for each variant
-        for variant in variants:
-            url = f"{base_url}/{build}/{variant}/{model}/{transcript}/{checkonly}"
-            try:
-                response = requests.get(url)
-                if response.status_code == 200:
-                    # Successful API response
-                    results.append({
-                        "variant": variant,
-                        "result": response.json()
-                    })
-                    logger.debug(f"Successfully retrieved result for variant: {variant}")
-                else:
-                    # API responded but returned an error status code
-                    results.append({
-                        "variant": variant,
-                        "error": f"Failed to retrieve data ({response.status_code})"
-                    })
-                    logger.warning(f"Variant {variant} returned status code {response.status_code}")
-            except Exception as e:
-                # Network or unexpected failure during request execution
-                results.append({
-                    "variant": variant,
-                    "error": f"Exception during request: {e}"
-                })
-                logger.error(f"Exception querying variant {variant}: {e}")
-
-        # Write results to JSON file
+        # Each result is written as a JSON line as soon as it comes back
         output_filename = input_filename.replace(".txt", ".json")
         output_path = os.path.join(output_folder, output_filename)
         try:
-            with open(output_path, "w") as out_f:
-                json.dump(results, out_f, indent=4)
-            logger.info(f"Saved JSON output: {output_path}")
+            out_f = open_records(output_path)
+        except Exception as e:
+            logger.error(f"Failed to save JSON output for {input_filename}: {e}")
+            f.close()
+            continue
+
+        # full responses, only when raw archiving is switched on
+        archive = open_raw_archive("validator", input_filename)
+        count = 0
+        try:
+            with f:
+                for line in f:
+                    if line.strip():
+                        variant, samples = split_samples(line.strip())
+                        entry = reuse_record(previous, variant, samples) or \
+                            reuse_record(cache, variant, samples)
+                        if entry is None:
+                            entry = query_variant(line.strip(), reference,
+                                                  archive, session)
+                            if "error" not in entry:
+                                cache[variant] = entry
+                        write_record(out_f, entry)
+                        count += 1
         except Exception as e:
             logger.error(f"Failed to save JSON output for {input_filename}: {e}")
+            discard_records(out_f, output_path)
+        else:
+            finish_records(out_f, output_path)
+            if previous is not None:
+                remove_old_output(output_path)
+            logger.info(f"Saved {count} results to JSON output: {output_path}")
+            # the processed file has been read, it is only kept as a record
+            compress_file(file)
+        finally:
+            if archive is not None:
+                archive.close()
+
+    if reference:
+        reference.close()
 
 
 # ----------------- Main Execution -----------------
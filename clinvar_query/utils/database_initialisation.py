@@ -1,9 +1,10 @@
-from clinvar_query.modules.setup_results import create_database
+from clinvar_query.modules.setup_results import create_database, upgrade_database
 from clinvar_query.utils.logger import logger
 import os
 
 """This module initialises the database
 This looks to see if a database file exists
+If it does, any outstanding schema upgrades are applied
 If it doesn't, then it creates a db file
 If this doesn't work, a critical error appears
 This is because database functionality is essential """
@@ -12,6 +13,7 @@ def database_initialise(db_file):
     db_exists = os.path.isfile(db_file)
     try:
         if db_exists:
+            upgrade_database(db_file)
             return db_file
 
         else:
@@ -10,7 +10,18 @@ app_messages = {
     "skipped": "This file {file} already exists and was not overwritten",
     "misaligned_created": "{file} was processed, but there was an error with your input. Check misaligned files in the results page",
     "misaligned_overwritten": "{file} was successfully overwritten, but there was an error with your input. Check misaligned files in the results page",
-    "overwritten_success": "{file} has been overwritten successfully"
+    "overwritten_success": "{file} has been overwritten successfully",
+    "unchanged_upload": "{file} is the same as the file already uploaded, its results have been kept as they are",
+    "panel_summary": "Gene panel {panel}: {kept} of {total} variants are in the panel, {skipped} outside it were left out, saving up to {queries_saved} VariantValidator and ClinVar queries",
+    "panel_error": "The gene panel {panel} could not be read, check it is a BED file",
+    "unsupported_panel": "Gene panels must be BED files",
+    "panel_exists": "A different gene panel called {panel} is already stored, pick it from the list, rename the file or upload with overwrite on to replace it",
+    "upload_incomplete": "{file} is missing {missing} chunks, send them and finish the upload again",
+    "checksum_missing": "Finish the upload with the sha256 checksum of the whole file, what was sent of it has been kept",
+    "checksum_mismatch": "{file} did not arrive intact, its checksum does not match, upload it again",
+    "unsupported_archive": "Batches of files can be sent as a zip archive",
+    "archive_too_large": "The zip archive is too large for one batch, {reason}",
+    "batch_duplicate_name": "{file} has the same name as another file in the batch (not counting the extension), only the first was processed"
 }
 
 
@@ -23,8 +23,16 @@ clinvar_folder = base_directory / "instance/clinvar_folder"
 
 database_file = database_folder / "clinvar_project.db"
 
+staging_database_file = database_folder / "staging.db"
+
 logs_folder = base_directory / "instance/logs_folder"
 
+panel_folder = base_directory / "instance/panel_folder"
+
+raw_archive_folder = base_directory / "instance/raw_archive_folder"
+
+archive_folder = base_directory / "instance/archive_folder"
+
 
 def allowed_file(filename, allowed_ext):
 
@@ -34,4 +42,6 @@ def allowed_file(filename, allowed_ext):
 
 allowed_ext = {"vcf", "csv"}
 
+panel_ext = {"bed"}
+
 
@@ -0,0 +1,84 @@
+import os
+
+"""
+Settings for how uploaded files are processed.
+Like paths.py, changes to how the app behaves are made here
+rather than in the modules that use them.
+"""
+
+
+# Filters applied to VCF rows while they are parsed, rows which fail are
+# not annotated. A filter set to None is switched off.
+# pass_only            - FILTER must be PASS (or "." when not filtered)
+# min_qual             - lowest QUAL score
+# min_depth            - lowest read depth, DP from the sample FORMAT column
+# min_genotype_quality - lowest genotype quality, GQ from the sample column
+# non_reference        - drop hom-ref (0/0) and no-call (./.) genotypes
+# A column which is not in the file (e.g. a sites only VCF) is not filtered
+# on, but a value of "." fails a minimum when that minimum is set.
+vcf_filters = {
+    "pass_only": True,
+    "min_qual": None,
+    "min_depth": None,
+    "min_genotype_quality": None,
+    "non_reference": True,
+}
+
+
+# GRCh38 reference FASTA used to build g.HGVS locally for simple variants
+# (see local_hgvs.py), only the rest are sent to VariantValidator.
+# None leaves every variant to VariantValidator.
+reference_fasta = os.environ.get("ClinVar_Search_FASTA")
+
+# Position sorted ClinVar VCF (clinvar.vcf.gz) used to annotate uploads in
+# bulk with one pass over the file (see clinvar_vcf_annotation.py) instead
+# of the VariantValidator and ClinVar APIs. None uses the APIs.
+clinvar_vcf = os.environ.get("ClinVar_Search_ClinVar_VCF")
+
+# Keep the full VariantValidator and ClinVar responses as well as the
+# compact records the pipeline uses (see response_projection.py), gzipped
+# in raw_archive_folder. Off by default as they are rarely looked at.
+archive_raw_responses = False
+
+# Keep the stage results in a SQLite staging database (see
+# staging_store.py) instead of one JSON file per patient per stage in the
+# validator and clinvar folders. Worth it once there are many files.
+staging_store = False
+
+# Compress files once the next stage has read them (see
+# compressed_files.py), "gzip", "zstd" (needs the zstandard package) or
+# None to leave them as they are. They are still read the same way.
+compression = os.environ.get("ClinVar_Search_Compression")
+
+# Move validator and clinvar files into dated archive bundles once they
+# are in the database (see intermediate_archive.py), so each run only
+# lists the files still being worked on. Bundles older than
+# retention_days are deleted, None keeps them.
+archive_ingested = False
+retention_days = None
+
+# Size of each chunk for the resumable chunked uploads (see
+# chunked_uploads.py), the client may ask for another size when it starts.
+upload_chunk_size = 8 * 1024 * 1024
+
+# Limits on the chunked uploads a client can start. Each chunk is sent in
+# one request so it can be no bigger than max_upload_chunk_size, and a
+# file is split into max_upload_chunks at most (ask for a bigger chunk
+# size to send a bigger file). Uploads with nothing sent for
+# chunked_upload_expiry seconds are removed with what was sent of them.
+max_chunked_upload_size = 50 * 1024 * 1024 * 1024
+max_upload_chunk_size = 64 * 1024 * 1024
+max_upload_chunks = 100000
+chunked_upload_expiry = 24 * 60 * 60
+
+# Number of files parsed at the same time in a batch upload (see
+# batch_uploads.py).
+batch_workers = 8
+
+# Limits on a zip archive sent as a batch, checked against the sizes the
+# archive lists before any of it is unpacked. Finished batch jobs are
+# forgotten batch_expiry seconds after they finish.
+max_archive_files = 1000
+max_archive_file_size = 2 * 1024 * 1024 * 1024
+max_archive_size = 20 * 1024 * 1024 * 1024
+batch_expiry = 24 * 60 * 60
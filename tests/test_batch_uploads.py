@@ -0,0 +1,180 @@
+import functools
+import io
+import time
+import zipfile
+import pytest
+import requests
+from werkzeug.datastructures import FileStorage
+import clinvar_query.modules.batch_uploads as batch_uploads
+import clinvar_query.modules.process_uploads as process_uploads
+from clinvar_query.modules.check_file_status import app_file_check
+from clinvar_query.modules.batch_uploads import (
+    archive_uploads,
+    batch_progress,
+    batch_stems,
+    process_batch,
+    start_batch,
+)
+from clinvar_query.modules.upload_index import find_upload, record_upload
+
+"""This tests uploading a batch of files at once
+This looks at:
+Files in a batch being processed, with unsupported and repeated ones refused,
+including the same title under another extension
+The files in a zip archive being read as uploads
+The batch job being given a shared session and its progress reported
+Zip archives over the file count and size limits being refused
+Finished batch jobs being forgotten after a while
+"""
+
+p1 = "tests/test_files/test1.csv"
+p5 = "tests/test_files/test5.vcf"
+
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch):
+    database = tmp_path / "uploads.db"
+    monkeypatch.setattr(process_uploads, "find_upload",
+                        functools.partial(find_upload, database=database))
+    monkeypatch.setattr(process_uploads, "record_upload",
+                        functools.partial(record_upload, database=database))
+    monkeypatch.setattr(process_uploads, "app_file_check",
+                        functools.partial(app_file_check, database=database))
+    folders = [tmp_path / "o_folder", tmp_path / "p_folder",
+               tmp_path / "e_folder"]
+    for folder in folders:
+        folder.mkdir()
+    return folders
+
+
+def upload(path, filename):
+    return FileStorage(stream=io.BytesIO(open(path, "rb").read()),
+                       filename=filename)
+
+
+def test_process_batch(folders):
+    files = [upload(p1, "plate_a1.csv"), upload(p5, "plate_a2.vcf"),
+             upload(p1, "plate_a1.csv"), upload(p1, "notes.txt"),
+             upload("tests/test_files/test5.csv", "plate_a3.csv")]
+
+    results = process_batch(files, *folders, workers=3)
+
+    assert [(name, result["message_params"]["message"])
+            for name, result in results] == [
+        ("plate_a1.csv", "upload_success"),
+        ("plate_a2.vcf", "misaligned_created"),
+        ("plate_a1.csv", "batch_duplicate_name"),
+        ("notes.txt", "unsupported_file"),
+        ("plate_a3.csv", "misaligned_created")]
+    assert batch_stems(results) == ["plate_a1_processed",
+                                    "plate_a2_processed",
+                                    "plate_a3_processed"]
+    assert sorted(path.name for path in folders[1].iterdir()) == \
+        ["plate_a1_processed.txt", "plate_a2_processed.txt",
+         "plate_a3_processed.txt"]
+
+
+def test_same_title_other_extension(folders):
+    # both would be written to plate_a1_processed.txt as the same patient
+    files = [upload(p1, "plate_a1.csv"), upload(p5, "plate_a1.vcf")]
+
+    results = process_batch(files, *folders, workers=2)
+
+    assert [result["message_params"]["message"] for _, result in results] \
+        == ["upload_success", "batch_duplicate_name"]
+    assert batch_stems(results) == ["plate_a1_processed"]
+    assert [path.name for path in folders[1].iterdir()] == [
+        "plate_a1_processed.txt"]
+
+
+def test_archive_uploads(folders):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as bundle:
+        bundle.write(p1, "plate/b1.csv")
+        bundle.write(p5, "plate/b2.vcf")
+        bundle.writestr("plate/", "")
+    archive.seek(0)
+
+    files = archive_uploads(FileStorage(stream=archive,
+                                        filename="plate.zip"))
+    assert [file.filename for file in files] == ["b1.csv", "b2.vcf"]
+
+    results = process_batch(files, *folders)
+    assert batch_stems(results) == ["b1_processed", "b2_processed"]
+    assert (folders[0] / "b1.csv").read_bytes() == open(p1, "rb").read()
+
+
+def wait_for(batch_id, timeout=10):
+    # the job runs in its own thread, which may be slow to start
+    deadline = time.time() + timeout
+    progress = batch_progress(batch_id)
+    while progress["status"] != "finished" and time.time() < deadline:
+        time.sleep(0.01)
+        progress = batch_progress(batch_id)
+    return progress
+
+
+def test_archive_limits(monkeypatch):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as bundle:
+        bundle.write(p1, "d1.csv")
+        bundle.writestr("d2.csv", b"0" * 5000)
+
+    def files():
+        archive.seek(0)
+        return archive_uploads(FileStorage(stream=archive,
+                                           filename="plate.zip"))
+
+    assert len(files()) == 2
+    # the sizes listed in the archive are checked, not the compressed ones
+    for limit, value in [("max_archive_files", 1),
+                         ("max_archive_file_size", 4999),
+                         ("max_archive_size", 5000)]:
+        with monkeypatch.context() as patch:
+            patch.setattr(batch_uploads, limit, value)
+            with pytest.raises(ValueError):
+                files()
+
+
+def test_finished_batches_forgotten(monkeypatch):
+    monkeypatch.setattr(batch_uploads, "batches", {})
+    old = start_batch([], lambda session, on_start: None)
+    wait_for(old)
+    batch_uploads.batches[old]["finished_at"] -= batch_uploads.batch_expiry + 1
+    running = start_batch([], lambda session, on_start: time.sleep(0.2))
+
+    new = start_batch([], lambda session, on_start: None)
+    assert batch_progress(old) is None
+    assert batch_progress(running) is not None
+    assert wait_for(new)["status"] == "finished"
+
+
+def test_batch_progress(tmp_path, monkeypatch):
+    validator = tmp_path / "validator"
+    clinvar = tmp_path / "clinvar"
+    validator.mkdir()
+    clinvar.mkdir()
+    monkeypatch.setattr(batch_uploads, "validator_folder", validator)
+    monkeypatch.setattr(batch_uploads, "clinvar_folder", clinvar)
+    monkeypatch.setattr(batch_uploads, "is_archived", lambda *args: False)
+    monkeypatch.setattr(batch_uploads, "is_already_ingested",
+                        lambda name, modified: name == "c1_processed.json")
+    sessions = []
+
+    def pipeline(session, on_start):
+        on_start()
+        sessions.append(session)
+        for stem in ["c1_processed", "c2_processed"]:
+            (validator / f"{stem}.json").write_text("")
+        (clinvar / "c1_processed.json").write_text("")
+
+    batch_id = start_batch(["c1_processed", "c2_processed", "c3_processed"],
+                           pipeline)
+    progress = wait_for(batch_id)
+
+    assert isinstance(sessions[0], requests.Session)
+    assert {key: progress[key] for key in
+            ["status", "files", "parsed", "validated", "annotated",
+             "ingested"]} == {"status": "finished", "files": 3, "parsed": 3,
+                              "validated": 2, "annotated": 1, "ingested": 1}
+    assert batch_progress("missing") is None
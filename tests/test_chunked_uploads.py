@@ -0,0 +1,272 @@
+import functools
+import hashlib
+import os
+import sqlite3
+import time
+import pytest
+import clinvar_query.modules.chunked_uploads as chunked_uploads
+import clinvar_query.modules.process_uploads as process_uploads
+from clinvar_query.modules.check_file_status import app_file_check
+from clinvar_query.modules.chunked_uploads import (
+    close_parser,
+    expire_chunked_uploads,
+    finish_chunked_upload,
+    save_chunk,
+    start_chunked_upload,
+    upload_status,
+)
+from clinvar_query.modules.parser import parser
+from clinvar_query.modules.upload_index import find_upload, record_upload
+
+"""This tests uploading a file in chunks which can be resumed
+This looks at:
+Chunks sent out of order being put back in place
+The start of the file being parsed before the last chunk arrives
+Missing chunks being listed and sent after a restart
+Uploads which do not match their checksum being removed
+Chunks which are out of range or the wrong size being refused
+Uploads over the size and chunk limits being refused
+Uploads nothing has been sent to for a while being removed
+A chunk changed after it was parsed starting the parser over
+An upload finished without a checksum being kept
+"""
+
+p1 = "tests/test_files/test1.vcf"
+content = open(p1, "rb").read()
+checksum = hashlib.sha256(content).hexdigest()
+parser_output = parser(p1)[0]
+
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch):
+    database = tmp_path / "uploads.db"
+    monkeypatch.setattr(process_uploads, "find_upload",
+                        functools.partial(find_upload, database=database))
+    monkeypatch.setattr(process_uploads, "record_upload",
+                        functools.partial(record_upload, database=database))
+    monkeypatch.setattr(process_uploads, "app_file_check",
+                        functools.partial(app_file_check, database=database))
+    folders = {"folder": tmp_path / "o_folder",
+               "processed_folder": tmp_path / "p_folder",
+               "error_folder": tmp_path / "e_folder"}
+    for folder in folders.values():
+        folder.mkdir()
+    return folders, database
+
+
+def chunks(chunk_size):
+    return [content[start:start + chunk_size]
+            for start in range(0, len(content), chunk_size)]
+
+
+def test_chunked_upload(folders, monkeypatch):
+    folders, database = folders
+    parsed_lines = []
+    text_lines = chunked_uploads.text_lines
+
+    def watched_lines(chunks, undecodable=None):
+        for line in text_lines(chunks, undecodable):
+            parsed_lines.append(line)
+            yield line
+
+    monkeypatch.setattr(chunked_uploads, "text_lines", watched_lines)
+    upload = start_chunked_upload("test1.vcf", len(content), 100,
+                                  folder=folders["folder"],
+                                  database=database)
+    parts = chunks(100)
+    assert upload["chunks"] == len(parts)
+
+    for index in reversed(range(len(parts) - 1)):
+        status = save_chunk(upload["upload_id"], index, parts[index],
+                            folders["folder"], database)
+    assert status["missing"] == [len(parts) - 1]
+
+    # the chunks before the last are parsed while it is still to come
+    for _ in range(100):
+        if "".join(parsed_lines).encode() == content[:content.rfind(
+                b"\n", 0, (len(parts) - 1) * 100) + 1]:
+            break
+        time.sleep(0.01)
+    else:
+        pytest.fail("the start of the upload was not parsed")
+
+    save_chunk(upload["upload_id"], len(parts) - 1, parts[-1],
+               folders["folder"], database)
+    result = finish_chunked_upload(upload["upload_id"], checksum,
+                                   folders["processed_folder"],
+                                   folders["error_folder"],
+                                   folders["folder"], database)
+
+    assert result == {'redirect_endpoint': 'process.upload_success',
+                      'message_params': {'message': 'upload_success',
+                                         'file': 'test1.vcf'}}
+    assert (folders["folder"] / "test1.vcf").read_bytes() == content
+    assert (folders["processed_folder"] / "test1_processed.txt").read_text() \
+        == parser(p1)[0]
+    assert upload_status(upload["upload_id"], database) is None
+
+
+def test_resume_after_restart(folders):
+    folders, database = folders
+    upload = start_chunked_upload("test1.vcf", len(content), 64,
+                                  folder=folders["folder"],
+                                  database=database)
+    parts = chunks(64)
+    for index in [0, 2, 3]:
+        save_chunk(upload["upload_id"], index, parts[index],
+                   folders["folder"], database)
+
+    result = finish_chunked_upload(upload["upload_id"], checksum,
+                                   folders["processed_folder"],
+                                   folders["error_folder"],
+                                   folders["folder"], database)
+    assert result["message_params"]["message"] == "upload_incomplete"
+
+    # the parser is lost when the app restarts, the file is kept
+    close_parser(upload["upload_id"])
+    status = upload_status(upload["upload_id"], database)
+    assert status["missing"] == [1] + list(range(4, len(parts)))
+    for index in status["missing"]:
+        save_chunk(upload["upload_id"], index, parts[index],
+                   folders["folder"], database)
+
+    result = finish_chunked_upload(upload["upload_id"], checksum,
+                                   folders["processed_folder"],
+                                   folders["error_folder"],
+                                   folders["folder"], database)
+    assert result["message_params"]["message"] == "upload_success"
+    assert (folders["processed_folder"] / "test1_processed.txt").read_text() \
+        == parser(p1)[0]
+
+
+def test_checksum_mismatch(folders):
+    folders, database = folders
+    upload = start_chunked_upload("test1.vcf", len(content), len(content),
+                                  folder=folders["folder"],
+                                  database=database)
+    save_chunk(upload["upload_id"], 0, content, folders["folder"], database)
+
+    result = finish_chunked_upload(upload["upload_id"], "0" * 64,
+                                   folders["processed_folder"],
+                                   folders["error_folder"],
+                                   folders["folder"], database)
+
+    assert result["message_params"] == {"message": "checksum_mismatch",
+                                        "file": "test1.vcf"}
+    assert list(folders["folder"].iterdir()) == []
+    assert list(folders["processed_folder"].iterdir()) == []
+    assert upload_status(upload["upload_id"], database) is None
+
+
+def test_bad_chunks(folders):
+    folders, database = folders
+    upload = start_chunked_upload("test1.vcf", 250, 100,
+                                  folder=folders["folder"],
+                                  database=database)
+
+    with pytest.raises(ValueError):
+        save_chunk(upload["upload_id"], 3, b"x" * 50, folders["folder"],
+                   database)
+    with pytest.raises(ValueError):
+        save_chunk(upload["upload_id"], 2, b"x" * 100, folders["folder"],
+                   database)
+    assert save_chunk("missing", 0, b"", folders["folder"], database) is None
+    with pytest.raises(ValueError):
+        start_chunked_upload("test1.vcf", 250, 0, folder=folders["folder"],
+                             database=database)
+
+    chunked_uploads.cancel_chunked_upload(upload["upload_id"],
+                                          folders["folder"], database)
+    assert list(folders["folder"].iterdir()) == []
+
+
+def test_upload_limits(folders, monkeypatch):
+    folders, database = folders
+    monkeypatch.setattr(chunked_uploads, "max_chunked_upload_size", 1000)
+    monkeypatch.setattr(chunked_uploads, "max_upload_chunk_size", 500)
+    monkeypatch.setattr(chunked_uploads, "max_upload_chunks", 10)
+
+    for size, chunk_size in [(1001, 500), (1000, 501), (1000, 99)]:
+        with pytest.raises(ValueError):
+            start_chunked_upload("test1.vcf", size, chunk_size,
+                                 folder=folders["folder"], database=database)
+    upload = start_chunked_upload("test1.vcf", 1000, 100,
+                                  folder=folders["folder"], database=database)
+    assert upload["chunks"] == 10
+    assert (folders["folder"] / f"{upload['upload_id']}.part").stat() \
+        .st_size == 1000
+
+
+def test_expired_uploads(folders):
+    folders, database = folders
+    old = start_chunked_upload("test1.vcf", len(content), 100,
+                               folder=folders["folder"], database=database)
+    save_chunk(old["upload_id"], 0, content[:100], folders["folder"],
+               database)
+    new = start_chunked_upload("test1.vcf", len(content), 100,
+                               folder=folders["folder"], database=database)
+
+    # nothing has been sent to the first upload for two days
+    a_while_ago = time.time() - 2 * 24 * 60 * 60
+    con = sqlite3.connect(database)
+    with con:
+        con.execute("UPDATE upload_sessions SET started_at = ? "
+                    "WHERE upload_id = ?", (a_while_ago, old["upload_id"]))
+    con.close()
+    os.utime(folders["folder"] / f"{old['upload_id']}.part",
+             (a_while_ago, a_while_ago))
+
+    assert expire_chunked_uploads(folders["folder"], database) == [
+        old["upload_id"]]
+    assert old["upload_id"] not in chunked_uploads.parsers
+    assert upload_status(old["upload_id"], database) is None
+    assert [path.name for path in folders["folder"].iterdir()] == [
+        f"{new['upload_id']}.part"]
+
+
+def test_parsed_chunk_changed(folders):
+    folders, database = folders
+    upload = start_chunked_upload("test1.vcf", len(content), 100,
+                                  folder=folders["folder"], database=database)
+    parts = chunks(100)
+    save_chunk(upload["upload_id"], 0, b"x" * 100, folders["folder"],
+               database)
+    parser = chunked_uploads.parsers[upload["upload_id"]]
+
+    # the same bytes again leave the parser as it is
+    save_chunk(upload["upload_id"], 0, b"x" * 100, folders["folder"],
+               database)
+    assert chunked_uploads.parsers[upload["upload_id"]] is parser
+
+    for index, part in enumerate(parts):
+        save_chunk(upload["upload_id"], index, part, folders["folder"],
+                   database)
+    assert chunked_uploads.parsers[upload["upload_id"]] is not parser
+
+    result = finish_chunked_upload(upload["upload_id"], checksum,
+                                   folders["processed_folder"],
+                                   folders["error_folder"],
+                                   folders["folder"], database)
+    assert result["message_params"]["message"] == "upload_success"
+    assert (folders["processed_folder"] / "test1_processed.txt").read_text() \
+        == parser_output
+
+
+def test_finish_without_checksum(folders):
+    folders, database = folders
+    upload = start_chunked_upload("test1.vcf", len(content), len(content),
+                                  folder=folders["folder"], database=database)
+    save_chunk(upload["upload_id"], 0, content, folders["folder"], database)
+
+    with pytest.raises(ValueError):
+        finish_chunked_upload(upload["upload_id"], "",
+                              folders["processed_folder"],
+                              folders["error_folder"], folders["folder"],
+                              database)
+    assert upload_status(upload["upload_id"], database)["missing"] == []
+
+    result = finish_chunked_upload(upload["upload_id"], checksum,
+                                   folders["processed_folder"],
+                                   folders["error_folder"],
+                                   folders["folder"], database)
+    assert result["message_params"]["message"] == "upload_success"
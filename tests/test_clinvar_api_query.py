@@ -12,6 +12,7 @@ Purpose:      Unit tests for the clinvar_api_query module.
               This test suite covers:
                 - search_clinvar: success and error handling
                 - get_esummary: success, empty input, and error handling
+                - get_gene_info: HGNC id found, and no gene reported
                 - process_clinvar: various scenarios including
                     * missing fields
                     * invalid JSON input
@@ -28,6 +29,7 @@ from pathlib import Path
 
 # Import the module under test
 from clinvar_query.modules import clinvar_api_query as module
+from clinvar_query.modules.json_records import read_records
 
 
 # -------------------------------------------------------------------
@@ -158,7 +160,7 @@ def test_process_clinvar_missing_variant(tmp_path):
     module.process_clinvar(tmp_path, outdir)
 
     out = (outdir / "file.json").read_text()
-    assert out == "[]"
+    assert out == ""
 
 
 def test_process_clinvar_missing_g_hgvs_keyerror(tmp_path):
@@ -175,7 +177,7 @@ def test_process_clinvar_missing_g_hgvs_keyerror(tmp_path):
 
     module.process_clinvar(tmp_path, outdir)
 
-    out = json.loads((outdir / "file.json").read_text())
+    out = list(read_records(outdir / "file.json"))
     assert out == []
 
 
@@ -193,7 +195,7 @@ def test_process_clinvar_missing_g_hgvs_nested(tmp_path):
 
     module.process_clinvar(tmp_path, outdir)
 
-    out = json.loads((outdir / "file.json").read_text())
+    out = list(read_records(outdir / "file.json"))
     assert out == []
 
 
@@ -210,9 +212,20 @@ def test_process_clinvar_success(tmp_path):
             "variant": "V1",
             "result": {
                 "V1": {
-                    "V1": {"g_hgvs": "NC_1:g.123A>T"}
+                    "V1": {
+                        "g_hgvs": "NC_1:g.123A>T",
+                        "hgvs_t_and_p": {
+                            "NM_1.1": {
+                                "gene_info": {
+                                    "hgnc_id": "HGNC:1",
+                                    "symbol": "GENE1"
+                                }
+                            }
+                        }
+                    }
                 }
-            }
+            },
+            "samples": ["patient1", "patient3"]
         }
     ]
     infile = tmp_path / "file.json"
@@ -224,7 +237,30 @@ def test_process_clinvar_success(tmp_path):
 
     summary_resp = MagicMock()
     summary_resp.raise_for_status.return_value = None
-    summary_resp.json.return_value = {"result": {"100": {"foo": "bar"}}}
+    summary_resp.json.return_value = {"result": {
+        "uids": ["100"],
+        "100": {
+            "genes": [{"symbol": "GENE1", "geneid": "1"}],
+            "variation_set": [{
+                "variation_loc": [
+                    {"status": "previous", "chr": "12", "assembly_name": "GRCh37"},
+                    {"status": "current", "chr": "12", "assembly_name": "GRCh38"},
+                ],
+                "allele_freq_set": [
+                    {"source": "1000 Genomes Project", "value": "0.1"},
+                    {"source": "The Genome Aggregation Database (gnomAD)",
+                     "value": "0.01"},
+                ],
+            }],
+            "germline_classification": {
+                "description": "Pathogenic",
+                "review_status": "reviewed by expert panel",
+                "trait_set": [{"trait_name": "Disease", "trait_xrefs": []}],
+                "last_evaluated": "2020/01/01 00:00",
+            },
+            "supporting_submissions": {"scv": ["SCV1"]},
+        },
+    }}
 
     def get_mock(url, params):
         """Route mocked requests based on URL content."""
@@ -233,9 +269,78 @@ def test_process_clinvar_success(tmp_path):
     with patch("requests.get", get_mock):
         module.process_clinvar(tmp_path, outdir)
 
-    out = json.loads((outdir / "file.json").read_text())
+    out = list(read_records(outdir / "file.json"))
     assert out[0]["clinvar_ids"] == ["100"]
-    assert out[0]["esummary"] == {"100": {"foo": "bar"}}
+    # only the fields json_to_dir reads are kept, in the ESummary layout
+    assert out[0]["esummary"] == {
+        "uids": ["100"],
+        "100": {
+            "genes": [{"symbol": "GENE1"}],
+            "variation_set": [{
+                "variation_loc": [{"status": "current", "chr": "12"}],
+                "allele_freq_set": [{
+                    "source": "The Genome Aggregation Database (gnomAD)",
+                    "value": "0.01"}],
+            }],
+            "germline_classification": {
+                "description": "Pathogenic",
+                "review_status": "reviewed by expert panel",
+                "trait_set": [{"trait_name": "Disease"}],
+            },
+        },
+    }
+    assert out[0]["gene_info"] == {"hgnc_id": "HGNC:1", "symbol": "GENE1"}
+    assert out[0]["samples"] == ["patient1", "patient3"]
+
+
+def test_process_clinvar_local_g_hgvs(tmp_path):
+    """
+        Verify that variants described locally, with the g_hgvs at the
+        top of the entry, are searched in ClinVar.
+        """
+    outdir = tmp_path / "out"
+    outdir.mkdir()
+
+    entry = [{"variant": "1-2-A-G", "g_hgvs": "NC_000001.11:g.2A>G",
+              "source": "local"}]
+    infile = tmp_path / "file.json"
+    infile.write_text(json.dumps(entry))
+
+    mock_resp = MagicMock()
+    mock_resp.raise_for_status.return_value = None
+    mock_resp.json.return_value = {"esearchresult": {"idlist": []}}
+
+    with patch("requests.get", return_value=mock_resp) as mock_get:
+        module.process_clinvar(tmp_path, outdir)
+
+    out = list(read_records(outdir / "file.json"))
+    assert out[0]["g_hgvs"] == "NC_000001.11:g.2A>G"
+    assert out[0]["esummary"] == {}
+    assert mock_get.call_args_list[0][1]["params"]["term"] == \
+        "NC_000001.11:g.2A>G"
+
+
+def test_process_clinvar_compact_entry(tmp_path):
+    """
+        Verify that compact VariantValidator records keep their gene.
+        """
+    outdir = tmp_path / "out"
+    outdir.mkdir()
+
+    entry = [{"variant": "V1", "g_hgvs": "NC_1:g.1A>G",
+              "gene_info": {"hgnc_id": "HGNC:1", "symbol": "GENE1"}}]
+    infile = tmp_path / "file.json"
+    infile.write_text(json.dumps(entry))
+
+    mock_resp = MagicMock()
+    mock_resp.raise_for_status.return_value = None
+    mock_resp.json.return_value = {"esearchresult": {"idlist": []}}
+
+    with patch("requests.get", return_value=mock_resp):
+        module.process_clinvar(tmp_path, outdir)
+
+    out = list(read_records(outdir / "file.json"))
+    assert out[0]["gene_info"] == {"hgnc_id": "HGNC:1", "symbol": "GENE1"}
 
 
 def test_process_clinvar_write_error(tmp_path):
@@ -255,10 +360,35 @@ def test_process_clinvar_write_error(tmp_path):
     mock_resp.json.return_value = {"esearchresult": {"idlist": []}}
 
     with patch("requests.get", return_value=mock_resp), \
-         patch("json.dump", side_effect=Exception("write error")):
+         patch.object(module, "write_record",
+                      side_effect=Exception("write error")):
         module.process_clinvar(tmp_path, outdir)
 
+    assert list(outdir.iterdir()) == []
 
 
+# -------------------------------------------------------------------
+# get_gene_info tests
+# -------------------------------------------------------------------
+def test_get_gene_info():
+    """
+       Verify that the first transcript reporting an HGNC id is used.
+       """
+    variant_result = {
+        "hgvs_t_and_p": {
+            "NR_1.1": {"gene_info": {}},
+            "NM_2.1": {"gene_info": {"hgnc_id": "HGNC:18618",
+                                     "symbol": "LRRK2"}},
+        }
+    }
+
+    assert module.get_gene_info(variant_result) == {
+        "hgnc_id": "HGNC:18618", "symbol": "LRRK2"}
 
 
+def test_get_gene_info_missing():
+    """
+       Verify that None is returned when no transcript reports a gene.
+       """
+    assert module.get_gene_info({}) is None
+    assert module.get_gene_info({"hgvs_t_and_p": {"intergenic": None}}) is None
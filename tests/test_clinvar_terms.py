@@ -0,0 +1,41 @@
+from clinvar_query.modules.clinvar_terms import (
+    star_count,
+    render_star_rating,
+    parse_star_rating,
+    condition_tokens,
+    normalise_condition,
+)
+
+"""This tests the review status and star rating helpers
+The star count is what is stored, the rating is rendered for display
+Ratings written by older versions can be read back when upgrading
+Condition names are split into words for the condition search"""
+
+
+def test_star_count():
+    assert star_count("criteria provided, single submitter") == 1
+    assert star_count("Reviewed by expert panel") == 3
+    assert star_count(None) == 0
+    assert star_count("something new") == 0
+
+
+def test_render_star_rating():
+    assert render_star_rating("practice guideline", 4) == "practice guideline (⭐⭐⭐⭐)"
+    assert render_star_rating(None, 0) == "Unknown (☆☆☆☆)"
+    assert render_star_rating(None, None) is None
+
+
+def test_parse_star_rating():
+    rating = "criteria provided, multiple submitters, no conflicts (⭐⭐☆☆)"
+
+    assert parse_star_rating(rating) == ("criteria provided, multiple submitters, no conflicts", 2)
+    assert parse_star_rating("Unknown (☆☆☆☆)") == (None, 0)
+    assert parse_star_rating(None) == (None, 0)
+
+
+def test_condition_tokens():
+    assert condition_tokens("Parkinson disease 8, autosomal dominant") == [
+        "parkinson", "disease", "8", "autosomal", "dominant"]
+    assert normalise_condition("Early-onset  Parkinson") == \
+        "early onset parkinson"
+    assert condition_tokens(None) == []
@@ -0,0 +1,174 @@
+import gzip
+import sqlite3
+import pytest
+import clinvar_query.modules.clinvar_vcf_annotation as cva
+import clinvar_query.modules.insert_annotated_results as insert_annotated_results
+from clinvar_query.modules.setup_results import create_database
+from clinvar_query.modules.clinvar_vcf_annotation import (
+    sorted_lines,
+    clinvar_records,
+    record_annotation,
+    merge_join,
+)
+
+"""This tests annotating processed files from a small made up ClinVar VCF
+This looks at:
+Sorting processed lines in memory and through sorted runs on disk
+Joining sorted variants to sorted ClinVar records, including two
+different alleles at one position
+An unsorted ClinVar VCF being refused
+Inserting the matched variants for every carrying sample
+A changed file moving its variants to the new run and removing those
+taken out of it
+Linking variants to genes already in the gene index by their symbol
+"""
+
+clinvar_vcf_text = "\n".join([
+    "##fileformat=VCFv4.1",
+    "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO",
+    "1\t100\t111\tA\tG\t.\t.\tCLNSIG=Benign;CLNREVSTAT=criteria_provided,"
+    "_multiple_submitters,_no_conflicts;CLNDN=not_provided;GENEINFO=ABC:1",
+    "1\t100\t112\tA\tT\t.\t.\tCLNSIG=Pathogenic;CLNREVSTAT=no_assertion_criteria"
+    "_provided;CLNDN=Disease_one|Disease_two;CLNHGVS=NC_000001.11:g.100A>T",
+    "2\t50\t113\tC\tCA\t.\t.\tCLNSIG=Uncertain_significance",
+    "12\t40367069\t114\tA\tG\t.\t.\tCLNSIG=Pathogenic;GENEINFO=LRRK2:120892",
+    "MT\t3243\t115\tA\tG\t.\t.\tCLNSIG=Pathogenic",
+]) + "\n"
+
+
+@pytest.fixture
+def clinvar_vcf(tmp_path):
+    path = tmp_path / "clinvar.vcf.gz"
+    with gzip.open(path, "wt") as vcf:
+        vcf.write(clinvar_vcf_text)
+    return path
+
+
+def test_sorted_lines_in_memory_and_on_disk(tmp_path):
+    lines = ["X-5-A-G", "12-9-C-T\tp1", "2-50-C-CA", "chr1-100-A-T",
+             "bad line", "1-7-G-A", "M-3243-A-G"]
+    expected = ["1-7-G-A", "chr1-100-A-T", "2-50-C-CA", "12-9-C-T\tp1",
+                "X-5-A-G", "M-3243-A-G"]
+
+    assert list(sorted_lines(lines)) == expected
+    assert list(sorted_lines(lines, chunk_size=2, temp_dir=tmp_path)) == \
+        expected
+
+
+def test_merge_join(clinvar_vcf):
+    lines = ["1-100-A-T\tp1,p2", "1-100-A-C", "2-50-C-CA",
+             "12-40367069-A-G", "chrM-3243-A-G", "22-10-G-A"]
+    matches = list(merge_join(lines, clinvar_records(clinvar_vcf)))
+
+    assert [(m["variant_id"], m["clinvar_id"]) for m in matches] == [
+        ("1-100-A-T", "112"),
+        ("2-50-C-CA", "113"),
+        ("12-40367069-A-G", "114"),
+        ("chrM-3243-A-G", "115"),
+    ]
+    assert matches[0]["samples"] == ["p1", "p2"]
+    assert matches[1]["samples"] == []
+
+
+def test_record_annotation(clinvar_vcf):
+    fields = list(clinvar_records(clinvar_vcf))[0][3]
+    annotation = record_annotation("1-100-A-G", fields)
+
+    assert annotation["consensus_classification"] == "Benign"
+    assert annotation["review_status"] == \
+        "criteria provided, multiple submitters, no conflicts"
+    assert annotation["stars"] == 2
+    assert annotation["conditions"] == ["not provided"]
+    assert annotation["gene"] == "ABC"
+    assert annotation["allele_frequency"] is None
+
+
+def test_unsorted_clinvar_vcf(tmp_path):
+    path = tmp_path / "unsorted.vcf"
+    path.write_text("2\t10\t1\tA\tG\t.\t.\t.\n1\t10\t2\tA\tG\t.\t.\t.\n")
+
+    with pytest.raises(ValueError):
+        list(clinvar_records(path))
+
+
+def test_bulk_annotate(clinvar_vcf, tmp_path, monkeypatch):
+    database = tmp_path / "bulk.db"
+    create_database(database)
+    monkeypatch.setattr(insert_annotated_results, "database_file",
+                        str(database))
+    processed = tmp_path / "run1.txt"
+    processed.write_text("12-40367069-A-G\tp1,p2\n1-100-A-T\tp2\n3-1-A-G\tp3\n")
+    connections = []
+    connect = sqlite3.connect
+    monkeypatch.setattr(insert_annotated_results.sqlite3, "connect",
+                        lambda *args: connections.append(args) or
+                        connect(*args))
+
+    # one annotation in each batch, so the second batch is written with
+    # the same connection
+    monkeypatch.setattr(insert_annotated_results, "BATCH_SIZE", 1)
+    assert cva.bulk_annotate(processed, clinvar_vcf) == 3
+    # earlier variants, starting the run, the inserts and finishing the run
+    assert len(connections) <= 5
+
+    con = sqlite3.connect(database)
+    assert con.execute("""
+        SELECT patient_id, variant_id, run_id FROM variants
+        ORDER BY variant_id, patient_id
+    """).fetchall() == [("p2", "1-100-A-T", 1), ("p1", "12-40367069-A-G", 1),
+                        ("p2", "12-40367069-A-G", 1)]
+    assert con.execute("""
+        SELECT clinvar.variant_id, classification, stars FROM clinvar
+        JOIN classifications USING (classification_id)
+        ORDER BY clinvar.variant_id
+    """).fetchall() == [("1-100-A-T", "Pathogenic", 0),
+                        ("12-40367069-A-G", "Pathogenic", 0)]
+    assert sorted(row[0] for row in con.execute(
+        "SELECT condition_name FROM conditions")) == ["Disease one",
+                                                      "Disease two"]
+    assert con.execute("SELECT variant_count, finished_at IS NOT NULL "
+                       "FROM annotation_runs").fetchall() == [(3, 1)]
+    con.close()
+
+
+def test_bulk_annotate_changed_file(clinvar_vcf, tmp_path, monkeypatch):
+    database = tmp_path / "bulk.db"
+    create_database(database)
+    monkeypatch.setattr(insert_annotated_results, "database_file",
+                        str(database))
+    processed = tmp_path / "run1.txt"
+    processed.write_text("12-40367069-A-G\tp1,p2\n1-100-A-T\tp2\n")
+    assert cva.bulk_annotate(processed, clinvar_vcf) == 3
+
+    # p2 no longer carries the LRRK2 variant and 1-100-A-T is gone
+    processed.write_text("12-40367069-A-G\tp1\n1-100-A-G\tp3\n")
+    modified = processed.stat().st_mtime + 10
+    cva.os.utime(processed, (modified, modified))
+    assert cva.bulk_annotate(processed, clinvar_vcf) == 2
+
+    con = sqlite3.connect(database)
+    assert con.execute("""
+        SELECT patient_id, variant_id, run_id FROM variants
+        ORDER BY variant_id, patient_id
+    """).fetchall() == [("p3", "1-100-A-G", 2), ("p1", "12-40367069-A-G", 2)]
+    con.close()
+
+
+def test_bulk_annotate_gene_index(clinvar_vcf, tmp_path, monkeypatch):
+    database = tmp_path / "bulk.db"
+    create_database(database)
+    monkeypatch.setattr(insert_annotated_results, "database_file",
+                        str(database))
+    con = sqlite3.connect(database)
+    con.execute("INSERT INTO genes VALUES ('HGNC:18618', 'LRRK2')")
+    con.execute("INSERT INTO gene_aliases VALUES ('LRRK2', 'HGNC:18618')")
+    con.commit()
+
+    processed = tmp_path / "run1.txt"
+    processed.write_text("12-40367069-A-G\tp1\n1-100-A-G\tp1\n")
+    assert cva.bulk_annotate(processed, clinvar_vcf) == 2
+
+    # ABC is not in the gene index so 1-100-A-G is not linked to a gene
+    assert con.execute("SELECT hgnc_id, variant_id FROM variant_genes"
+                       ).fetchall() == [("HGNC:18618", "12-40367069-A-G")]
+    con.close()
@@ -0,0 +1,127 @@
+import gzip
+import json
+import os
+import pytest
+from flask import Flask
+import clinvar_query.modules.compressed_files as compressed_files
+from clinvar_query.modules.compressed_files import (
+    available_method,
+    base_name,
+    benchmark,
+    compress_file,
+    open_text,
+    stored_stems,
+)
+from clinvar_query.modules.json_records import read_records
+from clinvar_query.modules.read_uploads import stream_file
+
+"""This tests compressing the files the pipeline has finished with
+This looks at:
+A file compressed in place keeping its modified time
+Compressed files being read the same as plain ones
+Compressed outputs still counting as done for the skip logic
+gzip being used when zstd is set but zstandard is not installed
+Processed files being viewed after they are compressed
+The benchmark report
+"""
+
+records = [{"variant": f"1-{n}-A-G", "g_hgvs": f"NC_000001.11:g.{n}A>G"}
+           for n in range(1, 200)]
+
+
+@pytest.fixture(autouse=True)
+def manifest(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(compressed_files, "forget_file",
+                        lambda path, database: True)
+    monkeypatch.setattr(compressed_files, "record_file",
+                        lambda path, database: recorded.append(path))
+    return recorded
+
+
+@pytest.fixture
+def json_file(tmp_path):
+    path = tmp_path / "patient1_processed.json"
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+    os.utime(path, (1000000, 1000000))
+    return path
+
+
+def test_compress_file(json_file, manifest):
+    size = json_file.stat().st_size
+    compressed = compress_file(json_file, "gzip")
+
+    assert compressed == f"{json_file}.gz"
+    assert not json_file.exists()
+    assert os.path.getsize(compressed) < size / 5
+    assert os.path.getmtime(compressed) == 1000000
+    assert manifest == [compressed]
+    assert list(read_records(compressed)) == records
+
+    # compressing again leaves it alone
+    assert compress_file(compressed, "gzip") == compressed
+
+
+def test_compression_off(json_file):
+    assert compress_file(json_file, None) == str(json_file)
+    assert json_file.exists()
+
+
+def test_zstd_without_zstandard(monkeypatch):
+    monkeypatch.setattr(compressed_files, "zstandard", None)
+
+    assert available_method("zstd") == "gzip"
+    assert available_method("bzip2") is None
+
+
+def test_stored_stems(tmp_path):
+    for name in ["a.json", "b.json.gz", "c.json.part", "d.txt.gz"]:
+        (tmp_path / name).write_text("")
+
+    assert stored_stems(tmp_path, ".json") == {"a", "b"}
+    assert base_name("b.json.gz") == "b.json"
+
+
+def test_open_text_by_content(tmp_path):
+    # the format is read from the file, not the name
+    path = tmp_path / "patient1_processed.txt"
+    path.write_bytes(gzip.compress(b"1-2-A-G\n"))
+
+    with open_text(path) as f:
+        assert f.read() == "1-2-A-G\n"
+
+
+def test_view_compressed_processed_file(tmp_path):
+    content = "17-45983420-G-T\n1-7984929-G-A\n6-162727667-A-G\n"
+    path = tmp_path / "test1_processed.txt.gz"
+    path.write_bytes(gzip.compress(content.encode()))
+    app = Flask(__name__)
+    app.add_url_rule("/view_file", "view_file",
+                     lambda: stream_file(tmp_path, "fileprocess"))
+    client = app.test_client()
+    query = {"fileprocess": path.name}
+
+    assert client.get("/view_file", query_string=query).get_data(
+        as_text=True) == content
+
+    window = client.get("/view_file", query_string={**query, "offset": 1,
+                                                    "limit": 1})
+    assert window.get_data(as_text=True) == "1-7984929-G-A\n"
+
+    stored = client.get("/view_file", query_string=query,
+                        headers={"Accept-Encoding": "gzip"})
+    assert stored.headers["Content-Encoding"] == "gzip"
+    assert stored.get_data() == path.read_bytes()
+
+    plain = client.get("/view_file", query_string=query)
+    assert plain.get_data(as_text=True) == content
+
+
+def test_benchmark(json_file):
+    report = {row["method"]: row for row in benchmark(json_file.parent,
+                                                      methods=("gzip",))}
+
+    assert report["none"]["bytes"] == json_file.stat().st_size
+    assert report["gzip"]["ratio"] > 5
+    # the copies made for the benchmark are removed
+    assert list(json_file.parent.iterdir()) == [json_file]
@@ -1,7 +1,6 @@
 from clinvar_query.utils.database_initialisation import database_initialise
 
 db_file = "tests/test_db/test.db"
-empty_folder = "tests/test_files/empty_folder"
 
 
 def test_db_init():
@@ -17,7 +16,8 @@ def test_db_creation(tmp_path):
     assert str(db_file) == init_db  
 
 
-def test_db_fail():
-    init_db = database_initialise(empty_folder)
+def test_db_fail(tmp_path):
+    # a folder cannot be opened as a database
+    init_db = database_initialise(str(tmp_path))
 
-    init_db is None
+    assert init_db is None
@@ -10,6 +10,7 @@ This tests:
 Processed files with no errors
 Misaligned files
 The status of files, whether created, skipped or overwritten
+The file manifest is kept in a database in tmp_path
 """
 
 process_file = "tests/test_files/test1.csv"
@@ -30,7 +31,8 @@ def test_file_check_processed_file(tmp_path):
                                                 process_file,
                                                 processed_folder=p_folder,
                                                 error_folder=e_folder,
-                                                overwrite=overwrite)
+                                                overwrite=overwrite,
+                                                database=tmp_path/"manifest.db")
     assert status == "created"
 
 def test_file_check_misaligned_file(tmp_path):
@@ -45,24 +47,27 @@ def test_file_check_misaligned_file(tmp_path):
                                                 misalign_file,
                                                 processed_folder=p_folder,
                                                 error_folder=e_folder,                                                
-                                                overwrite=overwrite)
+                                                overwrite=overwrite,
+                                                database=tmp_path/"manifest.db")
     assert status == "created"
 
-def test_file_check_skipped_process_file():
+def test_file_check_skipped_process_file(tmp_path):
 
     processed_file, misaligned_file, status = app_file_check(
                                                 process_file,
                                                 processed_folder=process_folder,
                                                 error_folder=err_folder,                                                
-                                                overwrite=overwrite)
+                                                overwrite=overwrite,
+                                                database=tmp_path/"manifest.db")
     assert status == "skipped"
 
 
-def test_file_skipped_misaligned_file():
+def test_file_skipped_misaligned_file(tmp_path):
 
     processed_file, misaligned_file, status = app_file_check(
                                                 misalign_file,
                                                 processed_folder=process_folder,
                                                 error_folder=err_folder,                                                
-                                                overwrite=overwrite)
+                                                overwrite=overwrite,
+                                                database=tmp_path/"manifest.db")
     assert status == "skipped"
@@ -0,0 +1,108 @@
+import clinvar_query.modules.file_manifest as file_manifest
+from clinvar_query.modules.file_manifest import (
+    record_file,
+    sync_folder,
+    manifest_page,
+    list_files,
+)
+import os
+import sqlite3
+
+"""This tests the file manifest used to list processed and misaligned files
+Each test uses its own database and folder in tmp_path
+This looks at:
+Existing folders being scanned the first time they are listed
+Files written afterwards being recorded without another scan
+Folders changed outside the app being scanned again
+Paging through a folder with the cursor
+Folders which do not exist
+"""
+
+
+def make_file(folder, name, content, modified):
+    path = folder / name
+    path.write_text(content)
+    os.utime(path, (modified, modified))
+    return path
+
+
+def test_first_listing_scans_folder(tmp_path):
+    database = tmp_path / "manifest.db"
+    folder = tmp_path / "processed"
+    folder.mkdir()
+    make_file(folder, "old_processed.txt", "1-1-A-G", 1000)
+    make_file(folder, "new_processed.txt", "1-2-A-G", 2000)
+
+    assert list_files(folder, database=database) == ["new_processed.txt",
+                                                     "old_processed.txt"]
+
+
+def test_record_file_without_rescan(tmp_path, monkeypatch):
+    database = tmp_path / "manifest.db"
+    folder = tmp_path / "processed"
+    folder.mkdir()
+    make_file(folder, "first_processed.txt", "1-1-A-G", 1000)
+    sync_folder(folder, database=database)
+
+    # writing the file changes the folder, recording it marks the folder
+    # as synced again so it is not read
+    recorded = make_file(folder, "second_processed.txt", "1-2-A-G", 2000)
+    record_file(str(recorded), database=database)
+
+    def no_scan(*args):
+        raise AssertionError("the folder was scanned again")
+
+    monkeypatch.setattr(file_manifest, "sync_folder", no_scan)
+    assert list_files(folder, database=database) == ["second_processed.txt",
+                                                     "first_processed.txt"]
+
+    con = sqlite3.connect(database)
+    size = con.execute("SELECT size FROM file_manifest WHERE filename = ?",
+                       ("second_processed.txt",)).fetchone()[0]
+    con.close()
+    assert size == len("1-2-A-G")
+
+
+def test_changed_folder_rescanned(tmp_path):
+    database = tmp_path / "manifest.db"
+    folder = tmp_path / "processed"
+    folder.mkdir()
+    make_file(folder, "first_processed.txt", "1-1-A-G", 1000)
+    make_file(folder, "second_processed.txt", "1-2-A-G", 2000)
+    assert list_files(folder, database=database) == ["second_processed.txt",
+                                                     "first_processed.txt"]
+
+    # removed and added without going through the app
+    os.remove(folder / "second_processed.txt")
+    make_file(folder, "third_processed.txt", "1-3-A-G", 3000)
+
+    assert list_files(folder, database=database) == ["third_processed.txt",
+                                                     "first_processed.txt"]
+
+
+def test_manifest_paging(tmp_path):
+    database = tmp_path / "manifest.db"
+    folder = tmp_path / "processed"
+    folder.mkdir()
+    for number in range(5):
+        make_file(folder, f"p{number}_processed.txt", "1-1-A-G", 1000 + number)
+
+    first, cursor = manifest_page(folder, limit=2, database=database)
+    second, cursor_2 = manifest_page(folder, after=cursor, limit=2,
+                                     database=database)
+    third, cursor_3 = manifest_page(folder, after=cursor_2, limit=2,
+                                    database=database)
+
+    assert first == ["p4_processed.txt", "p3_processed.txt"]
+    assert second == ["p2_processed.txt", "p1_processed.txt"]
+    assert third == ["p0_processed.txt"]
+    assert cursor_3 is None
+
+
+def test_missing_folder(tmp_path):
+    database = tmp_path / "manifest.db"
+
+    files, cursor = manifest_page(tmp_path / "missing", database=database)
+
+    assert files == []
+    assert cursor is None
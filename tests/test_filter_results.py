@@ -0,0 +1,36 @@
+from clinvar_query.modules.filter_results import parse_filters, filter_clause
+import pytest
+
+"""This tests reading the allele frequency, star and classification filters
+This looks at:
+Only given filters being returned
+Number filters which are not numbers
+The column the filtered rows are read in order of
+"""
+
+
+def test_parse_filters():
+    args = {"af_max": "0.01", "min_stars": "2", "classification": " Pathogenic ",
+            "af_min": ""}
+
+    assert parse_filters(args) == {"af_max": 0.01, "min_stars": 2,
+                                   "classification": "Pathogenic"}
+
+
+def test_parse_invalid_filters():
+    with pytest.raises(ValueError):
+        parse_filters({"af_max": "rare"})
+
+
+def test_filter_clause():
+    conditions, params, sort_column = filter_clause({"af_max": 0.01,
+                                                     "min_stars": 2})
+
+    assert conditions == ["clinvar.allele_frequency <= ?",
+                          "clinvar.stars >= ?"]
+    assert params == [0.01, 2]
+    assert sort_column == "clinvar.allele_frequency"
+
+
+def test_no_filters():
+    assert filter_clause({}) == ([], [], None)
@@ -0,0 +1,81 @@
+import io
+import pytest
+from werkzeug.datastructures import FileStorage
+from clinvar_query.modules.gene_panel import (
+    read_bed,
+    load_panel,
+    save_panel,
+    stored_panels,
+    in_panel,
+)
+
+"""This tests loading gene panels from BED files and checking variants
+This looks at:
+Header lines being skipped and overlapping regions being merged
+Variants at the edges of a region
+Mitochondrial regions written as chrMT or chrM
+Panels which are missing or are not BED files
+Stored panels only being replaced with overwrite on
+"""
+
+panel_folder = "tests/test_files/test_panels"
+
+
+def test_read_bed():
+    regions = read_bed(f"{panel_folder}/park_panel.bed")
+
+    # the second PRKN region is inside the first and is merged into it
+    assert regions["6"] == ([161347416], [162727771])
+    assert sorted(regions) == ["12", "17", "6"]
+
+
+def test_in_panel():
+    panel = load_panel("park_panel.bed", panel_folder)
+
+    assert in_panel(panel, "chr12", 40196743, 40196744)
+    assert in_panel(panel, "12", 40369284, 40369285)
+    assert not in_panel(panel, "12", 40369285, 40369286)
+    assert not in_panel(panel, "12", 40196742, 40196743)
+    assert not in_panel(panel, "1", 7984980, 7984981)
+
+
+def test_mitochondrial_panel(tmp_path):
+    # chrMT in the BED file matches the M variants the parser writes
+    (tmp_path / "mito.bed").write_text("chrMT\t3229\t3304\tMT-TL1\n")
+    panel = load_panel("mito.bed", tmp_path)
+
+    assert sorted(panel["regions"]) == ["M"]
+    assert in_panel(panel, "M", 3242, 3243)
+    assert in_panel(panel, "chrM", 3242, 3243)
+    assert not in_panel(panel, "M", 3304, 3305)
+
+
+def test_load_invalid_panel(tmp_path):
+    (tmp_path / "broken.bed").write_text("chr1\tstart\tend\n")
+
+    assert load_panel("broken.bed", tmp_path) is None
+    assert load_panel("missing.bed", tmp_path) is None
+
+
+def test_stored_panels(tmp_path):
+    assert stored_panels(panel_folder) == ["park_panel.bed"]
+    assert stored_panels(tmp_path / "missing") == []
+
+
+def test_save_panel(tmp_path):
+    bed = open(f"{panel_folder}/park_panel.bed", "rb").read()
+
+    def upload(content):
+        return FileStorage(stream=io.BytesIO(content),
+                           filename="park_panel.bed")
+
+    assert save_panel(upload(bed), tmp_path) == "park_panel.bed"
+    # the same panel again is fine, a different one needs overwrite
+    assert save_panel(upload(bed), tmp_path) == "park_panel.bed"
+    with pytest.raises(FileExistsError):
+        save_panel(upload(b"chr1\t0\t100\n"), tmp_path)
+    assert (tmp_path / "park_panel.bed").read_bytes() == bed
+
+    save_panel(upload(b"chr1\t0\t100\n"), tmp_path, overwrite=True)
+    assert load_panel("park_panel.bed", tmp_path)["regions"] == {
+        "1": ([0], [100])}
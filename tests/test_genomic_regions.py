@@ -0,0 +1,70 @@
+import pytest
+from clinvar_query.modules.genomic_regions import (
+    parse_variant_id,
+    parse_region,
+    region_bin,
+    overlapping_bins,
+)
+
+"""This tests reading positions from variant ids and regions, and the bins
+This looks at:
+Variant ids and regions being read as 0-based half open intervals
+Text which is not a variant id or region
+Regions outside the chromosome being cut back or refused
+chrMT and chrM regions both being read as M
+Every interval that overlaps a region being in one of its bins
+"""
+
+
+def test_parse_variant_id():
+    assert parse_variant_id("12-40367069-A-G") == ("12", 40367068, 40367069)
+    assert parse_variant_id("chrX-100-ATG-A") == ("X", 99, 102)
+    assert parse_variant_id("NM_198578.4:c.2830G>T") is None
+    assert parse_variant_id(None) is None
+
+
+def test_parse_region():
+    assert parse_region("chr12:40,200,000-40,400,000") == ("12", 40199999,
+                                                           40400000)
+    assert parse_region(" x:5-5 ") == ("X", 4, 5)
+    assert parse_region("12:400-100") is None
+    assert parse_region("LRRK2") is None
+
+
+def test_region_bounds():
+    # the end is cut back to the end of the chromosome
+    assert parse_region("1:1-999999999999") == ("1", 0, 248956422)
+    assert parse_region("chrM:16,000-20,000") == ("M", 15999, 16569)
+    assert len(overlapping_bins(0, 248956422)) < 2500
+
+    with pytest.raises(ValueError):
+        parse_region("1:999999999999-999999999999")
+    with pytest.raises(ValueError):
+        parse_region("25:1-100")
+    with pytest.raises(ValueError):
+        overlapping_bins(0, 1 << 40)
+    assert parse_region("1:1-" + "9" * 30) is None
+
+
+def test_mitochondrial():
+    # the parser writes chrM and chrMT variants as M
+    assert parse_region("chrMT:1-100") == ("M", 0, 100)
+    assert parse_region("MT:1-100") == parse_region("chrM:1-100")
+    assert parse_variant_id("MT-73-A-G") == ("M", 72, 73)
+
+
+def test_region_bins():
+    # the smallest bins are 128kb wide
+    assert region_bin(0, 1) == 585
+    assert region_bin(131071, 131073) == 73
+    assert region_bin(0, 1 << 29) == 0
+
+
+def test_overlapping_bins():
+    start, end = 40199999, 40400000
+    bins = set(overlapping_bins(start, end))
+    intervals = [(40100000, 40300000), (40399999, 40400001),
+                 (39000000, 45000000), (40250000, 40250001)]
+
+    for interval in intervals:
+        assert region_bin(*interval) in bins
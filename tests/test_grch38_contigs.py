@@ -0,0 +1,31 @@
+from clinvar_query.modules.grch38_contigs import canonical_contig, invalid_reason
+
+"""This tests the local GRCh38 checks run before VariantValidator
+This looks at:
+Contig names written in different ways
+Positions at and past the end of a chromosome
+Alleles VariantValidator cannot take
+"""
+
+
+def test_canonical_contig():
+    assert canonical_contig("chr12") == "12"
+    assert canonical_contig("NC_000023.11") == "X"
+    assert canonical_contig("MT") == canonical_contig("chrM") == "M"
+    assert canonical_contig("chrUn_KI270742v1") is None
+
+
+def test_contig_length():
+    assert invalid_reason("1", "248956422", "A", "G") is None
+    assert "past the end" in invalid_reason("1", "248956422", "AT", "A")
+    assert "past the end" in invalid_reason("M", "16570", "A", "G")
+    assert "positive" in invalid_reason("1", "0", "A", "G")
+
+
+def test_alleles():
+    assert invalid_reason("1", "100", "ATG", "a") is None
+    assert "symbolic" in invalid_reason("1", "100", "A", "<DEL>")
+    assert "symbolic" in invalid_reason("1", "100", "A", "*")
+    assert "more than one" in invalid_reason("1", "100", "A", "C,G")
+    assert "reference allele" in invalid_reason("1", "100", "R", "C")
+    assert "same as the reference" in invalid_reason("1", "100", "A", "A")
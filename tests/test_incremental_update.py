@@ -0,0 +1,182 @@
+import datetime
+import gzip
+import json
+import os
+import sqlite3
+import time
+import pytest
+from unittest.mock import MagicMock, patch
+import clinvar_query.modules.insert_annotated_results as insert_results
+import clinvar_query.modules.json_to_db as json_to_db
+import clinvar_query.modules.intermediate_archive as archive
+from clinvar_query.modules import vv_variant_query
+from clinvar_query.modules.incremental_update import previous_records
+from clinvar_query.modules.intermediate_archive import archive_ingested
+from clinvar_query.modules.json_records import read_records
+from clinvar_query.modules.setup_results import create_database
+
+"""This tests re-annotating a patient file which has been overwritten
+This looks at:
+Only the added variants being queried, the rest copied from the old output
+Old records with an error being queried again
+Files which have not changed still being skipped
+Old outputs being read back from their archive bundle
+Removed variants being dropped from the database, only from the runs of their file
+Unchanged variants being moved to the new run, so it lists the whole file
+Files with no valid entries being recorded with an empty run
+"""
+
+
+def write_lines(path, records):
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+
+
+def clinvar_entry(variant):
+    uid = variant.split("-")[1]
+    return {"variant": variant, "g_hgvs": f"NC_000001.11:g.{uid}A>G",
+            "esummary": {"uids": [uid], uid: {"germline_classification": {
+                "description": "Benign",
+                "review_status": "criteria provided, single submitter"}}}}
+
+
+def test_overwritten_file_queries_added_variants(tmp_path, monkeypatch):
+    processed = tmp_path / "p1_processed.txt"
+    processed.write_text("1-2-A-G\n1-3-A-G\n1-4-A-G\n")
+    out = tmp_path / "out"
+    out.mkdir()
+    old = out / "p1_processed.json.gz"
+    old.write_bytes(gzip.compress(
+        b'{"variant":"1-2-A-G","g_hgvs":"NC_000001.11:g.2A>G"}\n'
+        b'{"variant":"1-3-A-G","error":"Failed to retrieve data (500)"}\n'
+        b'{"variant":"1-9-A-G","g_hgvs":"NC_000001.11:g.9A>G"}\n'))
+    os.utime(old, (1000000, 1000000))
+    monkeypatch.setattr(vv_variant_query, "is_archived", lambda *args: False)
+
+    response = MagicMock(status_code=200)
+    response.json.return_value = {}
+    with patch.object(vv_variant_query, "output_folder", out), \
+            patch("glob.glob", return_value=[str(processed)]), \
+            patch("requests.get", return_value=response) as get:
+        vv_variant_query.vv_variant_query()
+
+    queried = [call.args[0].split("/")[-4] for call in get.call_args_list]
+    assert queried == ["1-3-A-G", "1-4-A-G"]
+    assert [record["variant"] for record in
+            read_records(out / "p1_processed.json")] == \
+        ["1-2-A-G", "1-3-A-G", "1-4-A-G"]
+    assert next(read_records(out / "p1_processed.json")) == \
+        {"variant": "1-2-A-G", "g_hgvs": "NC_000001.11:g.2A>G"}
+    # the old compressed output is replaced
+    assert [path.name for path in out.iterdir()] == ["p1_processed.json"]
+
+    # nothing has changed since, the file is skipped
+    with patch.object(vv_variant_query, "output_folder", out), \
+            patch("glob.glob", return_value=[str(processed)]), \
+            patch("requests.get") as get:
+        vv_variant_query.vv_variant_query()
+    get.assert_not_called()
+
+
+def test_previous_records_from_archive(tmp_path, monkeypatch):
+    folders = {"validator": tmp_path / "validator",
+               "clinvar": tmp_path / "clinvar"}
+    for folder in folders.values():
+        folder.mkdir()
+        write_lines(folder / "p1_processed.json", [clinvar_entry("1-2-A-G")])
+    monkeypatch.setattr(archive, "is_already_ingested", lambda *args: True)
+    bundles, database = tmp_path / "archive", tmp_path / "archive.db"
+    archive_ingested(folders, bundles, database,
+                     today=datetime.date(2026, 10, 1))
+
+    assert previous_records("clinvar", folders["clinvar"], "p1_processed",
+                            0, bundles, database) is None
+    previous = previous_records("clinvar", folders["clinvar"],
+                                "p1_processed", time.time() + 10, bundles,
+                                database)
+    assert previous == {"1-2-A-G": clinvar_entry("1-2-A-G")}
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    database = tmp_path / "results.db"
+    create_database(database)
+    monkeypatch.setattr(insert_results, "database_file", str(database))
+    monkeypatch.setattr(json_to_db, "clinvar_folder", tmp_path)
+    return database
+
+
+def test_overwritten_file_ingested(tmp_path, database):
+    clinvar_file = tmp_path / "p1_processed.json"
+    write_lines(clinvar_file, [clinvar_entry("1-2-A-G"),
+                               clinvar_entry("1-3-A-G")])
+    os.utime(clinvar_file, (1000000, 1000000))
+    json_to_db.json_to_dir()
+
+    con = sqlite3.connect(database)
+    kept = con.execute("SELECT run_id, date_annotated FROM variants "
+                       "WHERE variant_id = '1-3-A-G'").fetchone()
+
+    write_lines(clinvar_file, [clinvar_entry("1-3-A-G"),
+                               clinvar_entry("1-4-A-G")])
+    json_to_db.json_to_dir()
+
+    # the kept variant is moved to the new run without being inserted again
+    rows = con.execute("SELECT variant_id, run_id FROM variants "
+                       "ORDER BY variant_id").fetchall()
+    assert rows == [("1-3-A-G", kept[0] + 1), ("1-4-A-G", kept[0] + 1)]
+    assert con.execute("SELECT date_annotated FROM variants "
+                       "WHERE variant_id = '1-3-A-G'").fetchone()[0] == kept[1]
+    # the new version of the file is recorded as ingested
+    assert insert_results.is_already_ingested(
+        clinvar_file.name, clinvar_file.stat().st_mtime)
+
+    # a version which only takes a variant out still makes a full run
+    write_lines(clinvar_file, [clinvar_entry("1-3-A-G")])
+    later = clinvar_file.stat().st_mtime + 10
+    os.utime(clinvar_file, (later, later))
+    json_to_db.json_to_dir()
+    assert con.execute("SELECT variant_id, run_id FROM variants").fetchall() \
+        == [("1-3-A-G", kept[0] + 2)]
+    assert con.execute("SELECT variant_count FROM annotation_runs "
+                       "WHERE run_id = ?", (kept[0] + 2,)).fetchone() == (1,)
+    con.close()
+
+
+def test_removed_variant_of_other_file_kept(tmp_path, database):
+    clinvar_file = tmp_path / "p1_processed.json"
+    write_lines(clinvar_file, [clinvar_entry("1-2-A-G"),
+                               clinvar_entry("1-3-A-G")])
+    os.utime(clinvar_file, (1000000, 1000000))
+    json_to_db.json_to_dir()
+
+    # another file of the patient takes the association over
+    extra_file = tmp_path / "p1_extra.json"
+    write_lines(extra_file, [clinvar_entry("1-3-A-G")])
+    json_to_db.json_to_dir()
+    assert insert_results.drop_variants({"p1 _ (1-3-A-G)"},
+                                        clinvar_file.name) == 0
+
+    write_lines(clinvar_file, [clinvar_entry("1-2-A-G")])
+    json_to_db.json_to_dir()
+
+    con = sqlite3.connect(database)
+    assert con.execute("SELECT variant_id FROM variants "
+                       "ORDER BY variant_id").fetchall() == [("1-2-A-G",),
+                                                             ("1-3-A-G",)]
+    con.close()
+
+
+def test_file_without_entries_ingested(tmp_path, database):
+    # nothing in the file can be inserted, it is still marked as ingested
+    # so it is not read again by every pipeline run
+    clinvar_file = tmp_path / "p2_processed.json"
+    write_lines(clinvar_file, [{"variant": "1-5-A-G"}])
+    json_to_db.json_to_dir()
+
+    assert insert_results.is_already_ingested(
+        clinvar_file.name, clinvar_file.stat().st_mtime)
+    con = sqlite3.connect(database)
+    assert con.execute("SELECT variant_count FROM annotation_runs "
+                       "WHERE source_file = ?",
+                       (clinvar_file.name,)).fetchall() == [(0,)]
+    con.close()
@@ -11,6 +11,9 @@ from clinvar_query.modules.insert_annotated_results import (
     insert_patient_information,
     insert_variants,
     insert_clinvar,
+    start_annotation_run,
+    finish_annotation_run,
+    is_already_ingested,
 )
 from clinvar_query.utils.logger import logger
 import sqlite3
@@ -44,22 +47,78 @@ def temp_db(tmp_path, monkeypatch):
     cur = con.cursor()
     cur.execute("CREATE TABLE patient_information (patient_id TEXT)")
     cur.execute(
-        "CREATE TABLE variants (variant_id TEXT, patient_id TEXT, patient_variant TEXT)"
+        """
+        CREATE TABLE variants (
+            variant_id TEXT,
+            patient_id TEXT,
+            patient_variant TEXT PRIMARY KEY,
+            date_annotated DATETIME DEFAULT CURRENT_TIMESTAMP,
+            run_id INTEGER
+        )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE annotation_runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id TEXT,
+            source_file TEXT,
+            source_modified REAL,
+            started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME,
+            variant_count INTEGER DEFAULT 0
+        )
+        """
     )
     cur.execute(
         """
         CREATE TABLE clinvar (
             variant_id TEXT,
             hgvs TEXT,
-            associated_conditions TEXT,
             chromosome TEXT,
             gene TEXT,
-            consensus_classification TEXT,
-            star_rating TEXT,
+            classification_id INTEGER,
+            review_status_id INTEGER,
+            stars INTEGER,
             allele_frequency REAL
         )
         """
     )
+    cur.execute(
+        "CREATE TABLE classifications (classification_id INTEGER PRIMARY KEY, "
+        "classification TEXT UNIQUE)"
+    )
+    cur.execute(
+        "CREATE TABLE review_statuses (review_status_id INTEGER PRIMARY KEY, "
+        "review_status TEXT UNIQUE)"
+    )
+    cur.execute(
+        "CREATE TABLE conditions (condition_id INTEGER PRIMARY KEY, "
+        "condition_name TEXT UNIQUE, normalised_name TEXT)"
+    )
+    cur.execute(
+        "CREATE TABLE variant_locations (variant_id TEXT PRIMARY KEY, "
+        "chromosome TEXT, start INTEGER, end INTEGER, bin INTEGER)"
+    )
+    cur.execute(
+        "CREATE TABLE genes (hgnc_id TEXT PRIMARY KEY, symbol TEXT)"
+    )
+    cur.execute(
+        "CREATE TABLE gene_aliases (alias TEXT, hgnc_id TEXT, "
+        "PRIMARY KEY (alias, hgnc_id))"
+    )
+    cur.execute(
+        "CREATE TABLE variant_genes (hgnc_id TEXT, variant_id TEXT, "
+        "PRIMARY KEY (hgnc_id, variant_id))"
+    )
+    cur.execute(
+        "CREATE TABLE condition_tokens (token TEXT, condition_id INTEGER, "
+        "PRIMARY KEY (token, condition_id))"
+    )
+    cur.execute(
+        "CREATE TABLE clinvar_conditions (variant_id TEXT, condition_id INTEGER, "
+        "PRIMARY KEY (variant_id, condition_id))"
+    )
     con.commit()
     con.close()
 
@@ -126,11 +185,12 @@ def test_insert_clinvar(temp_db):
         {
             "variant_id": "V1",
             "hgvs": "NM_000000.1:c.1A>T",
-            "associated_conditions": "ConditionX",
+            "conditions": ["ConditionX"],
             "chromosome": "1",
             "gene": "GENE1",
             "consensus_classification": "Pathogenic",
-            "star_rating": "★★",
+            "review_status": "criteria provided, multiple submitters, no conflicts",
+            "stars": 2,
             "allele_frequency": 0.12,
         }
     )
@@ -145,3 +205,185 @@ def test_insert_clinvar(temp_db):
     assert expected == result
 
 #Made with CHATGPT
+
+
+def test_annotation_run(temp_db):
+    """
+    Check that a run is opened, finished and then counts as ingested.
+
+    A file is only treated as already ingested once its run is finished,
+    and only for the same (or an older) modification time.
+    """
+    run_id = start_annotation_run("P001", "P001_processed.json", 100.0)
+
+    assert not is_already_ingested("P001_processed.json", 100.0)
+
+    finish_annotation_run(run_id, 2)
+
+    con = sqlite3.connect(temp_db)
+    result = con.execute(
+        "SELECT patient_id, variant_count FROM annotation_runs WHERE run_id = ?",
+        (run_id,),
+    ).fetchall()
+    con.close()
+
+    logger.info(f"testing annotation runs: {result}")
+    assert result == [("P001", 2)]
+    assert is_already_ingested("P001_processed.json", 100.0)
+    assert not is_already_ingested("P001_processed.json", 200.0)
+
+
+def test_insert_variants_moves_to_latest_run(temp_db):
+    """
+    Check that annotating an existing association again moves it
+    to the new run rather than being ignored.
+    """
+    record = {
+        "variant_id": "V1",
+        "patient_id": "P001",
+        "patient_variant": "P001_V1",
+    }
+
+    insert_variants({**record, "run_id": 1})
+    insert_variants({**record, "run_id": 2})
+
+    con = sqlite3.connect(temp_db)
+    result = con.execute(
+        "SELECT patient_variant, run_id FROM variants"
+    ).fetchall()
+    con.close()
+
+    assert result == [("P001_V1", 2)]
+
+
+def test_insert_clinvar_lookup_tables(temp_db):
+    """
+    Check that repeated classification, review status and condition
+    text is stored once and referenced by id.
+    """
+    for variant_id in ("V1", "V2"):
+        insert_clinvar(
+            {
+                "variant_id": variant_id,
+                "conditions": ["ConditionX", "ConditionY"],
+                "consensus_classification": "Pathogenic",
+                "review_status": "reviewed by expert panel",
+                "stars": 3,
+            }
+        )
+
+    con = sqlite3.connect(temp_db)
+    classifications = con.execute(
+        "SELECT classification FROM classifications"
+    ).fetchall()
+    result = con.execute(
+        """
+        SELECT clinvar.variant_id, classification, review_status, stars
+        FROM clinvar
+        JOIN classifications USING (classification_id)
+        JOIN review_statuses USING (review_status_id)
+        ORDER BY clinvar.variant_id
+        """
+    ).fetchall()
+    links = con.execute(
+        """
+        SELECT variant_id, condition_name FROM clinvar_conditions
+        JOIN conditions USING (condition_id)
+        ORDER BY variant_id, condition_name
+        """
+    ).fetchall()
+    con.close()
+
+    assert classifications == [("Pathogenic",)]
+    assert result == [
+        ("V1", "Pathogenic", "reviewed by expert panel", 3),
+        ("V2", "Pathogenic", "reviewed by expert panel", 3),
+    ]
+    assert links == [
+        ("V1", "ConditionX"),
+        ("V1", "ConditionY"),
+        ("V2", "ConditionX"),
+        ("V2", "ConditionY"),
+    ]
+
+
+def test_insert_clinvar_condition_tokens(temp_db):
+    """
+    Check that a new condition is stored with its normalised name
+    and one search token per word.
+    """
+    for variant_id in ("V1", "V2"):
+        insert_clinvar(
+            {
+                "variant_id": variant_id,
+                "conditions": ["Dilated cardiomyopathy 1A"],
+            }
+        )
+
+    con = sqlite3.connect(temp_db)
+    names = con.execute(
+        "SELECT normalised_name FROM conditions"
+    ).fetchall()
+    tokens = con.execute(
+        "SELECT token FROM condition_tokens ORDER BY token"
+    ).fetchall()
+    con.close()
+
+    assert names == [("dilated cardiomyopathy 1a",)]
+    assert tokens == [("1a",), ("cardiomyopathy",), ("dilated",)]
+
+
+def test_insert_clinvar_gene_index(temp_db):
+    """
+    Check that the HGNC id is added to the gene index with each symbol
+    as an alias, and linked to every variant in the gene.
+    """
+    insert_clinvar(
+        {
+            "variant_id": "V1",
+            "hgnc_id": "HGNC:18618",
+            "gene_symbols": ["LRRK2", "Lrrk2"],
+        }
+    )
+    insert_clinvar(
+        {
+            "variant_id": "V2",
+            "hgnc_id": "HGNC:18618",
+            "gene_symbols": [None, "PARK8"],
+        }
+    )
+
+    con = sqlite3.connect(temp_db)
+    genes = con.execute("SELECT hgnc_id, symbol FROM genes").fetchall()
+    aliases = con.execute(
+        "SELECT alias FROM gene_aliases ORDER BY alias"
+    ).fetchall()
+    links = con.execute(
+        "SELECT variant_id FROM variant_genes ORDER BY variant_id"
+    ).fetchall()
+    con.close()
+
+    assert genes == [("HGNC:18618", "LRRK2")]
+    assert aliases == [("LRRK2",), ("PARK8",)]
+    assert links == [("V1",), ("V2",)]
+
+
+def test_insert_variants_location(temp_db):
+    """
+    Check that the chromosome position is read from the variant id,
+    and ids which are not chrom-pos-ref-alt are left out.
+    """
+    insert_variants(
+        {"variant_id": "12-40367069-A-G", "patient_id": "P001",
+         "patient_variant": "P001_V1"}
+    )
+    insert_variants(
+        {"variant_id": "V2", "patient_id": "P001",
+         "patient_variant": "P001_V2"}
+    )
+
+    con = sqlite3.connect(temp_db)
+    result = con.execute("SELECT * FROM variant_locations").fetchall()
+    con.close()
+
+    assert result == [("12-40367069-A-G", "12", 40367068, 40367069, 892)]
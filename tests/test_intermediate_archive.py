@@ -0,0 +1,97 @@
+import datetime
+import gzip
+import pytest
+import clinvar_query.modules.intermediate_archive as archive
+from clinvar_query.modules import clinvar_api_query
+from clinvar_query.modules.intermediate_archive import (
+    archive_ingested,
+    enforce_retention,
+    is_archived,
+    retrieve,
+)
+
+"""This tests archiving the validator and clinvar files once ingested
+This looks at:
+Only ingested files being moved, compressed ones included
+Archived files being read back from the bundle through the index
+Bundles past retention being deleted while the files are still known
+process_clinvar not querying a file whose output was archived
+"""
+
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch):
+    folders = {"validator": tmp_path / "validator",
+               "clinvar": tmp_path / "clinvar"}
+    for folder in folders.values():
+        folder.mkdir()
+        (folder / "p1_processed.json").write_text('{"variant":"1-2-A-G"}\n')
+        (folder / "p2_processed.json.gz").write_bytes(
+            gzip.compress(b'{"variant":"1-5-C-T"}\n'))
+        (folder / "p3_processed.json").write_text('{"variant":"2-3-G-T"}\n')
+
+    ingested = {"p1_processed.json", "p2_processed.json"}
+    monkeypatch.setattr(archive, "is_already_ingested",
+                        lambda name, modified: name in ingested)
+    return folders, tmp_path / "archive", tmp_path / "archive.db"
+
+
+def test_archive_ingested(folders):
+    folders, bundles, database = folders
+    day = datetime.date(2026, 10, 1)
+
+    assert archive_ingested(folders, bundles, database, today=day) == 4
+    for folder in folders.values():
+        assert [path.name for path in folder.iterdir()] == \
+            ["p3_processed.json"]
+    assert [path.name for path in bundles.iterdir()] == ["2026-10-01.tar"]
+
+    assert is_archived("clinvar", "p1_processed", database)
+    assert not is_archived("clinvar", "p3_processed", database)
+    assert retrieve("validator", "p1_processed", bundles, database) == \
+        '{"variant":"1-2-A-G"}\n'
+    assert retrieve("clinvar", "p2_processed", bundles, database) == \
+        '{"variant":"1-5-C-T"}\n'
+
+    # nothing left to archive
+    assert archive_ingested(folders, bundles, database, today=day) == 0
+
+
+def test_is_archived_without_archive(tmp_path):
+    database = tmp_path / "missing.db"
+
+    assert not is_archived("clinvar", "p1_processed", database)
+    assert not database.exists()
+
+
+def test_enforce_retention(folders):
+    folders, bundles, database = folders
+    archive_ingested(folders, bundles, database,
+                     today=datetime.date(2026, 10, 1))
+
+    assert enforce_retention(30, bundles, database,
+                             today=datetime.date(2026, 10, 20)) == []
+    assert enforce_retention(30, bundles, database,
+                             today=datetime.date(2026, 11, 15)) == \
+        ["2026-10-01.tar"]
+    assert list(bundles.iterdir()) == []
+
+    assert retrieve("clinvar", "p1_processed", bundles, database) is None
+    assert is_archived("clinvar", "p1_processed", database)
+
+
+def test_archived_output_not_queried(tmp_path, monkeypatch):
+    validator = tmp_path / "validator"
+    validator.mkdir()
+    (validator / "p1_processed.json").write_text(
+        '{"variant":"1-2-A-G","g_hgvs":"NC_000001.11:g.2A>G"}\n')
+    monkeypatch.setattr(clinvar_api_query, "is_archived",
+                        lambda stage, stem: stem == "p1_processed")
+
+    def no_query(*args, **kwargs):
+        raise AssertionError("archived file was queried")
+
+    monkeypatch.setattr(clinvar_api_query, "annotate_entry", no_query)
+    clinvar_api_query.process_clinvar(validator, tmp_path / "clinvar")
+
+    assert list((tmp_path / "clinvar").iterdir()) == []
@@ -0,0 +1,46 @@
+import json
+from clinvar_query.modules.json_records import (
+    read_records,
+    open_records,
+    write_record,
+    finish_records,
+)
+
+"""This tests the JSON Lines intermediate files
+This looks at:
+Records written a line at a time and moved into place when finished
+Older files holding one JSON array still being read
+A line which is not complete yet being skipped
+"""
+
+
+def test_write_and_read_records(tmp_path):
+    path = tmp_path / "patient1.json"
+    records = [{"variant": "1-2-A-G", "g_hgvs": "NC_000001.11:g.2A>G"},
+               {"variant": "1-5-C-T", "error": "Failed to retrieve data (500)"}]
+
+    out = open_records(path)
+    for record in records:
+        write_record(out, record)
+    # nothing has the final name until it is finished
+    assert not path.exists()
+    finish_records(out, path)
+
+    assert len(path.read_text().splitlines()) == 2
+    assert list(read_records(path)) == records
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_read_legacy_array(tmp_path):
+    path = tmp_path / "patient1.json"
+    records = [{"variant": "1-2-A-G"}, {"variant": "1-5-C-T"}]
+    path.write_text(json.dumps(records, indent=4))
+
+    assert list(read_records(path)) == records
+
+
+def test_read_incomplete_line(tmp_path):
+    path = tmp_path / "patient1.json.part"
+    path.write_text('{"variant": "1-2-A-G"}\n\n{"variant": "1-5')
+
+    assert list(read_records(path)) == [{"variant": "1-2-A-G"}]
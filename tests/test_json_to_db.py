@@ -97,11 +97,16 @@ def mock_paths(monkeypatch, tmp_path):
     """
         Patch filesystem paths used by ``json_to_db``.
 
-        This fixture redirects the ClinVar input folder and database path
-        to a temporary directory to prevent interaction with real files.
+        This fixture redirects the ClinVar input folder to a temporary
+        directory to prevent interaction with real files.
         """
     monkeypatch.setattr(json_to_db, "clinvar_folder", tmp_path)
-    monkeypatch.setattr(json_to_db, "database_file", tmp_path / "db.sqlite")
+
+    # Annotation runs are tracked in the database, so these are stubbed too
+    monkeypatch.setattr(json_to_db, "is_already_ingested", lambda *args: False)
+    monkeypatch.setattr(json_to_db, "start_annotation_run", lambda *args: 1)
+    monkeypatch.setattr(json_to_db, "finish_annotation_run", lambda *args: None)
+    monkeypatch.setattr(json_to_db, "previous_associations", lambda *args: set())
     return tmp_path
 
 
@@ -235,8 +240,10 @@ def test_valid_variant_successful_insert(mock_paths, mock_inserts, mock_logger):
     clinvar = mock_inserts["clinvar"][0]
     assert clinvar["gene"] == "BRCA1"
     assert clinvar["chromosome"] == "17"
-    assert clinvar["allele_frequency"] == "0.001"  # Updated to string
-    assert "⭐" in clinvar["star_rating"]
+    assert clinvar["allele_frequency"] == 0.001  # Stored as a number
+    assert clinvar["review_status"] == "criteria provided, single submitter"
+    assert clinvar["stars"] == 1
+    assert clinvar["conditions"] == ["Breast cancer"]
 
     assert any("Inserted variant" in msg for level, msg in mock_logger)
 
@@ -251,7 +258,7 @@ def test_invalid_allele_frequency_logs_warning(mock_paths, mock_inserts, mock_lo
     json_to_db.json_to_dir()
 
     assert any("Invalid allele frequency" in msg for level, msg in mock_logger)
-    assert mock_inserts["clinvar"][0]["allele_frequency"] == "None found"  # Updated to string
+    assert mock_inserts["clinvar"][0]["allele_frequency"] is None
 
 
 def test_database_insertion_failure_is_caught(mock_paths, monkeypatch, mock_logger):
@@ -274,16 +281,94 @@ def test_database_insertion_failure_is_caught(mock_paths, monkeypatch, mock_logg
 
 def test_missing_review_status_defaults_to_zero_stars(mock_paths, mock_inserts):
     """
-        Verify that missing review status values default to an
-        'unknown' star rating.
+        Verify that missing review status values default to zero stars,
+        which is displayed as an 'unknown' star rating.
         """
     variant = make_valid_variant(review_status=None)
     file = mock_paths / "p1_test.json"
     file.write_text(json.dumps([variant]))
     json_to_db.json_to_dir()
 
-    star_rating = mock_inserts["clinvar"][0]["star_rating"]
-    assert star_rating.startswith("Unknown")
+    clinvar = mock_inserts["clinvar"][0]
+    assert clinvar["review_status"] is None
+    assert clinvar["stars"] == 0
+
+
+
+
+
+def test_variants_are_linked_to_one_run(mock_paths, mock_inserts, monkeypatch):
+    """
+        Verify that one run is opened and finished per file, and that
+        every variant inserted from the file carries its run id.
+        """
+    runs = []
+    monkeypatch.setattr(json_to_db, "start_annotation_run",
+                        lambda patient_id, name, modified: runs.append(
+                            (patient_id, name)) or 7)
+    finished = []
+    monkeypatch.setattr(json_to_db, "finish_annotation_run",
+                        lambda run_id, count: finished.append((run_id, count)))
+
+    file = mock_paths / "p123_wes.json"
+    file.write_text(json.dumps([
+        make_valid_variant(variant="v1"),
+        make_valid_variant(variant="v2"),
+    ]))
+    json_to_db.json_to_dir()
+
+    assert runs == [("p123", "p123_wes.json")]
+    assert finished == [(7, 2)]
+    assert [v["run_id"] for v in mock_inserts["variant"]] == [7, 7]
+
+
+def test_already_ingested_file_is_skipped(mock_paths, mock_inserts, monkeypatch):
+    """
+        Verify that files ingested before, and unchanged since,
+        are not read again.
+        """
+    monkeypatch.setattr(json_to_db, "is_already_ingested", lambda *args: True)
+
+    file = mock_paths / "p123_wes.json"
+    file.write_text(json.dumps([make_valid_variant()]))
+    json_to_db.json_to_dir()
+
+    assert mock_inserts["variant"] == []
+
+
+def test_gene_info_passed_to_insert(mock_paths, mock_inserts, mock_logger):
+    """
+        Verify that the HGNC id and symbol from VariantValidator are
+        passed on for the gene index.
+        """
+    variant = make_valid_variant()
+    variant["gene_info"] = {"hgnc_id": "HGNC:1100", "symbol": "BRCA1"}
+    file = mock_paths / "p1_test.json"
+    file.write_text(json.dumps([variant]))
+    json_to_db.json_to_dir()
+
+    clinvar = mock_inserts["clinvar"][0]
+    assert clinvar["hgnc_id"] == "HGNC:1100"
+    assert clinvar["gene_symbols"] == ["BRCA1", "BRCA1"]
 
 
+def test_multi_sample_variant_linked_to_each_sample(mock_paths, mock_inserts,
+                                                    mock_logger):
+    """
+        Verify that a variant from a multi-sample file is linked to every
+        sample carrying it, with the ClinVar record inserted once.
+        """
+    first = make_valid_variant(variant="12-1-A-G")
+    first["samples"] = ["patient1", "patient3"]
+    second = make_valid_variant(variant="12-2-C-T")
+    second["samples"] = ["patient3"]
+    file = mock_paths / "cohort_processed.json"
+    file.write_text(json.dumps([first, second]))
+    json_to_db.json_to_dir()
 
+    assert mock_inserts["patient"] == [{"patient_id": "patient1"},
+                                       {"patient_id": "patient3"}]
+    assert [v["patient_variant"] for v in mock_inserts["variant"]] == [
+        "patient1 _ (12-1-A-G)", "patient3 _ (12-1-A-G)",
+        "patient3 _ (12-2-C-T)"]
+    assert len(mock_inserts["clinvar"]) == 2
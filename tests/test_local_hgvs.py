@@ -0,0 +1,62 @@
+from clinvar_query.modules.local_hgvs import ReferenceFasta, local_g_hgvs
+import pytest
+
+"""This tests building g.HGVS locally from a small made up reference FASTA
+The FASTA has 10 bases per line so fetches cross line ends
+This looks at:
+The .fai index being made when it is missing
+Substitutions, deletions, insertions and duplications
+Deletions and insertions in repeats being moved 3'
+Variants which are left for VariantValidator
+"""
+
+# 1-based positions 11-16 are CAAAAG and 29-36 are TACGATCG
+chr1 = "GATTACAGATCAAAAGTTCCTTTTTACGTACGATCGATCG"
+
+
+@pytest.fixture
+def reference(tmp_path):
+    fasta = tmp_path / "grch38_test.fa"
+    lines = [chr1[i:i + 10] for i in range(0, len(chr1), 10)]
+    fasta.write_text(">chr1 test\n" + "\n".join(lines) + "\n"
+                     + ">chrUn_test\nACGT\n")
+    reference = ReferenceFasta(str(fasta))
+    yield reference
+    reference.close()
+
+
+def test_index_and_fetch(reference, tmp_path):
+    fai = (tmp_path / "grch38_test.fa.fai").read_text().split("\n")
+
+    assert fai[0] == "chr1\t40\t11\t10\t11"
+    assert reference.fetch("1", 8, 13) == "ATCAA"
+    assert reference.fetch("1", 38, 45) == "CG"
+
+
+def test_substitution(reference):
+    assert local_g_hgvs(reference, "1-2-A-G") == "NC_000001.11:g.2A>G"
+    assert local_g_hgvs(reference, "chr1-2-AT-GC") == \
+        "NC_000001.11:g.2_3delinsGC"
+
+
+def test_deletion(reference):
+    assert local_g_hgvs(reference, "1-10-TC-T") == "NC_000001.11:g.11del"
+    # deletions in the AAAA repeat move to its 3' end
+    assert local_g_hgvs(reference, "1-11-CA-C") == "NC_000001.11:g.15del"
+    assert local_g_hgvs(reference, "1-11-CAA-C") == \
+        "NC_000001.11:g.14_15del"
+
+
+def test_insertion(reference):
+    assert local_g_hgvs(reference, "1-16-G-GCC") == \
+        "NC_000001.11:g.16_17insCC"
+    assert local_g_hgvs(reference, "1-11-C-CA") == "NC_000001.11:g.15dup"
+    assert local_g_hgvs(reference, "1-32-G-GAT") == \
+        "NC_000001.11:g.33_34dup"
+
+
+def test_left_for_variant_validator(reference):
+    # REF does not match, chromosome not in the FASTA, not a variant id
+    assert local_g_hgvs(reference, "1-2-C-G") is None
+    assert local_g_hgvs(reference, "2-2-A-G") is None
+    assert local_g_hgvs(reference, "NM_198578.4:c.2830G>T") is None
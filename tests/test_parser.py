@@ -1,4 +1,5 @@
 from clinvar_query.modules.parser import parser
+from clinvar_query.modules.gene_panel import load_panel
 from clinvar_query.utils.logger import logger
 from pathlib import Path
 import pytest
@@ -96,3 +97,54 @@ def test_vcf_parser_process_files_fail_misalign():
     with pytest.raises(AssertionError):
         assert (process_result, misaligned_result) == (None, expected_misaligned_file)    
 
+
+
+def test_csv_parser_panel():
+    panel = load_panel("park_panel.bed", "tests/test_files/test_panels")
+    summary = {}
+    expected = "17-45983420-G-T\n6-162727667-A-G\n6-162262619-G-T\n12-40367069-A-G\n17-45991554-C-T", ""
+    result = parser(csv_file_1, panel=panel, summary=summary)
+
+    assert expected == result
+    assert summary == {"total": 10, "filtered": 0, "kept": 5}
+
+
+def test_vcf_parser_filters():
+    filters = {"pass_only": True, "min_qual": 20, "min_depth": 10,
+               "min_genotype_quality": None, "non_reference": True}
+    summary = {}
+    expected = "12-40367069-A-G", ""
+    result = parser("tests/test_files/test_filters.vcf", filters=filters,
+                    summary=summary)
+
+    assert expected == result
+    assert summary == {"total": 6, "filtered": 5, "kept": 1}
+
+
+def test_vcf_parser_default_filters():
+    # by default only FILTER and the genotype are checked
+    expected = "12-40367069-A-G\n6-162727667-A-G\n19-41985036-A-C", ""
+    result = parser("tests/test_files/test_filters.vcf")
+
+    assert expected == result
+
+
+def test_vcf_parser_multi_sample():
+    # each variant is written once with the samples carrying it,
+    # patient2 is hom-ref for the first row and carries the repeated row
+    summary = {}
+    expected = "12-40367069-A-G\tpatient1,patient3,patient2\n6-162727667-A-G\tpatient2", ""
+    result = parser("tests/test_files/test_samples.vcf", summary=summary)
+
+    assert expected == result
+    assert summary == {"total": 5, "filtered": 2, "kept": 2, "samples": 3}
+
+
+def test_csv_parser_invalid_variants():
+    # rows VariantValidator would reject are sent to misaligned
+    process_result, misaligned_result = parser("tests/test_files/test_invalid.csv")
+    misaligned_rows = misaligned_result.split("\n")
+
+    assert process_result == "12-40367069-A-G\n17-45983420-G-T\nM-3243-A-G"
+    assert len(misaligned_rows) == 6
+    assert misaligned_rows[1] == "invalid variant row ['1', '300000000', '.', 'A', 'G']: position 300000000 is past the end of chromosome 1 (248956422)"
@@ -1,5 +1,5 @@
 from .test_db.lookup_results import lookup_list
-from clinvar_query.modules.patient_lookup import lookup
+from clinvar_query.modules.patient_lookup import lookup, latest_results_page, file_page
 import pytest
 
 """This tests the patient lookup module
@@ -14,15 +14,31 @@ Normal files
 Error files 
 Empty files
 
+For the paged lookups used by the results page, this looks for:
+Pages following on from the cursor without gaps or repeats
+The cursor running out on the last page
+
 """
 
 database_file = "tests/test_db/test.db"
 processed_folder = "tests/test_files/test_processed"
 error_folder = "tests/test_files/test_error"
-empty_folder = "tests/test_files/empty_folder"
 
 
-def test_lookup_latest_results():
+@pytest.fixture
+def manifest(tmp_path):
+    # keeps the file manifest out of the app database
+    return tmp_path / "manifest.db"
+
+
+@pytest.fixture
+def empty_folder(tmp_path):
+    folder = tmp_path / "empty_folder"
+    folder.mkdir()
+    return folder
+
+
+def test_lookup_latest_results(manifest):
     database = database_file
     latest_results = []
     files = []
@@ -34,7 +50,8 @@ def test_lookup_latest_results():
         misaligned,
         database,
         process_folder=processed_folder,
-        err_folder=error_folder
+        err_folder=error_folder,
+        manifest_database=manifest
     )
 
     # Extract variants from latest_results (column 1)
@@ -46,7 +63,7 @@ def test_lookup_latest_results():
     assert result_variants == expected_variants
 
 
-def test_lookup_no_database():
+def test_lookup_no_database(manifest):
     with pytest.raises(UnboundLocalError):
         database = database  # intentionally undefined
         latest_results = []
@@ -63,7 +80,7 @@ def test_lookup_no_database():
         )
 
 
-def test_lookup_files():
+def test_lookup_files(manifest):
     database = database_file
     latest_results = []
     files = []
@@ -75,7 +92,8 @@ def test_lookup_files():
         misaligned,
         database,
         process_folder=processed_folder,
-        err_folder=error_folder
+        err_folder=error_folder,
+        manifest_database=manifest
     )
 
     expected_files = [
@@ -87,7 +105,7 @@ def test_lookup_files():
     assert sorted(files) == sorted(expected_files)
 
 
-def test_empty_files():
+def test_empty_files(manifest, empty_folder):
     database = database_file
     latest_results = []
     files = []
@@ -99,13 +117,14 @@ def test_empty_files():
         misaligned,
         database,
         process_folder=empty_folder,
-        err_folder=error_folder
+        err_folder=error_folder,
+        manifest_database=manifest
     )
 
     assert files == []
 
 
-def test_error_files():
+def test_error_files(manifest):
     database = database_file
     latest_results = []
     files = []
@@ -117,7 +136,8 @@ def test_error_files():
         misaligned,
         database,
         process_folder=processed_folder,
-        err_folder=error_folder
+        err_folder=error_folder,
+        manifest_database=manifest
     )
 
     expected_error_files = [
@@ -128,7 +148,7 @@ def test_error_files():
     assert sorted(misaligned) == sorted(expected_error_files)
 
 
-def test_empty_error_files():
+def test_empty_error_files(manifest, empty_folder):
     database = database_file
     latest_results = []
     files = []
@@ -140,7 +160,52 @@ def test_empty_error_files():
         misaligned,
         database,
         process_folder=processed_folder,
-        err_folder=empty_folder
+        err_folder=empty_folder,
+        manifest_database=manifest
     )
 
     assert misaligned == []
+
+
+def test_latest_results_page():
+    first, cursor = latest_results_page(database_file, limit=3)
+    second, last_cursor = latest_results_page(database_file, after=cursor,
+                                              limit=3)
+
+    result_variants = [row["variant_id"] for row in first + second]
+    expected_variants = sorted({row[0] for row in lookup_list})
+
+    assert len(first) == 3
+    assert cursor == first[-1]["patient_variant"]
+    assert sorted(result_variants) == expected_variants
+    assert last_cursor is None
+
+
+def test_file_page(manifest):
+    first, cursor = file_page(processed_folder, limit=2, database=manifest)
+    second, last_cursor = file_page(processed_folder, after=cursor, limit=2,
+                                    database=manifest)
+
+    expected_files = [
+        "test_data_processed.txt",
+        "test5_processed.txt",
+        "test1_processed.txt",
+    ]
+
+    assert len(first) == 2
+    assert sorted(first + second) == sorted(expected_files)
+    assert last_cursor is None
+
+
+def test_empty_file_page(manifest, empty_folder):
+    files, cursor = file_page(empty_folder, database=manifest)
+
+    assert files == []
+    assert cursor is None
+
+
+def test_latest_results_filtered():
+    rows, _ = latest_results_page(database_file, filters={"min_stars": 1})
+
+    assert sorted(row["variant_id"] for row in rows) == [
+        "12-40367069-A-G", "17-45991554-C-T", "4-89835580-C-G"]
@@ -1,7 +1,24 @@
+import functools
+import hashlib
+import io
+from flask import Flask
+import clinvar_query.modules.check_file_status as check_file_status
+import clinvar_query.modules.process_uploads as process_uploads
+from clinvar_query.modules.check_file_status import app_file_check
 from clinvar_query.modules.process_uploads import process_upload_file
+from clinvar_query.modules.upload_index import (
+    find_upload,
+    record_upload,
+    stream_upload,
+    text_lines,
+)
+from clinvar_query.modules.parser import parser
+from clinvar_query.ClinVar_Site.routes.upload import process_bp
 from clinvar_query.ClinVar_Site import create_app
 import pytest
 from werkzeug.datastructures import FileStorage
+from clinvar_query.modules.gene_panel import load_panel
+from clinvar_query.utils.settings import vcf_filters
 
 #made with some help from chatGPT
 
@@ -15,17 +32,47 @@ processed, error
 Overwrite state:
 created, skipped
 It also tests for invalid files
+and the gene panel counts added for the job summary
+and uploads of a title with the same content using the results already made,
+the same content under another title or with other VCF filters being processed
+and uploads being saved and parsed in one pass as they arrive,
+with any line endings and rows which are not UTF-8 sent to the misaligned file
+and the gene panel summary only being shown when its counts can be read
 """
 
 folder = "tests/test_files/test_output"
 p1 = "tests/test_files/test1.csv"
 overwrite = False
 p5 = "tests/test_files/test5.csv"
+vcf = "tests/test_files/test5.vcf"
 process_folder = "tests/test_files/test_processed"
 err_folder = "tests/test_files/test_error"
 p1text = "tests/test_files/test_processed/test1_processed.txt"
 
 
+@pytest.fixture(autouse=True)
+def upload_index(tmp_path, monkeypatch):
+    # keeps the upload index and file manifest out of the app database
+    database = tmp_path / "uploads.db"
+    monkeypatch.setattr(process_uploads, "find_upload",
+                        functools.partial(find_upload, database=database))
+    monkeypatch.setattr(process_uploads, "record_upload",
+                        functools.partial(record_upload, database=database))
+    monkeypatch.setattr(process_uploads, "app_file_check",
+                        functools.partial(app_file_check, database=database))
+    return database
+
+
+def upload(path, filename, o_folder, p_folder, e_folder, overwrite=False,
+           panel=None):
+    with open(path, "rb") as f:
+        storedfile = FileStorage(stream=f, filename=filename)
+        return process_upload_file(storedfile, folder=o_folder,
+                                   processed_folder=p_folder,
+                                   error_folder=e_folder,
+                                   overwrite=overwrite, panel=panel)
+
+
 def test_process_upload(tmp_path):
     p_folder = tmp_path/"p_folder"
     e_folder = tmp_path/"e_folder"
@@ -136,3 +183,218 @@ def test_invalid_file():
                                 error_folder=err_folder,
                                 overwrite=overwrite)
 
+
+
+def test_process_upload_panel(tmp_path):
+    p_folder = tmp_path/"p_folder"
+    e_folder = tmp_path/"e_folder"
+    o_folder = tmp_path/"o_folder"
+
+    p_folder.mkdir(parents=True, exist_ok=True)
+    e_folder.mkdir(parents=True, exist_ok=True)
+    o_folder.mkdir(parents=True, exist_ok=True)
+
+    panel = load_panel("park_panel.bed", "tests/test_files/test_panels")
+    with open(p1, "rb") as f:
+        storedfile = FileStorage(stream=f, filename="test1.csv")
+        expected = {'redirect_endpoint': 'process.upload_success',
+                    'message_params':
+                    {'message': 'upload_success', 'file': 'test1.csv',
+                     'panel': 'park_panel.bed', 'total': 10, 'kept': 5}}
+        result = process_upload_file(storedfile, folder=o_folder,
+                                     processed_folder=p_folder,
+                                     error_folder=e_folder,
+                                     overwrite=overwrite,
+                                     panel=panel)
+
+        assert expected == result
+
+
+def test_duplicate_upload(tmp_path, monkeypatch):
+    folders = [tmp_path/"o_folder", tmp_path/"p_folder", tmp_path/"e_folder"]
+    for f in folders:
+        f.mkdir()
+
+    upload(p1, "test1.csv", *folders)
+    processed = folders[1]/"test1_processed.txt"
+    modified = processed.stat().st_mtime_ns
+
+    def no_parse(*args, **kwargs):
+        raise AssertionError("the same content was parsed again")
+
+    monkeypatch.setattr(process_uploads, "app_file_check", no_parse)
+
+    result = upload(p1, "test1.csv", *folders, overwrite=True)
+    assert result == {'redirect_endpoint': 'process.upload_success',
+                      'message_params':
+                      {'message': 'unchanged_upload', 'file': 'test1.csv',
+                       'existing': 'test1'}}
+    assert processed.stat().st_mtime_ns == modified
+
+
+
+def test_same_content_other_title(tmp_path):
+    folders = [tmp_path/"o_folder", tmp_path/"p_folder", tmp_path/"e_folder"]
+    for f in folders:
+        f.mkdir()
+    upload(p1, "test1.csv", *folders)
+
+    # each title is its own patient, so it gets its own outputs
+    result = upload(p1, "again.csv", *folders)
+    assert result["message_params"] == {'message': 'upload_success',
+                                        'file': 'again.csv'}
+    assert sorted(f.name for f in folders[0].iterdir()) == \
+        ["again.csv", "test1.csv"]
+    assert (folders[1]/"again_processed.txt").read_text() == \
+        (folders[1]/"test1_processed.txt").read_text()
+
+
+def test_duplicate_upload_reprocessed(tmp_path):
+    folders = [tmp_path/"o_folder", tmp_path/"p_folder", tmp_path/"e_folder"]
+    for f in folders:
+        f.mkdir()
+    upload(p1, "test1.csv", *folders)
+
+    # a different panel, new content under the title,
+    # or a removed output all mean the file is processed again
+    panel = load_panel("park_panel.bed", "tests/test_files/test_panels")
+    result = upload(p1, "test1.csv", *folders, overwrite=True, panel=panel)
+    assert result["message_params"]["message"] == "overwritten_success"
+    result = upload(p1, "test1.csv", *folders, overwrite=True, panel=panel)
+    assert result["message_params"]["message"] == "unchanged_upload"
+    assert result["message_params"]["kept"] == 5
+
+    upload(p5, "test1.csv", *folders, overwrite=True)
+    result = upload(p1, "test1.csv", *folders, overwrite=True, panel=panel)
+    assert result["message_params"]["message"] == "overwritten_success"
+
+    (folders[1]/"test1_processed.txt").unlink()
+    result = upload(p1, "test1.csv", *folders, overwrite=True, panel=panel)
+    assert result["message_params"]["message"] == "upload_success"
+
+
+def test_filters_changed_reprocessed(tmp_path, monkeypatch):
+    folders = [tmp_path/"o_folder", tmp_path/"p_folder", tmp_path/"e_folder"]
+    for f in folders:
+        f.mkdir()
+    upload(vcf, "test5.vcf", *folders)
+    result = upload(vcf, "test5.vcf", *folders, overwrite=True)
+    assert result["message_params"]["message"] == "unchanged_upload"
+
+    monkeypatch.setitem(vcf_filters, "pass_only", False)
+    result = upload(vcf, "test5.vcf", *folders, overwrite=True)
+    assert result["message_params"]["message"] in ("overwritten_success",
+                                                   "misaligned_overwritten")
+
+
+def test_stream_upload_lines(tmp_path):
+    content = open(p1, "rb").read()
+    digest = hashlib.sha256()
+    upload_path = tmp_path/"test1.csv"
+    storedfile = FileStorage(stream=io.BytesIO(content), filename="test1.csv")
+
+    # small chunks so lines are split between them
+    lines = list(stream_upload(storedfile, upload_path, digest, chunk_size=7))
+
+    assert "".join(lines).encode() == content
+    assert all(line.endswith("\n") for line in lines[:-1])
+    assert (tmp_path/"test1.csv.part").read_bytes() == content
+    assert digest.hexdigest() == hashlib.sha256(content).hexdigest()
+
+
+def test_stream_upload_line_endings(tmp_path):
+    # old Mac files end their lines with \r alone, \r\n may be split
+    # between chunks
+    assert list(text_lines([b"a,b\r", b"\nc,d\r", b"e,f"])) == [
+        "a,b\r\n", "c,d\r", "e,f"]
+
+    folders = [tmp_path/"o_folder", tmp_path/"p_folder", tmp_path/"e_folder"]
+    for f in folders:
+        f.mkdir()
+    content = open(p1, "rb").read().replace(b"\r\n", b"\r")
+    storedfile = FileStorage(stream=io.BytesIO(content), filename="mac.csv")
+    result = process_upload_file(storedfile, folder=folders[0],
+                                 processed_folder=folders[1],
+                                 error_folder=folders[2])
+
+    assert result["message_params"]["message"] == "upload_success"
+    assert (folders[1]/"mac_processed.txt").read_text() == parser(p1)[0]
+
+
+def test_undecodable_rows_misaligned(tmp_path):
+    folders = [tmp_path/"o_folder", tmp_path/"p_folder", tmp_path/"e_folder"]
+    for f in folders:
+        f.mkdir()
+    content = open(p1, "rb").read() + b"\r\n1,7984929,.,G,\xff\r\n"
+    undecodable = []
+    assert len(list(text_lines([content], undecodable))) == 11
+    assert undecodable == [b"1,7984929,.,G,\xff\r\n"]
+
+    storedfile = FileStorage(stream=io.BytesIO(content), filename="bad.csv")
+    result = process_upload_file(storedfile, folder=folders[0],
+                                 processed_folder=folders[1],
+                                 error_folder=folders[2])
+
+    assert result["message_params"]["message"] == "misaligned_created"
+    assert (folders[1]/"bad_processed.txt").read_text() == parser(p1)[0]
+    misaligned = next(folders[2].iterdir()).read_text()
+    assert misaligned == "undecodable row b'1,7984929,.,G,\\xff\\r\\n'"
+
+
+def test_streamed_upload_route(tmp_path, monkeypatch):
+    folders = [tmp_path/"o_folder", tmp_path/"p_folder", tmp_path/"e_folder"]
+    for f in folders:
+        f.mkdir()
+    app = Flask(__name__)
+    app.register_blueprint(process_bp, url_prefix="/upload")
+    app.config.update(upload_folder=folders[0], processed_folder=folders[1],
+                      error_folder=folders[2], panel_folder=tmp_path)
+    expected = parser(p1)[0]
+
+    def no_read(*args, **kwargs):
+        raise AssertionError("the saved upload was read again")
+
+    monkeypatch.setattr(check_file_status, "parser", no_read)
+
+    response = app.test_client().post(
+        "/upload/stream", query_string={"filename": "test1.csv"},
+        data=open(p1, "rb").read())
+
+    assert response.status_code == 302
+    assert "key=upload_success" in response.headers["Location"]
+    assert (folders[1]/"test1_processed.txt").read_text() == expected
+    assert (folders[0]/"test1.csv").read_bytes() == open(p1, "rb").read()
+
+    response = app.test_client().post(
+        "/upload/stream", query_string={"filename": "test1.txt"}, data=b"")
+    assert "key=unsupported_file" in response.headers["Location"]
+
+
+def test_upload_success_panel_counts(monkeypatch):
+    import clinvar_query.ClinVar_Site.routes.upload as upload_routes
+    from clinvar_query.ClinVar_Site.routes.main_routes import main_bp
+    from clinvar_query.ClinVar_Site.routes.search_site import search_bp
+    from clinvar_query.ClinVar_Site.routes.results import lookup_bp
+
+    monkeypatch.setattr(upload_routes, "run_pipeline", lambda: None)
+    app = Flask("clinvar_query.ClinVar_Site")
+    app.register_blueprint(main_bp, url_prefix="/")
+    app.register_blueprint(process_bp, url_prefix="/upload")
+    app.register_blueprint(search_bp, url_prefix="/search_site")
+    app.register_blueprint(lookup_bp, url_prefix="/result_site")
+    client = app.test_client()
+    params = {"key": "upload_success", "file": "test1.csv",
+              "panel": "park_panel.bed"}
+
+    response = client.get("/upload/upload_success",
+                          query_string={**params, "total": "5", "kept": "3"})
+    assert response.status_code == 200
+    assert b"2 outside it were left out" in response.data
+
+    # counts edited by hand or missing leave the summary out
+    for counts in [{"total": "5", "kept": "many"}, {"total": "5"},
+                   {"total": "3", "kept": "5"}]:
+        response = client.get("/upload/upload_success",
+                              query_string={**params, **counts})
+        assert response.status_code == 200
+        assert b"Gene panel" not in response.data
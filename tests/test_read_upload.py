@@ -1,7 +1,8 @@
 import os
 from flask import request, Flask
 from clinvar_query.utils.logger import logger
-from clinvar_query.modules.read_uploads import read_file
+from clinvar_query.modules.read_uploads import stream_file
+import gzip
 import pytest
 
 #made with some help from chatGPT
@@ -15,50 +16,91 @@ processed_folder = "tests/test_files/test_processed"
 error_folder = "tests/test_files/test_error"
 
 
-def test_read_file():
+def test_read_file_test_exists():
     folder = processed_folder
-    app = Flask(__name__)
+    filename = "test1_processed.txt"
+    assert os.path.exists(os.path.join(folder, filename))
 
 
-    with app.test_request_context(query_string={"fileprocess": "test1_processed.txt"}):
-        result = read_file(folder, "fileprocess")
-    expected = '17-45983420-G-T\n1-7984929-G-A\n6-162727667-A-G\n6-162262619-G-T\n12-40367069-A-G\n17-45991554-C-T\n4-89835580-C-G\n19-41985036-A-C\n19-41970289-G-A\n1-7984981-T-C'
+  
+def test_read_file_test_no_exists():
+    folder = processed_folder
+    filename = "test2_processed.txt"
+    result = os.path.exists(os.path.join(folder, filename))
+    expected = False
 
     assert result == expected
 
-def test_read_no_file():
-    folder = processed_folder
-    app = Flask(__name__)
 
-    with app.test_request_context(query_string={"fileprocess": "test2_processed.txt"}):
-        result = read_file(folder, "fileprocess")
-    expected = "File not found, please refresh and try again."
+"""The streamed view of a file is tested through a test client,
+so that the Range and Accept-Encoding headers are handled as in the site"""
 
-    assert result == expected
 
-def test_read_misaligned_file():
-    folder = error_folder
+@pytest.fixture
+def client():
     app = Flask(__name__)
+    app.add_url_rule("/view_file", "view_file",
+                     lambda: stream_file(processed_folder, "fileprocess"))
+    return app.test_client()
 
-    with app.test_request_context(query_string={"filemisalign": "misaligned_output.txt"}):
-        result = read_file(folder, "filemisalign")
-    expected = "incomplete or misaligned row ['12', '40310486', 'C']"
 
-    assert result == expected
+def test_stream_line_window(client):
+    response = client.get("/view_file", query_string={
+        "fileprocess": "test1_processed.txt", "offset": 2, "limit": 3})
 
+    assert response.get_data(as_text=True) == '6-162727667-A-G\n6-162262619-G-T\n12-40367069-A-G\n'
+    assert response.headers["X-Next-Offset"] == "5"
 
 
-def test_read_file_test_exists():
-    folder = processed_folder
-    filename = "test1_processed.txt"
-    assert os.path.exists(os.path.join(folder, filename))
+def test_stream_last_line_window(client):
+    response = client.get("/view_file", query_string={
+        "fileprocess": "test1_processed.txt", "offset": 8, "limit": 5})
 
+    assert response.get_data(as_text=True) == '19-41970289-G-A\n1-7984981-T-C'
+    assert "X-Next-Offset" not in response.headers
 
-  
-def test_read_file_test_no_exists():
-    folder = processed_folder
-    filename = "test2_processed.txt"
-    result = os.path.exists(os.path.join(folder, filename))
-    expected = False
 
-    assert result == expected
\ No newline at end of file
+def test_stream_gzip(client):
+    response = client.get("/view_file",
+                          query_string={"fileprocess": "test1_processed.txt"},
+                          headers={"Accept-Encoding": "gzip"})
+
+    with open(os.path.join(processed_folder, "test1_processed.txt"), "rb") as f:
+        expected = f.read()
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.get_data()) == expected
+
+
+def test_stream_range(client):
+    response = client.get("/view_file",
+                          query_string={"fileprocess": "test1_processed.txt"},
+                          headers={"Range": "bytes=0-14"})
+
+    assert response.status_code == 206
+    assert response.get_data(as_text=True) == "17-45983420-G-T"
+
+
+def test_stream_no_file(client):
+    response = client.get("/view_file",
+                          query_string={"fileprocess": "test2_processed.txt"})
+
+    assert response.status_code == 404
+
+
+def test_stream_misaligned_file():
+    app = Flask(__name__)
+    app.add_url_rule("/view_file", "view_file",
+                     lambda: stream_file(error_folder, "filemisalign"))
+    response = app.test_client().get(
+        "/view_file", query_string={"filemisalign": "misaligned_output.txt"})
+
+    assert response.get_data(as_text=True) == \
+        "incomplete or misaligned row ['12', '40310486', 'C']"
+
+
+def test_stream_outside_folder(client):
+    response = client.get("/view_file",
+                          query_string={"fileprocess": "../test1.csv"})
+
+    assert response.status_code == 404
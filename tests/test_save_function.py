@@ -8,6 +8,7 @@ import pytest
 This tests the save function
 This looks at each outcome of file processing
 Once that has been evaluated, it saves the file in a specified location
+The file manifest is kept in a database in tmp_path
 """
 processed_folder = "tests/test_files/test_processed"
 data = "tests/test_files/test1.csv"
@@ -22,19 +23,21 @@ def test_save_function(tmp_path):
     output_path, status = save_output_to_file(processed_data,
                                               title,
                                               folder=tmp_path/"test_processed",
-                                              overwrite=overwrite)
+                                              overwrite=overwrite,
+                                              database=tmp_path/"manifest.db")
     logger.info(f"testing for save functionality")
     assert output_path == str(tmp_path/"test_processed/test_data_processed.txt")
     assert status == "created"
     assert os.path.isfile(output_path)
 
 
-def test_save_function_skip():
+def test_save_function_skip(tmp_path):
     processed_data, misaligned_data = parser(data)
     saved_file, status = save_output_to_file(processed_data,
                                             title,
                                             folder="tests/test_files/test_processed",
-                                            overwrite=overwrite)
+                                            overwrite=overwrite,
+                                            database=tmp_path/"manifest.db")
     logger.info(f"testing for skipping if a file exists and overwrite is false")
     assert saved_file == None
     assert status == "skipped"
@@ -45,19 +48,39 @@ def test_save_function_Error(tmp_path):
     saved_file, status = save_output_to_file(processed_data,
                                             title,
                                             folder=tmp_path/"test_processed",
-                                            overwrite=overwrite)
+                                            overwrite=overwrite,
+                                            database=tmp_path/"manifest.db")
     logger.info(f"testing for error, when processed data is empty")
     assert saved_file == None
     assert status == "error"
 
 
-def test_save_function_overwrite():
+def test_save_function_overwrite(tmp_path):
     overwrite = True
     processed_data, misaligned_data = parser(data)
     output_path, status = save_output_to_file(processed_data,
                                               title,
                                               folder="tests/test_files/test_processed",
-                                              overwrite=overwrite)
+                                              overwrite=overwrite,
+                                              database=tmp_path/"manifest.db")
     logger.info(f"testing for skipping if a file exists and overwrite is false")
     assert output_path == "tests/test_files/test_processed/test_data_processed.txt"
     assert status == "overwritten"
+
+
+def test_save_function_compressed(tmp_path):
+    # a processed file compressed after it was annotated still exists
+    folder = tmp_path / "test_processed"
+    folder.mkdir()
+    (folder / "test_data_processed.txt.gz").write_bytes(b"\x1f\x8b")
+
+    saved_file, status = save_output_to_file("1-2-A-G", title, folder=folder,
+                                           database=tmp_path/"manifest.db")
+    assert saved_file is None
+    assert status == "skipped"
+
+    output_path, status = save_output_to_file("1-2-A-G", title, folder=folder,
+                                              overwrite=True,
+                                              database=tmp_path/"manifest.db")
+    assert status == "overwritten"
+    assert os.listdir(folder) == ["test_data_processed.txt"]
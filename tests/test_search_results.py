@@ -1,6 +1,24 @@
-from clinvar_query.modules.search_results import search_results
+import sqlite3
+import pytest
+from clinvar_query.modules.setup_results import create_database
+from clinvar_query.modules.insert_annotated_results import (
+    location_row,
+    location_sql,
+)
+from clinvar_query.modules.genomic_regions import parse_region
+from clinvar_query.modules.search_results import (
+    search_results,
+    filter_variants,
+    search_conditions,
+    search_gene,
+    search_region,
+)
 
-"""this tests the search function"""
+"""this tests the search function
+including the classification, star and condition text on clinvar
+only the patient information, variants and clinvar tables being searched
+the allele frequency, star and classification filters
+the condition, gene and region searches"""
 
 database_file = "tests/test_db/test.db"
 
@@ -24,3 +42,195 @@ def test_search_fail():
     expected_results = {}
 
     assert results == expected_results
+
+
+def test_search_lookup_text():
+    # the classification and conditions are stored by id on clinvar
+    results = search_results(database_file, "Pathogenic", {})
+    rows = [dict(row) for row in results["clinvar"]["rows"]]
+    assert [row["variant_id"] for row in rows] == ["19-41985036-A-C",
+                                                   "1-7984981-T-C"]
+    assert rows[0]["star_rating"] == "no assertion criteria provided (☆☆☆☆)"
+
+    results = search_results(database_file, "frontotemporal dementia", {})
+    assert {row["variant_id"] for row in results["clinvar"]["rows"]} == {
+        "17-45983420-G-T", "17-45991554-C-T"}
+    assert results["clinvar"]["columns"][3] == "associated_conditions"
+
+
+def test_search_internal_tables():
+    # runs, indexes and locations are not shown on the search page
+    assert set(search_results(database_file, "12", {})) <= {
+        "patient_information", "variants", "clinvar"}
+    assert set(search_results(database_file, "test1", {})) == {
+        "patient_information", "variants"}
+
+
+def test_filter_rare_variants():
+    rows, cursor = filter_variants(database_file, {"af_max": 0.01})
+    variants = [row["variant_id"] for row in rows]
+
+    # variants with no allele frequency are left out
+    assert variants == ["12-40367069-A-G", "6-162727667-A-G"]
+    assert cursor is None
+
+
+def test_filter_classification():
+    rows, _ = filter_variants(database_file, {"classification": "Pathogenic"})
+
+    assert [row["variant_id"] for row in rows] == ["1-7984981-T-C",
+                                                   "19-41985036-A-C"]
+
+
+def test_filter_pages():
+    first, cursor = filter_variants(database_file, {"min_stars": 1}, limit=3)
+    second, last_cursor = filter_variants(database_file, {"min_stars": 1},
+                                          after=cursor, limit=3)
+    variants = [row["variant_id"] for row in first + second]
+
+    assert len(first) == 3
+    assert len(variants) == len(set(variants)) == 5
+    assert last_cursor is None
+
+
+def test_condition_prefix():
+    rows, cursor = search_conditions(database_file, "PARKIN")
+    conditions = {row["condition"] for row in rows}
+
+    assert conditions == {
+        "Autosomal recessive juvenile Parkinson disease 2",
+        "Autosomal dominant Parkinson disease 1",
+        "Autosomal recessive early-onset Parkinson disease 7",
+    }
+    assert {row["patient_id"] for row in rows} == {"test1"}
+    assert cursor is None
+
+
+def test_condition_tokens():
+    rows, _ = search_conditions(database_file, "parkinson 7")
+
+    assert [(row["condition"], row["variant_id"]) for row in rows] == [
+        ("Autosomal recessive early-onset Parkinson disease 7",
+         "1-7984981-T-C")]
+
+
+def test_condition_pages():
+    first, cursor = search_conditions(database_file, "parkinson", limit=2)
+    second, last_cursor = search_conditions(database_file, "parkinson",
+                                            after=cursor, limit=2)
+
+    assert len(first) == len(second) == 2
+    assert first != second
+    assert last_cursor is None
+
+
+def test_condition_no_match():
+    assert search_conditions(database_file, "cardiomyopathy") == ([], None)
+    assert search_conditions(database_file, "  ") == ([], None)
+
+
+@pytest.fixture
+def gene_db(tmp_path):
+    """Two LRRK2 variants, one seen in two patients, and a PARK7 variant"""
+    database = tmp_path / "genes.db"
+    create_database(database)
+    con = sqlite3.connect(database)
+    con.executescript("""
+        INSERT INTO genes VALUES ('HGNC:18618', 'LRRK2'), ('HGNC:16369', 'PARK7');
+        INSERT INTO gene_aliases VALUES ('LRRK2', 'HGNC:18618'),
+            ('PARK8', 'HGNC:18618'), ('PARK7', 'HGNC:16369');
+        INSERT INTO variant_genes VALUES ('HGNC:18618', '12-1-A-G'),
+            ('HGNC:18618', '12-2-C-T'), ('HGNC:16369', '1-3-T-C');
+        INSERT INTO variants (variant_id, patient_id, patient_variant) VALUES
+            ('12-1-A-G', 'p1', 'p1 _ (12-1-A-G)'),
+            ('12-1-A-G', 'p2', 'p2 _ (12-1-A-G)'),
+            ('12-2-C-T', 'p1', 'p1 _ (12-2-C-T)'),
+            ('1-3-T-C', 'p3', 'p3 _ (1-3-T-C)');
+        INSERT INTO clinvar (variant_id, hgvs) VALUES
+            ('12-1-A-G', 'NC_000012.12:g.1A>G');
+    """)
+    con.commit()
+    con.close()
+    return database
+
+
+def test_gene_by_symbol(gene_db):
+    summary, rows, cursor = search_gene(gene_db, "lrrk2")
+
+    assert summary == {"hgnc_id": "HGNC:18618", "symbol": "LRRK2",
+                       "variant_count": 2, "patient_count": 2}
+    assert [(row["variant_id"], row["patient_id"]) for row in rows] == [
+        ("12-1-A-G", "p1"), ("12-1-A-G", "p2"), ("12-2-C-T", "p1")]
+    assert rows[0]["hgvs"] == "NC_000012.12:g.1A>G"
+    assert cursor is None
+
+
+def test_gene_by_id_and_alias(gene_db):
+    by_id, _, _ = search_gene(gene_db, "HGNC:18618")
+    by_alias, _, _ = search_gene(gene_db, "PARK8")
+
+    assert by_id == by_alias
+
+
+def test_gene_pages(gene_db):
+    _, first, cursor = search_gene(gene_db, "LRRK2", limit=2)
+    _, second, last_cursor = search_gene(gene_db, "LRRK2", after=cursor,
+                                         limit=2)
+
+    assert len(first) == 2
+    assert [(row["variant_id"], row["patient_id"]) for row in second] == [
+        ("12-2-C-T", "p1")]
+    assert last_cursor is None
+
+
+def test_gene_not_found(gene_db):
+    assert search_gene(gene_db, "BRCA1") == (None, [], None)
+
+
+def test_region():
+    rows, cursor = search_region(database_file, ("17", 45983419, 45991554))
+
+    assert [row["variant_id"] for row in rows] == ["17-45983420-G-T",
+                                                   "17-45991554-C-T"]
+    assert rows[0]["gene"] == "MAPT"
+    assert cursor is None
+
+
+def test_region_edges():
+    # the region stops just short of both variants
+    assert search_region(database_file, ("17", 45983420, 45991553)) == (
+        [], None)
+    assert search_region(database_file, ("12", 45983419, 45991554)) == (
+        [], None)
+
+
+def test_region_pages():
+    first, cursor = search_region(database_file, ("17", 0, 50000000),
+                                  limit=1)
+    second, last_cursor = search_region(database_file, ("17", 0, 50000000),
+                                        after=cursor, limit=1)
+
+    assert [row["variant_id"] for row in first + second] == [
+        "17-45983420-G-T", "17-45991554-C-T"]
+    assert last_cursor is None
+
+
+def test_region_whole_chromosome():
+    # thousands of bins, read as one range for each bin size
+    rows, _ = search_region(database_file, parse_region("chr17:1-999999999"))
+
+    assert [row["variant_id"] for row in rows] == [
+        "17-45983420-G-T", "17-45991554-C-T"]
+
+
+def test_region_mitochondrial(gene_db):
+    con = sqlite3.connect(gene_db)
+    con.execute(location_sql, location_row("M-73-A-G"))
+    con.execute("INSERT INTO variants (variant_id, patient_id, "
+                "patient_variant) VALUES ('M-73-A-G', 'p1', 'p1 _ (M-73-A-G)')")
+    con.commit()
+    con.close()
+
+    for region in ["chrMT:1-100", "chrM:1-100", "MT:73-73"]:
+        rows, _ = search_region(gene_db, parse_region(region))
+        assert [row["variant_id"] for row in rows] == ["M-73-A-G"]
@@ -33,3 +33,92 @@ def test_create_database_tables(test_db):
     }
 
     assert expected_tables.issubset(tables), f"Missing tables: {expected_tables - tables}"
+
+
+def test_failed_migration_rolled_back(test_db, monkeypatch):
+    """
+    A migration which fails part way leaves nothing behind,
+    so it can be run again once it is fixed
+    """
+    from clinvar_query.modules import setup_results
+
+    con = sqlite3.connect(test_db)
+    version = con.execute("PRAGMA user_version").fetchone()[0]
+    con.close()
+
+    def broken(con):
+        setup_results.run_script(con, """
+        ALTER TABLE variants ADD COLUMN note TEXT;
+        UPDATE missing_table SET note = 1;
+        """)
+
+    monkeypatch.setattr(setup_results, "MIGRATIONS",
+                        setup_results.MIGRATIONS + [broken])
+    with pytest.raises(RuntimeError):
+        setup_results.upgrade_database(test_db)
+
+    con = sqlite3.connect(test_db)
+    columns = [row[1] for row in con.execute("PRAGMA table_info(variants)")]
+    assert "note" not in columns
+    assert con.execute("PRAGMA user_version").fetchone()[0] == version
+    con.close()
+
+    monkeypatch.setattr(setup_results, "MIGRATIONS",
+                        setup_results.MIGRATIONS[:-1] +
+                        ["ALTER TABLE variants ADD COLUMN note TEXT;"])
+    setup_results.upgrade_database(test_db)
+
+    con = sqlite3.connect(test_db)
+    columns = [row[1] for row in con.execute("PRAGMA table_info(variants)")]
+    assert "note" in columns
+    assert con.execute("PRAGMA user_version").fetchone()[0] == version + 1
+    con.close()
+
+
+def test_clinvar_text_columns_dropped(tmp_path, monkeypatch):
+    """
+    The emptied clinvar text columns are dropped by rebuilding the
+    table, the rows and indexes are kept and the database is vacuumed
+    """
+    from clinvar_query.modules import setup_results
+
+    db_path = str(tmp_path / "old.db")
+    monkeypatch.setattr(setup_results, "MIGRATIONS",
+                        setup_results.MIGRATIONS[:-1])
+    setup_results.upgrade_database(db_path)
+
+    con = sqlite3.connect(db_path)
+    con.execute("""
+        INSERT INTO clinvar (variant_id, hgvs, gene, allele_frequency,
+                             chromosome, stars)
+        VALUES ('17-43045711-G-A', 'NM_007294.4:c.5123C>A', 'BRCA1',
+                0.01, '17', 2)
+    """)
+    con.executemany("INSERT INTO variants (variant_id, patient_id,"
+                    " patient_variant) VALUES (?, 'p1', ?)",
+                    [("1-1-A-T", f"p1_{n}") for n in range(2000)])
+    con.execute("DELETE FROM variants")
+    con.commit()
+    con.close()
+
+    monkeypatch.undo()
+    setup_results.upgrade_database(db_path)
+
+    con = sqlite3.connect(db_path)
+    columns = [row[1] for row in con.execute("PRAGMA table_info(clinvar)")]
+    assert "consensus_classification" not in columns
+    assert "star_rating" not in columns
+    assert "associated_conditions" not in columns
+    assert con.execute("""
+        SELECT hgvs, gene, allele_frequency, chromosome, stars FROM clinvar
+    """).fetchall() == [("NM_007294.4:c.5123C>A", "BRCA1", 0.01, "17", 2)]
+
+    indexes = {row[1] for row in con.execute("PRAGMA index_list(clinvar)")}
+    assert {"idx_clinvar_allele_frequency",
+            "idx_clinvar_stars_variant",
+            "idx_clinvar_classification_variant"} <= indexes
+
+    assert con.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    assert con.execute("PRAGMA user_version").fetchone()[0] == \
+        len(setup_results.MIGRATIONS)
+    con.close()
@@ -0,0 +1,226 @@
+import os
+import pytest
+import clinvar_query.modules.json_to_db as json_to_db
+import clinvar_query.modules.staging_store as staging
+from clinvar_query.modules.staging_store import connect_staging, pending
+
+"""This tests the SQLite staging store used in place of the JSON folders
+This looks at:
+Only variants without a validator result being queried, and unchanged
+files not being read again
+Variants with nothing to search in ClinVar not being passed on
+Pending variants being inserted once, with one run per processed file
+A variant whose insert fails staying pending for the next run
+A changed file getting a new run, with its kept variants moved to it and
+those taken out of it removed
+Stores made before the done flag being brought up to date
+The pending query using the partial index of rows not done
+"""
+
+
+def fake_query(line, reference=None):
+    variant, samples = staging.split_samples(line)
+    entry = {"variant": variant, "g_hgvs": f"NC:g.{variant}"}
+    if variant.startswith("bad"):
+        entry = {"variant": variant, "error": "Failed to retrieve data (400)"}
+    if samples:
+        entry["samples"] = samples
+    return entry
+
+
+def fake_annotate(entry, archive=None):
+    if not entry.get("g_hgvs"):
+        return None
+    result = {
+        "variant": entry["variant"],
+        "g_hgvs": entry["g_hgvs"],
+        "gene_info": None,
+        "clinvar_ids": ["1"],
+        "esummary": {"uids": ["1"], "1": {
+            "germline_classification": {"description": "Benign"}}},
+    }
+    if entry.get("samples"):
+        result["samples"] = entry["samples"]
+    return result
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    processed = tmp_path / "processed"
+    processed.mkdir()
+    calls = {"query": [], "variants": [], "runs": [], "moved": [],
+             "dropped": [], "previous": {}}
+
+    def query(line, reference=None):
+        calls["query"].append(line)
+        return fake_query(line, reference)
+
+    monkeypatch.setattr(staging, "query_variant", query)
+    monkeypatch.setattr(staging, "annotate_entry", fake_annotate)
+    monkeypatch.setattr(staging.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(staging, "start_annotation_run",
+                        lambda *args: calls["runs"].append(args) or
+                        len(calls["runs"]))
+    monkeypatch.setattr(staging, "finish_annotation_run", lambda *args: None)
+    monkeypatch.setattr(staging, "previous_associations",
+                        lambda source_file:
+                        set(calls["previous"].get(source_file, ())))
+    monkeypatch.setattr(staging, "move_variants",
+                        lambda links, run_id: calls["moved"].append(
+                            (sorted(links), run_id)) or len(links))
+    monkeypatch.setattr(staging, "drop_variants",
+                        lambda links, source_file: calls["dropped"].append(
+                            (sorted(links), source_file)) or len(links))
+    monkeypatch.setattr(json_to_db, "insert_patient_information",
+                        lambda data: None)
+    monkeypatch.setattr(json_to_db, "insert_variants",
+                        calls["variants"].append)
+    monkeypatch.setattr(json_to_db, "insert_clinvar", lambda data: None)
+    return processed, tmp_path / "staging.db", calls
+
+
+def test_stage_validator(store):
+    processed, database, calls = store
+    processed_file = processed / "patient1_test.txt"
+    processed_file.write_text("1-2-A-G\nbad-1-A-G\n")
+
+    assert staging.stage_validator(processed, database) == 2
+    # the file is fully staged and unchanged so it is not read again
+    assert staging.stage_validator(processed, database) == 0
+
+    processed_file.write_text("1-2-A-G\nbad-1-A-G\n1-5-C-T\n")
+    modified = processed_file.stat().st_mtime + 10
+    os.utime(processed_file, (modified, modified))
+    assert staging.stage_validator(processed, database) == 1
+    assert calls["query"] == ["1-2-A-G", "bad-1-A-G", "1-5-C-T"]
+
+
+def test_stage_clinvar_and_database(store):
+    processed, database, calls = store
+    (processed / "patient1_test.txt").write_text("1-2-A-G\nbad-1-A-G\n")
+    (processed / "cohort.txt").write_text("2-3-G-T\tp1,p2\n")
+
+    staging.stage_validator(processed, database)
+    assert staging.stage_clinvar(database) == 3
+    assert staging.stage_clinvar(database) == 0
+
+    # the variant with no g.HGVS has nothing to insert
+    con = connect_staging(database)
+    assert [row[:2] for row in pending(con, "database")] == [
+        ("cohort", "2-3-G-T"), ("patient1_test", "1-2-A-G")]
+    con.close()
+
+    assert staging.stage_database(database) == 3
+    assert staging.stage_database(database) == 0
+    assert [(v["patient_id"], v["variant_id"], v["run_id"])
+            for v in calls["variants"]] == [
+        ("p1", "2-3-G-T", 1), ("p2", "2-3-G-T", 1),
+        ("patient1", "1-2-A-G", 2)]
+    assert [run[:2] for run in calls["runs"]] == [
+        ("cohort", "cohort.json"), ("patient1", "patient1_test.json")]
+
+
+def test_failed_insert_stays_pending(store, monkeypatch):
+    processed, database, calls = store
+    (processed / "patient1_test.txt").write_text("1-2-A-G\n1-5-C-T\n")
+    staging.stage_validator(processed, database)
+    staging.stage_clinvar(database)
+
+    def failing_insert(data):
+        if data["variant_id"] == "1-2-A-G":
+            raise RuntimeError("database locked")
+        calls["variants"].append(data)
+
+    monkeypatch.setattr(json_to_db, "insert_variants", failing_insert)
+    assert staging.stage_database(database) == 1
+
+    monkeypatch.setattr(json_to_db, "insert_variants",
+                        calls["variants"].append)
+    assert staging.stage_database(database) == 1
+    assert [v["variant_id"] for v in calls["variants"]] == [
+        "1-5-C-T", "1-2-A-G"]
+
+
+def test_changed_file_moves_and_removes(store):
+    processed, database, calls = store
+    processed_file = processed / "patient1_test.txt"
+    processed_file.write_text("1-2-A-G\n1-5-C-T\n")
+    staging.run_staged_pipeline(processed, database)
+    assert calls["moved"] == [] and calls["dropped"] == []
+
+    # the file is overwritten, 1-5-C-T is taken out and 1-9-G-A added
+    calls["previous"]["patient1_test.json"] = [
+        "patient1 _ (1-2-A-G)", "patient1 _ (1-5-C-T)"]
+    processed_file.write_text("1-2-A-G\n1-9-G-A\n")
+    modified = processed_file.stat().st_mtime + 10
+    os.utime(processed_file, (modified, modified))
+
+    assert staging.stage_validator(processed, database) == 1
+    staging.stage_clinvar(database)
+    assert staging.stage_database(database) == 2
+    assert [v["variant_id"] for v in calls["variants"]] == [
+        "1-2-A-G", "1-5-C-T", "1-9-G-A"]
+    assert calls["moved"] == [(["patient1 _ (1-2-A-G)"], 2)]
+    assert calls["dropped"] == [(["patient1 _ (1-5-C-T)"],
+                                 "patient1_test.json")]
+
+    # taking a variant out is enough for a new run
+    calls["previous"]["patient1_test.json"] = [
+        "patient1 _ (1-2-A-G)", "patient1 _ (1-9-G-A)"]
+    processed_file.write_text("1-2-A-G\n")
+    os.utime(processed_file, (modified + 10, modified + 10))
+    assert staging.stage_validator(processed, database) == 0
+    assert staging.stage_database(database) == 1
+    assert len(calls["runs"]) == 3
+    assert calls["dropped"][-1] == (["patient1 _ (1-9-G-A)"],
+                                    "patient1_test.json")
+    assert staging.stage_database(database) == 0
+
+
+def test_done_flags_added(tmp_path):
+    database = tmp_path / "staging.db"
+    con = staging.sqlite3.connect(database)
+    con.executescript("""
+        CREATE TABLE stage_results (
+            file_stem TEXT NOT NULL,
+            variant TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            record TEXT,
+            PRIMARY KEY (file_stem, variant, stage)
+        ) WITHOUT ROWID;
+        CREATE INDEX idx_stage_results_stage
+            ON stage_results (stage, file_stem, variant);
+        CREATE TABLE staged_files (
+            file_stem TEXT PRIMARY KEY,
+            source_modified REAL
+        );
+        INSERT INTO stage_results VALUES
+            ('p1_test', '1-2-A-G', 'validator', '{}'),
+            ('p1_test', '1-2-A-G', 'clinvar', '{}'),
+            ('p1_test', '1-2-A-G', 'database', NULL),
+            ('p1_test', '1-5-C-T', 'validator', '{}');
+    """)
+    con.close()
+
+    con = connect_staging(database)
+    # the database stage is run again so it keeps the ids it links
+    assert [row[:2] for row in pending(con, "clinvar")] == [
+        ("p1_test", "1-5-C-T")]
+    assert [row[:2] for row in pending(con, "database")] == [
+        ("p1_test", "1-2-A-G")]
+    indexes = {row[1] for row in con.execute(
+        "PRAGMA index_list(stage_results)")}
+    assert "idx_stage_results_stage" not in indexes
+    con.close()
+
+
+def test_pending_uses_stage_index(tmp_path):
+    con = connect_staging(tmp_path / "staging.db")
+    # the plan of the query pending runs, for the clinvar stage
+    plan = " ".join(row[3] for row in con.execute(
+        "EXPLAIN QUERY PLAN " + staging.pending_sql,
+        ("validator", "", "", staging.STAGE_BATCH)))
+    con.close()
+
+    assert "idx_stage_results_pending" in plan
+    assert "TEMP B-TREE" not in plan
@@ -0,0 +1,52 @@
+from clinvar_query.modules.vcf_filters import failed_filter, non_reference
+
+"""This tests the VCF quality and genotype filters
+This looks at:
+Each filter on its own
+Rows without the QUAL, FILTER or sample columns
+Missing values when a minimum is set
+"""
+
+no_filters = {"pass_only": False, "min_qual": None, "min_depth": None,
+              "min_genotype_quality": None, "non_reference": False}
+
+
+def row(qual="50", vcf_filter="PASS", sample="0/1:30:99"):
+    return ["12", "40367069", ".", "A", "G", qual, vcf_filter, ".",
+            "GT:DP:GQ", sample]
+
+
+def test_pass_only():
+    filters = {**no_filters, "pass_only": True}
+
+    assert failed_filter(row(), filters) is None
+    assert failed_filter(row(vcf_filter="."), filters) is None
+    assert failed_filter(row(vcf_filter="LowQual"), filters) == "pass_only"
+
+
+def test_minimums():
+    filters = {**no_filters, "min_qual": 20, "min_depth": 10,
+               "min_genotype_quality": 20}
+
+    assert failed_filter(row(), filters) is None
+    assert failed_filter(row(qual="12"), filters) == "min_qual"
+    assert failed_filter(row(qual="."), filters) == "min_qual"
+    assert failed_filter(row(sample="0/1:8:99"), filters) == "min_depth"
+    assert failed_filter(row(sample="0/1:30:15"), filters) == \
+        "min_genotype_quality"
+
+
+def test_non_reference():
+    filters = {**no_filters, "non_reference": True}
+
+    assert failed_filter(row(sample="0|1:30:99"), filters) is None
+    assert failed_filter(row(sample="0/0:30:99"), filters) == "non_reference"
+    assert failed_filter(row(sample="./.:.:."), filters) == "non_reference"
+    assert non_reference("1") and not non_reference(".")
+
+
+def test_sites_only_rows():
+    filters = {**no_filters, "pass_only": True, "min_depth": 10,
+               "non_reference": True}
+
+    assert failed_filter(["12", "40367069", ".", "A", "G"], filters) is None
@@ -25,6 +25,7 @@ Notes:
 ===============================================================================
 """
 
+import gzip
 import json
 import pytest
 import os
@@ -33,6 +34,8 @@ from pathlib import Path
 
 # Import the module under test
 from clinvar_query.modules import vv_variant_query as module
+from clinvar_query.modules import response_projection as projection
+from clinvar_query.modules.json_records import read_records
 
 
 # -------------------------------------------------------------------
@@ -121,10 +124,159 @@ def test_successful_processing(tmp_path):
             output_file = tmp_path / "out" / "variants.json"
             assert output_file.exists()
 
-            data = json.loads(output_file.read_text())
+            data = list(read_records(output_file))
             assert len(data) == 2
-            assert data[0]["variant"] == "NM_0001.1:c.123A>G"
-            assert data[0]["result"] == {"ok": True}
+            assert data[0] == {"variant": "NM_0001.1:c.123A>G",
+                               "g_hgvs": None, "gene_info": None}
+
+
+# -------------------------------------------------------------------
+# Test: Only the fields used later are kept, raw responses archived
+# -------------------------------------------------------------------
+def test_projection_and_raw_archive(tmp_path):
+    """
+    Test that the g.HGVS and gene are written as a compact record,
+    and the full response goes to the raw archive when it is on.
+    """
+    input_file = tmp_path / "variants.txt"
+    input_file.write_text("12-40367069-A-G\n")
+    raw = {
+        "12-40367069-A-G": {
+            "12-40367069-A-G": {
+                "g_hgvs": "NC_000012.12:g.40367069A>G",
+                "hgvs_t_and_p": {
+                    "NM_198578.4": {
+                        "gene_info": {"hgnc_id": "HGNC:18618",
+                                      "symbol": "LRRK2"},
+                        "t_hgvs": "NM_198578.4:c.-31A>G",
+                    }
+                },
+            }
+        },
+        "flag": "gene_variant",
+    }
+
+    with patch.object(module, "input_file_pattern", str(input_file)), \
+         patch.object(module, "output_folder", str(tmp_path / "out")), \
+         patch("glob.glob", return_value=[str(input_file)]), \
+         patch.object(projection, "archive_raw_responses", True), \
+         patch.object(projection, "raw_archive_folder", tmp_path / "raw"):
+
+        mock_resp = MagicMock()
+        mock_resp.status_code = 200
+        mock_resp.json.return_value = raw
+
+        with patch("requests.get", return_value=mock_resp):
+            module.vv_variant_query()
+
+    data = list(read_records(tmp_path / "out" / "variants.json"))
+    assert data == [{"variant": "12-40367069-A-G",
+                     "g_hgvs": "NC_000012.12:g.40367069A>G",
+                     "gene_info": {"hgnc_id": "HGNC:18618",
+                                   "symbol": "LRRK2"}}]
+
+    with gzip.open(tmp_path / "raw" / "validator" / "variants.jsonl.gz",
+                   "rt") as archive:
+        assert json.loads(archive.readline()) == {
+            "variant": "12-40367069-A-G", "response": raw}
+
+
+# -------------------------------------------------------------------
+# Test: Lines from multi-sample files keep their samples
+# -------------------------------------------------------------------
+def test_multi_sample_processing(tmp_path):
+    """
+    Test that the variant is queried without its samples, and the
+    samples are written alongside the result.
+    """
+    input_file = tmp_path / "cohort_processed.txt"
+    input_file.write_text("12-40367069-A-G\tpatient1,patient3\n")
+
+    with patch.object(module, "input_file_pattern", str(input_file)), \
+         patch.object(module, "output_folder", str(tmp_path / "out")), \
+         patch("glob.glob", return_value=[str(input_file)]):
+
+        mock_resp = MagicMock()
+        mock_resp.status_code = 200
+        mock_resp.json.return_value = {"ok": True}
+
+        with patch("requests.get", return_value=mock_resp) as mock_get:
+            module.vv_variant_query()
+
+            assert "/12-40367069-A-G/" in mock_get.call_args[0][0]
+
+            output_file = tmp_path / "out" / "cohort_processed.json"
+            data = list(read_records(output_file))
+            assert data == [{"variant": "12-40367069-A-G",
+                             "g_hgvs": None, "gene_info": None,
+                             "samples": ["patient1", "patient3"]}]
+
+
+# -------------------------------------------------------------------
+# Test: A shared session is used and repeated variants queried once
+# -------------------------------------------------------------------
+def test_shared_session_and_cache(tmp_path):
+    """
+    Test that a batch session is used for the queries and a variant in
+    more than one file is only queried once.
+    """
+    files = []
+    for name, samples in [("p1", "12-40367069-A-G\n1-2-A-G\n"),
+                          ("p2", "12-40367069-A-G\n")]:
+        input_file = tmp_path / f"{name}_processed.txt"
+        input_file.write_text(samples)
+        files.append(str(input_file))
+
+    session = MagicMock()
+    session.get.return_value.status_code = 200
+    session.get.return_value.json.return_value = {"ok": True}
+
+    with patch.object(module, "output_folder", str(tmp_path / "out")), \
+         patch("glob.glob", return_value=files), \
+         patch("requests.get") as mock_get:
+        module.vv_variant_query(session=session)
+
+    mock_get.assert_not_called()
+    assert session.get.call_count == 2
+    assert list(read_records(tmp_path / "out" / "p2_processed.json")) == \
+        [{"variant": "12-40367069-A-G", "g_hgvs": None, "gene_info": None}]
+
+
+# -------------------------------------------------------------------
+# Test: Simple variants are described locally from a reference FASTA
+# -------------------------------------------------------------------
+def test_local_hgvs(tmp_path):
+    """
+    Test that a variant the local engine can describe is not sent to
+    the API, and one it cannot describe still is.
+    """
+    fasta = tmp_path / "reference.fa"
+    fasta.write_text(">chr1\nGATTACAGAT\n")
+    input_file = tmp_path / "variants.txt"
+    input_file.write_text("1-2-A-G\n1-2-C-G\n")
+
+    with patch.object(module, "input_file_pattern", str(input_file)), \
+         patch.object(module, "output_folder", str(tmp_path / "out")), \
+         patch.object(module, "reference_fasta", str(fasta)), \
+         patch("glob.glob", return_value=[str(input_file)]):
+
+        mock_resp = MagicMock()
+        mock_resp.status_code = 200
+        mock_resp.json.return_value = {"ok": True}
+
+        with patch("requests.get", return_value=mock_resp) as mock_get:
+            module.vv_variant_query()
+
+            # only the variant whose REF does not match goes to the API
+            assert mock_get.call_count == 1
+            assert "/1-2-C-G/" in mock_get.call_args[0][0]
+
+            data = list(read_records(tmp_path / "out" / "variants.json"))
+            assert data[0] == {"variant": "1-2-A-G",
+                               "g_hgvs": "NC_000001.11:g.2A>G",
+                               "source": "local"}
+            assert data[1]["variant"] == "1-2-C-G"
+            assert "source" not in data[1]
 
 
 # -------------------------------------------------------------------
@@ -152,7 +304,7 @@ def test_api_failure(tmp_path):
             output_file = tmp_path / "out" / "variants.json"
             assert output_file.exists()
 
-            data = json.loads(output_file.read_text())
+            data = list(read_records(output_file))
             # The error field should indicate the status code
             assert "error" in data[0]
             assert "(404)" in data[0]["error"]
@@ -180,7 +332,7 @@ def test_api_exception(tmp_path):
             output_file = tmp_path / "out" / "variants.json"
             assert output_file.exists()
 
-            data = json.loads(output_file.read_text())
+            data = list(read_records(output_file))
             assert "Exception during request" in data[0]["error"]
 
 
@@ -201,8 +353,12 @@ def test_json_write_failure(tmp_path):
          patch("glob.glob", return_value=[str(input_file)]), \
          patch("requests.get", return_value=MagicMock(
              status_code=200, json=lambda: {"ok": True})), \
-         patch("json.dump", side_effect=Exception("write error")):
+         patch.object(module, "write_record",
+                      side_effect=Exception("write error")):
 
         module.vv_variant_query()
         # Test passes if exception is caught and logged
 
+    # the unfinished output is removed so the file is queried again
+    assert list((tmp_path / "out").iterdir()) == []
+